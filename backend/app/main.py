@@ -1,18 +1,33 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import asyncio
+import json
 import logging
+from contextlib import aclosing
 from typing import Dict, Any, Optional, List
 import uuid
 import os
-from datetime import datetime
+import socket
+import time
+import aiofiles
 
-from services.document_service import DocumentService
 from services.vector_service import VectorService
 from services.chat_service import ChatService
-from models.schemas import ChatRequest, ChatResponse, DocumentResponse
+from services.job_queue import FINAL_EVENTS, JobQueue, JobRunner
+from services.job_events import JobEventHub
+from services.ingestion import IngestionPipeline
+from services.answer_cache import AnswerCache, scope_key
+from models.schemas import (
+    ChatRequest, ChatResponse, DocumentResponse,
+    BatchSearchRequest, BatchChatRequest, BatchChatResult, BatchChatResponse
+)
 from utils.config import get_settings
+from utils.metrics import (
+    BYTES, HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, REGISTRY,
+    request_timings, server_timing, stats_family
+)
 
 # Configuração
 settings = get_settings()
@@ -33,45 +48,161 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Rota (template do path) de cada endpoint, para não criar uma série por id
+route_paths: Dict[Any, str] = {}
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Duração de cada requisição por rota e, com TIMING_HEADERS, o header Server-Timing.
+    
+    Em respostas em streaming a duração vai até o início da resposta.
+    """
+    timings = [] if settings.timing_headers else None
+    token = request_timings.set(timings)
+    HTTP_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if timings is not None:
+            response.headers["Server-Timing"] = server_timing(timings, time.perf_counter() - start)
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        request_timings.reset(token)
+        endpoint = request.scope.get("endpoint")
+        if endpoint is not None and endpoint not in route_paths:
+            route_paths.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+            route_paths.setdefault(endpoint, "unmatched")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route_paths.get(endpoint, "unmatched"),
+            status=str(status)
+        )
+
 # Serviços
-document_service = DocumentService()
 vector_service = VectorService()
 chat_service = ChatService()
 
-# Armazenamento de jobs em processamento
-processing_jobs: Dict[str, Dict[str, Any]] = {}
+# Cache semântico de respostas, invalidado quando um documento muda
+answer_cache = None
+if settings.answer_cache_enabled:
+    answer_cache = AnswerCache(
+        vector_service.embedding_dim,
+        threshold=settings.answer_cache_threshold,
+        ttl=settings.answer_cache_ttl,
+        max_entries=settings.answer_cache_max_entries
+    )
+    vector_service.add_document_listener(answer_cache.invalidate_documents)
+
+# Fila durável de jobs de ingestão: download, extração e embeddings rodam
+# nos workers (worker.py); a indexação roda aqui, no dono do índice
+job_queue = JobQueue(
+    settings.jobs_db_path,
+    settings.jobs_spool_dir,
+    max_attempts=settings.jobs_max_attempts,
+    retry_base=settings.jobs_retry_base_seconds
+)
+ingestion_pipeline = IngestionPipeline(job_queue, vector_service=vector_service)
+index_runner = JobRunner(
+    job_queue,
+    {"index": (ingestion_pipeline.index, 1)},
+    worker_id=f"api-{socket.gethostname()}-{os.getpid()}",
+    poll_interval=settings.jobs_poll_interval,
+    stale_seconds=settings.jobs_stale_seconds,
+    finished_ttl=settings.jobs_finished_ttl
+)
+# Eventos dos jobs (de todos os processos) para /job-events e callbacks
+job_events = JobEventHub(
+    job_queue,
+    poll_interval=settings.jobs_events_poll_interval,
+    callback_timeout=settings.jobs_callback_timeout,
+    callback_retries=settings.jobs_callback_retries,
+    allowed_hosts=[host.strip() for host in settings.jobs_callback_allowed_hosts.split(",") if host.strip()]
+)
+
+def collect_metrics():
+    """Tamanho dos índices, catálogo, fila de jobs e caches, lidos na hora do scrape"""
+    index = vector_service.index_stats()
+    lexical = index.pop("lexical")
+    families = [
+        ("rag_index_vectors", "gauge", "Vetores no índice FAISS", [
+            ("rag_index_vectors", {"state": "live"}, index["live_vectors"]),
+            ("rag_index_vectors", {"state": "dead"}, index["dead_vectors"])
+        ]),
+        ("rag_index_vector_bytes", "gauge", "Tamanho estimado dos vetores do índice (float32, sem compressão)", [
+            ("rag_index_vector_bytes", {}, index["ntotal"] * vector_service.embedding_dim * 4)
+        ]),
+        ("rag_documents", "gauge", "Documentos no catálogo", [
+            ("rag_documents", {}, vector_service.catalog.count())
+        ]),
+        ("rag_jobs", "gauge", "Jobs de ingestão por status (e etapa, quando em processamento)", [
+            ("rag_jobs", {"status": key}, count) for key, count in job_queue.counts().items()
+        ]),
+        stats_family("rag_job_events_stats", "Assinantes e callbacks de eventos de jobs", job_events.stats()),
+        stats_family("rag_index_stats", "Contadores do índice FAISS", index),
+        stats_family("rag_lexical_index_stats", "Contadores do índice léxico", lexical)
+    ]
+    embeddings = vector_service.embedding_stats()
+    families.append(stats_family("rag_embedding_cache_stats", "Cache de embeddings", embeddings["cache"]))
+    families.append(stats_family("rag_embedding_scheduler_stats", "Agendador de embeddings", embeddings["scheduler"]))
+    if answer_cache is not None:
+        families.append(stats_family("rag_answer_cache_stats", "Cache de respostas", answer_cache.stats()))
+    return families
+
+REGISTRY.register_collector(collect_metrics)
+
+@app.on_event("startup")
+async def startup_event():
+    """Inicia a indexação dos jobs vindos dos workers e a entrega dos eventos"""
+    index_runner.start()
+    await job_events.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Persiste o índice vetorial ao encerrar"""
+    await index_runner.stop()
+    await job_events.stop()
+    job_queue.close()
+    vector_service.close()
 
 @app.post("/process-document")
 async def process_document_from_n8n(
-    background_tasks: BackgroundTasks,
     file_url: str,
     filename: str,
-    file_id: str
+    file_id: str,
+    callback_url: Optional[str] = None
 ):
-    """Endpoint chamado pelo n8n para processar documentos"""
+    """Endpoint chamado pelo n8n para processar documentos.
+    
+    Com callback_url, cada evento do job (ver /job-events) é enviado por POST para essa URL
+    (apenas hosts públicos ou os de JOBS_CALLBACK_ALLOWED_HOSTS).
+    """
+    if callback_url:
+        try:
+            await job_events.check_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        job_id = str(uuid.uuid4())
-        
-        # Inicializar job
-        processing_jobs[job_id] = {
-            "status": "processing",
-            "filename": filename,
-            "file_id": file_id,
-            "started_at": datetime.now(),
-            "progress": 0
-        }
-        
-        # Processar em background
-        background_tasks.add_task(
-            process_document_background,
-            job_id, file_url, filename, file_id
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue,
+            "download",
+            {"file_url": file_url},
+            filename=filename,
+            file_id=file_id,
+            callback_url=callback_url
         )
         
         return {
             "status": "success",
             "job_id": job_id,
+            "events_url": f"/job-events/{job_id}",
             "message": "Document processing started"
         }
         
@@ -82,153 +213,329 @@ async def process_document_from_n8n(
             "error": str(e)
         }
 
-async def process_document_background(
-    job_id: str, file_url: str, filename: str, file_id: str
-):
-    """Processa documento em background"""
-    try:
-        # Atualizar progresso
-        processing_jobs[job_id]["progress"] = 10
-        
-        # Download do arquivo
-        content = await document_service.download_from_url(file_url)
-        processing_jobs[job_id]["progress"] = 30
-        
-        # Extrair texto
-        text, metadata = await document_service.extract_text(content, filename)
-        processing_jobs[job_id]["progress"] = 50
-        
-        # Gerar chunks
-        chunks = await document_service.create_chunks(text)
-        processing_jobs[job_id]["progress"] = 70
-        
-        # Gerar embeddings e armazenar
-        document_id = await vector_service.store_document(
-            chunks=chunks,
-            filename=filename,
-            original_text=text,
-            metadata=metadata
-        )
-        processing_jobs[job_id]["progress"] = 100
-        
-        # Finalizar job
-        processing_jobs[job_id].update({
-            "status": "completed",
-            "document_id": document_id,
-            "chunk_count": len(chunks),
-            "completed_at": datetime.now()
-        })
-        
-        logger.info(f"Documento {filename} processado com sucesso: {document_id}")
-        
-    except Exception as e:
-        logger.error(f"Erro no processamento background: {e}")
-        processing_jobs[job_id].update({
-            "status": "error",
-            "error": str(e),
-            "completed_at": datetime.now()
-        })
-
 @app.get("/job-status/{job_id}")
 async def get_job_status(job_id: str):
     """Consulta status de processamento"""
-    if job_id not in processing_jobs:
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job não encontrado")
     
-    return processing_jobs[job_id]
+    return job
+
+async def retrieve_context(request: ChatRequest):
+    """Embedding da pergunta e contexto relevante (o embedding também é a chave do cache de respostas)"""
+    query_embedding = await vector_service.embed_query(request.message)
+    context_docs = await vector_service.search_similar(
+        query=request.message,
+        top_k=settings.chat_context_candidates,
+        file_ids=request.context_file_ids,
+        nprobe=request.nprobe,
+        ef_search=request.ef_search,
+        query_embedding=query_embedding,
+        mode=request.search_mode
+    )
+    return query_embedding, context_docs
+
+def cached_answer(request: ChatRequest, query_embedding, context_docs) -> Optional[Dict[str, Any]]:
+    if answer_cache is None:
+        return None
+    return answer_cache.lookup(
+        query_embedding,
+        [doc["id"] for doc in context_docs],
+        scope_key(request.context_file_ids, request.history)
+    )
+
+def cache_answer(request: ChatRequest, query_embedding, context_docs, response: Dict[str, Any]):
+    if answer_cache is not None:
+        # A contagem de tokens é da requisição que gerou a resposta
+        answer_cache.store(
+            query_embedding,
+            [doc["id"] for doc in context_docs],
+            scope_key(request.context_file_ids, request.history),
+            {key: value for key, value in response.items() if key != "usage"}
+        )
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """Endpoint de chat melhorado"""
     try:
         # Buscar contexto relevante
-        context_docs = await vector_service.search_similar(
-            query=request.message,
-            top_k=5,
-            file_ids=request.context_file_ids
-        )
+        query_embedding, context_docs = await retrieve_context(request)
         
-        # Gerar resposta
-        response = await chat_service.generate_response(
-            message=request.message,
-            context_docs=context_docs,
-            conversation_history=request.history
-        )
+        # Gerar resposta (ou reaproveitar a de uma pergunta equivalente)
+        response = cached_answer(request, query_embedding, context_docs)
+        if response is None:
+            response = await chat_service.generate_response(
+                message=request.message,
+                context_docs=context_docs,
+                conversation_history=request.history
+            )
+            cache_answer(request, query_embedding, context_docs, response)
         
         return ChatResponse(
             response=response["text"],
             sources=response["sources"],
-            context_used=len(context_docs) > 0
+            context_used=len(context_docs) > 0,
+            usage=response.get("usage")
+        )
+        
+    except Exception as e:
+        logger.error(f"Erro no chat: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def check_batch_size(size: int):
+    if size > settings.batch_max_queries:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Lote com mais de {settings.batch_max_queries} consultas"
+        )
+
+@app.post("/search/batch")
+async def search_batch_endpoint(request: BatchSearchRequest):
+    """Busca várias queries de uma vez (um embedding em lote, uma busca matricial no FAISS)"""
+    check_batch_size(len(request.queries))
+    try:
+        results = await vector_service.search_batch(
+            request.queries,
+            top_k=request.top_k,
+            file_ids=request.context_file_ids,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            mode=request.search_mode
+        )
+        return {"results": results}
+        
+    except Exception as e:
+        logger.error(f"Erro na busca em lote: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """Chat para várias perguntas: recuperação em lote e completions com concorrência limitada"""
+    check_batch_size(len(request.messages))
+    try:
+        query_embeddings = await vector_service.embed_queries(request.messages)
+        contexts = await vector_service.search_batch(
+            request.messages,
+            top_k=settings.chat_context_candidates,
+            file_ids=request.context_file_ids,
+            nprobe=request.nprobe,
+            ef_search=request.ef_search,
+            query_embeddings=query_embeddings,
+            mode=request.search_mode
+        )
+    except Exception as e:
+        logger.error(f"Erro no chat em lote: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    semaphore = asyncio.Semaphore(settings.chat_batch_concurrency)
+    
+    async def answer(message: str, query_embedding, context_docs) -> BatchChatResult:
+        chat_request = ChatRequest(
+            message=message,
+            context_file_ids=request.context_file_ids,
+            history=request.history
         )
+        try:
+            response = cached_answer(chat_request, query_embedding, context_docs)
+            if response is None:
+                async with semaphore:
+                    response = await chat_service.generate_response(
+                        message=message,
+                        context_docs=context_docs,
+                        conversation_history=request.history
+                    )
+                cache_answer(chat_request, query_embedding, context_docs, response)
+        except Exception as e:
+            # Uma pergunta com erro não derruba o lote
+            return BatchChatResult(error=str(e))
         
+        return BatchChatResult(
+            response=response["text"],
+            sources=response["sources"],
+            context_used=len(context_docs) > 0,
+            usage=response.get("usage")
+        )
+    
+    results = await asyncio.gather(*(
+        answer(message, query_embedding, context_docs)
+        for message, query_embedding, context_docs in zip(request.messages, query_embeddings, contexts)
+    ))
+    return BatchChatResponse(results=results)
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Formata um server-sent event com payload JSON (event_id permite retomar com Last-Event-ID)"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/job-events/{job_id}")
+async def job_events_endpoint(job_id: str, http_request: Request, after: int = 0):
+    """Eventos do job em SSE, do início (ou depois de after/Last-Event-ID) até completed ou failed.
+    
+    Cada evento (queued, stage_started, stage_completed, stage_failed,
+    stage_requeued, completed, failed) traz etapa, duração e contagens em data.
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    last_event_id = http_request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    
+    async def events():
+        # Assina antes de ler o histórico: nada se perde entre os dois
+        live = job_events.subscribe(job_id)
+        last = after
+        try:
+            for event in await asyncio.to_thread(job_queue.events, job_id, after):
+                last = event["seq"]
+                yield sse_event(event["event"], {**event["data"], "created_at": event["created_at"]}, last)
+                if event["event"] in FINAL_EVENTS:
+                    return
+            # Retomada depois do evento final: não há mais o que enviar
+            if job["status"] != "processing":
+                return
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(live.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        return
+                    # Comentário SSE mantém a conexão viva em proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                if event["seq"] <= last:
+                    continue
+                last = event["seq"]
+                yield sse_event(event["event"], {**event["data"], "created_at": event["created_at"]}, last)
+                if event["event"] in FINAL_EVENTS:
+                    return
+        finally:
+            job_events.unsubscribe(job_id, live)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Chat em streaming (SSE): evento sources, eventos token e evento done"""
+    try:
+        query_embedding, context_docs = await retrieve_context(request)
     except Exception as e:
         logger.error(f"Erro no chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        prompt = chat_service.build_prompt(request.message, context_docs, request.history)
+        sources = chat_service.build_sources(prompt.context_docs)
+        yield sse_event("sources", {
+            "sources": sources,
+            "context_used": len(context_docs) > 0
+        })
+        
+        cached = cached_answer(request, query_embedding, context_docs)
+        if cached is not None:
+            yield sse_event("token", {"text": cached["text"]})
+            yield sse_event("done", {"cached": True})
+            return
+        
+        parts = []
+        try:
+            async with aclosing(chat_service.stream_response(
+                message=request.message,
+                context_docs=context_docs,
+                conversation_history=request.history,
+                prompt=prompt
+            )) as tokens:
+                async for text in tokens:
+                    # Cliente foi embora: parar de gerar (e de pagar) a resposta
+                    if await http_request.is_disconnected():
+                        logger.info("Cliente desconectou; geração interrompida")
+                        return
+                    parts.append(text)
+                    yield sse_event("token", {"text": text})
+        except Exception as e:
+            logger.error(f"Erro no chat em streaming: {e}")
+            yield sse_event("error", {"detail": str(e)})
+            return
+        
+        # Só respostas completas entram no cache
+        cache_answer(request, query_embedding, context_docs, {"text": "".join(parts), "sources": sources})
+        yield sse_event("done", {"cached": False, "usage": prompt.usage()})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/upload-direct")
 async def upload_direct(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...)
 ):
     """Upload direto (sem n8n) para testes"""
     try:
-        content = await file.read()
         job_id = str(uuid.uuid4())
         
-        processing_jobs[job_id] = {
-            "status": "processing",
-            "filename": file.filename,
-            "started_at": datetime.now(),
-            "progress": 0
-        }
+        # O arquivo vai em blocos para o spool do job e a fila começa pela extração
+        source_file = "source" + os.path.splitext(file.filename or "")[1]
+        source_path = os.path.join(job_queue.spool_dir(job_id), source_file)
+        max_bytes = settings.max_file_size_mb * 1024 * 1024
+        size = 0
+        async with aiofiles.open(source_path, "wb") as f:
+            while block := await file.read(settings.download_chunk_size):
+                size += len(block)
+                if size > max_bytes:
+                    job_queue.remove_spool(job_id)
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Arquivo maior que {settings.max_file_size_mb} MB"
+                    )
+                await f.write(block)
+        BYTES.inc(size, source="upload")
         
-        background_tasks.add_task(
-            process_direct_upload,
-            job_id, content, file.filename
+        await asyncio.to_thread(
+            job_queue.enqueue,
+            "extract",
+            {"source_file": source_file},
+            filename=file.filename,
+            job_id=job_id
         )
         
         return {"job_id": job_id, "status": "processing"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def process_direct_upload(job_id: str, content: bytes, filename: str):
-    """Processa upload direto"""
+@app.get("/documents")
+async def list_documents(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    filename: Optional[str] = None,
+    file_id: Optional[str] = None
+):
+    """Lista documentos processados, paginado: o cursor da próxima página vem no header X-Next-Cursor"""
     try:
-        processing_jobs[job_id]["progress"] = 20
-        
-        text, metadata = await document_service.extract_text(content, filename)
-        processing_jobs[job_id]["progress"] = 50
-        
-        chunks = await document_service.create_chunks(text)
-        processing_jobs[job_id]["progress"] = 80
-        
-        document_id = await vector_service.store_document(
-            chunks=chunks,
+        documents, next_cursor = await vector_service.list_documents(
+            limit=limit,
+            cursor=cursor,
+            status=status,
             filename=filename,
-            original_text=text,
-            metadata=metadata
+            file_id=file_id
         )
-        
-        processing_jobs[job_id].update({
-            "status": "completed",
-            "document_id": document_id,
-            "chunk_count": len(chunks),
-            "progress": 100,
-            "completed_at": datetime.now()
-        })
-        
-    except Exception as e:
-        processing_jobs[job_id].update({
-            "status": "error",
-            "error": str(e),
-            "completed_at": datetime.now()
-        })
-
-@app.get("/documents")
-async def list_documents():
-    """Lista documentos processados"""
-    return await vector_service.list_documents()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
 
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
@@ -238,6 +545,92 @@ async def delete_document(document_id: str):
         raise HTTPException(status_code=404, detail="Documento não encontrado")
     return {"message": "Documento removido com sucesso"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas no formato texto do Prometheus"""
+    return PlainTextResponse(
+        await asyncio.to_thread(REGISTRY.render),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/admin/index")
+async def index_stats():
+    """Estado do índice vetorial"""
+    return await asyncio.to_thread(vector_service.index_stats)
+
+@app.get("/admin/jobs")
+async def job_counts():
+    """Jobs de ingestão por status e etapa"""
+    return await asyncio.to_thread(job_queue.counts)
+
+@app.get("/admin/answer-cache")
+async def answer_cache_stats():
+    """Taxa de acerto e tamanho do cache de respostas"""
+    if answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **answer_cache.stats()}
+
+@app.get("/admin/embeddings")
+async def embedding_stats():
+    """Cache de embeddings (hits, misses, tamanho) e vazão do agendador"""
+    return await asyncio.to_thread(vector_service.embedding_stats)
+
+@app.post("/admin/index/retrain")
+async def retrain_index():
+    """Re-treina/migra o índice vetorial para o tipo configurado"""
+    started = await asyncio.to_thread(vector_service.retrain_index)
+    return {"started": started, **await asyncio.to_thread(vector_service.index_stats)}
+
+@app.post("/admin/index/compact")
+async def compact_index():
+    """Compacta o índice vetorial removendo os vetores de documentos apagados"""
+    started = await asyncio.to_thread(vector_service.compact_index)
+    return {"started": started, **await asyncio.to_thread(vector_service.index_stats)}
+
+def snapshot_path(name: str) -> str:
+    """Caminho do snapshot dentro de CORPUS_SNAPSHOT_DIR (nome simples, sem diretórios)"""
+    if not name or name != os.path.basename(name) or name.startswith(".") or name.endswith(".partial"):
+        raise HTTPException(status_code=400, detail="Nome de snapshot inválido")
+    return os.path.join(settings.corpus_snapshot_dir, name)
+
+@app.get("/admin/snapshots")
+async def list_snapshots():
+    """Snapshots do corpus disponíveis (manifest de cada um)"""
+    def manifests():
+        if not os.path.isdir(settings.corpus_snapshot_dir):
+            return []
+        result = []
+        for name in sorted(os.listdir(settings.corpus_snapshot_dir)):
+            path = os.path.join(settings.corpus_snapshot_dir, name, "manifest.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as fh:
+                    result.append({"name": name, **json.load(fh)})
+        return result
+    
+    return await asyncio.to_thread(manifests)
+
+@app.post("/admin/snapshots")
+async def export_snapshot(name: Optional[str] = None):
+    """Exporta o corpus (chunks, embeddings e catálogo) para CORPUS_SNAPSHOT_DIR/name"""
+    path = snapshot_path(name or time.strftime("corpus-%Y%m%d-%H%M%S"))
+    os.makedirs(settings.corpus_snapshot_dir, exist_ok=True)
+    try:
+        manifest = await vector_service.export_corpus(path)
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"name": os.path.basename(path), **manifest}
+
+@app.post("/admin/snapshots/{name}/import")
+async def import_snapshot(name: str):
+    """Importa um snapshot do corpus, sem gerar embeddings"""
+    path = snapshot_path(name)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail="Snapshot não encontrado")
+    try:
+        return await vector_service.import_corpus(path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,15 +1,45 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 
 class ChatRequest(BaseModel):
     message: str
     context_file_ids: Optional[List[str]] = None
     history: Optional[List[Dict[str, str]]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    search_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
 
 class ChatResponse(BaseModel):
     response: str
     sources: List[Dict[str, Any]]
     context_used: bool
+    usage: Optional[Dict[str, Optional[int]]] = None  # tokens do prompt; ausente em respostas do cache
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    context_file_ids: Optional[List[str]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    search_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    context_file_ids: Optional[List[str]] = None
+    history: Optional[List[Dict[str, str]]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    search_mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+
+class BatchChatResult(BaseModel):
+    response: Optional[str] = None
+    sources: List[Dict[str, Any]] = []
+    context_used: bool = False
+    usage: Optional[Dict[str, Optional[int]]] = None
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatResult]
 
 class DocumentResponse(BaseModel):
     id: str
@@ -21,7 +51,14 @@ class DocumentResponse(BaseModel):
 class JobStatus(BaseModel):
     job_id: str
     status: str
+    stage: Optional[str] = None
     progress: int
     filename: Optional[str] = None
     document_id: Optional[str] = None
+    chunk_count: Optional[int] = None
+    chunks_new: Optional[int] = None
+    chunks_reused: Optional[int] = None
+    chunks_removed: Optional[int] = None
+    unchanged: Optional[bool] = None
+    attempts: int = 0
     error: Optional[str] = None
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+from services.id_map import document_id_of
+
+
+@dataclass
+class _Entry:
+    slot: int
+    chunk_ids: FrozenSet[str]
+    scope: str
+    answer: Dict[str, Any]
+    expires_at: float
+
+
+def scope_key(file_ids: Optional[List[str]], history: Optional[List[Dict[str, str]]]) -> str:
+    """Chave do que, além da pergunta, determina a resposta: filtro de arquivos e histórico"""
+    payload = json.dumps([sorted(file_ids or []), history or []], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Cache semântico de respostas do chat.
+    
+    Uma resposta é reaproveitada quando a pergunta nova tem similaridade de
+    cosseno acima de threshold com uma já respondida, com o mesmo conjunto
+    de chunks recuperados e o mesmo escopo (context_file_ids e histórico).
+    Os embeddings das perguntas ficam numa matriz normalizada de
+    max_entries linhas, comparada inteira a cada consulta. Entradas
+    expiram após ttl segundos, as menos usadas saem quando o cache enche
+    e as que citam um documento removido ou reindexado são invalidadas.
+    """
+    
+    def __init__(self, dim: int, threshold: float = 0.97, ttl: float = 3600.0, max_entries: int = 5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((max_entries, dim), dtype="float32")
+        self.entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _drop(self, slot: int) -> None:
+        del self.entries[slot]
+        self.vectors[slot] = 0
+        self.free_slots.append(slot)
+    
+    def lookup(self, embedding: np.ndarray, chunk_ids: Iterable[str], scope: str) -> Optional[Dict[str, Any]]:
+        """Resposta em cache para a pergunta, ou None"""
+        query = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        now = time.time()
+        
+        with self.lock:
+            if self.entries:
+                similarities = self.vectors @ query
+                candidates = np.flatnonzero(similarities >= self.threshold)
+                for slot in candidates[np.argsort(-similarities[candidates])]:
+                    entry = self.entries.get(int(slot))
+                    if entry is None:
+                        continue
+                    if entry.expires_at < now:
+                        self._drop(entry.slot)
+                        self.counters["expirations"] += 1
+                        continue
+                    if entry.scope == scope and entry.chunk_ids == chunk_ids:
+                        self.entries.move_to_end(entry.slot)
+                        self.counters["hits"] += 1
+                        return entry.answer
+            
+            self.counters["misses"] += 1
+            return None
+    
+    def store(self, embedding: np.ndarray, chunk_ids: Iterable[str], scope: str, answer: Dict[str, Any]) -> None:
+        with self.lock:
+            if not self.free_slots:
+                # Menos usada recentemente
+                slot = next(iter(self.entries))
+                self._drop(slot)
+                self.counters["evictions"] += 1
+            
+            slot = self.free_slots.pop()
+            self.vectors[slot] = self._normalize(embedding)
+            self.entries[slot] = _Entry(slot, frozenset(chunk_ids), scope, answer, time.time() + self.ttl)
+            self.counters["stores"] += 1
+    
+    def invalidate_documents(self, document_ids: Iterable[str]) -> int:
+        """Remove respostas baseadas em chunks dos documentos"""
+        document_ids = set(document_ids)
+        with self.lock:
+            stale = [
+                slot for slot, entry in self.entries.items()
+                if any(document_id_of(chunk_id) in document_ids for chunk_id in entry.chunk_ids)
+            ]
+            for slot in stale:
+                self._drop(slot)
+            self.counters["invalidations"] += len(stale)
+        return len(stale)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold
+            }
@@ -1,93 +1,136 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from openai import AsyncOpenAI
 import logging
+from services.context_builder import ChatPrompt, ContextBuilder
 from utils.config import get_settings
+from utils.metrics import PROMPT_TOKENS, TOKENS, stage_timer
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+SYSTEM_PROMPT = """Você é um assistente especializado em análise de documentos para pentesting e investigação forense.
+
+Responda às perguntas com base no contexto fornecido dos documentos.
+Se a informação não estiver no contexto, diga que não pode responder com base nos documentos disponíveis.
+Sempre cite as fontes quando possível.
+Seja preciso e técnico nas respostas relacionadas a segurança."""
+
 class ChatService:
     def __init__(self):
-        self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
+        self.openai_client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None
+        )
+        self.context_builder = ContextBuilder(
+            model=settings.chat_model,
+            system_prompt=SYSTEM_PROMPT,
+            max_prompt_tokens=settings.chat_prompt_max_tokens,
+            history_tokens=settings.chat_history_max_tokens,
+            summary_tokens=settings.chat_history_summary_tokens,
+            mmr_lambda=settings.chat_mmr_lambda,
+            duplicate_threshold=settings.chat_duplicate_threshold,
+            min_chunk_tokens=settings.chat_min_chunk_tokens
+        )
     
-    async def generate_response(
+    def build_prompt(
         self,
         message: str,
         context_docs: List[Dict[str, Any]],
         conversation_history: Optional[List[Dict[str, str]]] = None
+    ) -> ChatPrompt:
+        """Mensagens para a OpenAI dentro do orçamento de tokens (ver ContextBuilder)"""
+        with stage_timer("context_assembly"):
+            prompt = self.context_builder.build(message, context_docs, conversation_history)
+        
+        PROMPT_TOKENS.observe(prompt.prompt_tokens, part="total")
+        PROMPT_TOKENS.observe(prompt.context_tokens, part="context")
+        PROMPT_TOKENS.observe(prompt.history_tokens, part="history")
+        logger.info(
+            f"Prompt com {prompt.prompt_tokens} tokens ({len(prompt.context_docs)} chunks, "
+            f"{prompt.dropped_docs} descartados, {prompt.summarized_turns} turnos resumidos)"
+        )
+        return prompt
+    
+    async def generate_response(
+        self,
+        message: str,
+        context_docs: List[Dict[str, Any]],
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        prompt: Optional[ChatPrompt] = None
     ) -> Dict[str, Any]:
         """Gera resposta usando OpenAI"""
         try:
-            # Preparar contexto
-            context = self._prepare_context(context_docs)
-            
-            # Preparar mensagens
-            messages = self._prepare_messages(message, context, conversation_history)
+            # Preparar mensagens (contexto e histórico no orçamento)
+            prompt = prompt or self.build_prompt(message, context_docs, conversation_history)
             
             # Gerar resposta
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                temperature=0.3,
-                max_tokens=1500
-            )
+            with stage_timer("completion"):
+                response = await self.openai_client.chat.completions.create(
+                    model=settings.chat_model,
+                    messages=prompt.messages,
+                    temperature=0.3,
+                    max_tokens=1500
+                )
             
             response_text = response.choices[0].message.content
-            
-            # Preparar fontes
-            sources = [
-                {
-                    "filename": doc["metadata"].get("filename", "Unknown"),
-                    "chunk_index": doc["metadata"].get("chunk_index", 0),
-                    "score": doc.get("score", 0)
-                }
-                for doc in context_docs
-            ]
+            completion_tokens = self._count_usage(response)
             
             return {
                 "text": response_text,
-                "sources": sources
+                "sources": self.build_sources(prompt.context_docs),
+                "usage": {**prompt.usage(), "completion_tokens": completion_tokens}
             }
             
         except Exception as e:
             logger.error(f"Erro ao gerar resposta: {e}")
             raise
     
-    def _prepare_context(self, context_docs: List[Dict[str, Any]]) -> str:
-        """Prepara contexto dos documentos"""
-        if not context_docs:
-            return ""
-        
-        context_parts = []
-        for doc in context_docs:
-            filename = doc["metadata"].get("filename", "Unknown")
-            text = doc["text"]
-            context_parts.append(f"[{filename}]\n{text}")
-        
-        return "\n\n".join(context_parts)
-    
-    def _prepare_messages(
+    async def stream_response(
         self,
         message: str,
-        context: str,
-        conversation_history: Optional[List[Dict[str, str]]] = None
-    ) -> List[Dict[str, str]]:
-        """Prepara mensagens para OpenAI"""
-        system_prompt = """Você é um assistente especializado em análise de documentos para pentesting e investigação forense.
-
-Responda às perguntas com base no contexto fornecido dos documentos.
-Se a informação não estiver no contexto, diga que não pode responder com base nos documentos disponíveis.
-Sempre cite as fontes quando possível.
-Seja preciso e técnico nas respostas relacionadas a segurança."""
-
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Adicionar histórico da conversa
-        if conversation_history:
-            messages.extend(conversation_history[-10:])  # Últimas 10 mensagens
-        
-        # Adicionar contexto e pergunta atual
-        user_content = f"Contexto dos documentos:\n{context}\n\nPergunta: {message}" if context else message
-        messages.append({"role": "user", "content": user_content})
+        context_docs: List[Dict[str, Any]],
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        prompt: Optional[ChatPrompt] = None
+    ) -> AsyncIterator[str]:
+        """Gera resposta usando OpenAI em streaming, um trecho de texto por vez"""
+        prompt = prompt or self.build_prompt(message, context_docs, conversation_history)
         
-        return messages
+        # A etapa vai até o fim do stream (ou até o cliente desistir)
+        with stage_timer("completion"):
+            stream = await self.openai_client.chat.completions.create(
+                model=settings.chat_model,
+                messages=prompt.messages,
+                temperature=0.3,
+                max_tokens=1500,
+                stream=True
+            )
+            try:
+                async for chunk in stream:
+                    self._count_usage(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Fechar a conexão interrompe a geração quando o cliente desiste
+                await stream.response.aclose()
+    
+    @staticmethod
+    def _count_usage(response: Any) -> Optional[int]:
+        """Soma os tokens de prompt e de resposta informados pela API (retorna os de resposta)"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        TOKENS.inc(completion_tokens, kind="completion")
+        return completion_tokens
+    
+    def build_sources(self, context_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Prepara fontes"""
+        return [
+            {
+                "filename": doc["metadata"].get("filename", "Unknown"),
+                "chunk_index": doc["metadata"].get("chunk_index", 0),
+                "score": doc.get("score", 0)
+            }
+            for doc in context_docs
+        ]
@@ -0,0 +1,202 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from utils.tokens import get_encoding
+
+# Rótulos do Docling que abrem uma nova seção
+HEADING_LABELS = {"title", "section_header"}
+
+
+@dataclass
+class Chunk:
+    text: str
+    tokens: int
+    index: int
+    section: Optional[str] = None
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    
+    def metadata(self) -> Dict[str, Any]:
+        """Metadados do chunk para o vector store (sem valores vazios)"""
+        metadata = {
+            "chunk_index": self.index,
+            "token_count": self.tokens,
+            "section": self.section,
+            "page_start": self.page_start,
+            "page_end": self.page_end
+        }
+        return {key: value for key, value in metadata.items() if value is not None}
+
+
+@dataclass
+class _Window:
+    tokens: List[int] = field(default_factory=list)
+    fresh: int = 0  # tokens que não vieram do overlap do chunk anterior
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    
+    def add(self, tokens: List[int], page: Optional[int]) -> None:
+        self.tokens.extend(tokens)
+        self.fresh += len(tokens)
+        if page is not None:
+            self.page_start = page if self.page_start is None else min(self.page_start, page)
+            self.page_end = page if self.page_end is None else max(self.page_end, page)
+
+
+class TokenChunker:
+    """Empacota itens do Docling em chunks limitados em tokens.
+    
+    Consome os itens (dicts com text, label e page) como um iterador e
+    mantém em memória só a janela do chunk atual. Títulos fecham o chunk
+    em andamento, para que um chunk não misture seções; parágrafos que não
+    cabem no espaço restante vão para o próximo chunk, que começa com os
+    últimos overlap_tokens do anterior; itens maiores que um chunk são
+    cortados por tokens.
+    
+    Com length_function (o tamanho do texto no tokenizador de quem vai
+    receber o chunk, como o modelo de embeddings local), um chunk que passa
+    de max_length nessa medida é dividido no maior prefixo que cabe; o
+    restante, com o overlap, segue para o próximo chunk.
+    """
+    
+    def __init__(
+        self,
+        model: str,
+        chunk_tokens: int = 800,
+        overlap_tokens: int = 100,
+        length_function: Optional[Callable[[str], int]] = None,
+        max_length: Optional[int] = None
+    ):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens precisa ser menor que chunk_tokens")
+        if length_function is not None and max_length is None:
+            raise ValueError("length_function exige max_length")
+        self.encoding = get_encoding(model)
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.length_function = length_function
+        self.max_length = max_length
+    
+    def chunks(self, items: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        window = _Window()
+        section: Optional[str] = None
+        index = 0
+        
+        def flush() -> Iterator[Chunk]:
+            nonlocal window, index
+            tokens, tail = window.tokens, []
+            while True:
+                # Cada parte avança além do overlap que herdou
+                cut = self._fit(tokens, len(tail) + 1)
+                yield Chunk(
+                    text=self.encoding.decode(tokens[:cut]).strip(),
+                    tokens=cut,
+                    index=index,
+                    section=section,
+                    page_start=window.page_start,
+                    page_end=window.page_end
+                )
+                index += 1
+                tail = self._overlap(tokens[:cut])
+                if cut == len(tokens):
+                    break
+                tokens = tail + tokens[cut:]
+            window = _Window(tokens=list(tail), page_start=window.page_end, page_end=window.page_end)
+        
+        for item in items:
+            text = (item.get("text") or "").strip()
+            if not text:
+                continue
+            page = item.get("page")
+            
+            if item.get("label") in HEADING_LABELS:
+                if window.fresh:
+                    yield from flush()
+                # Nova seção não herda o final da anterior
+                window = _Window()
+                section = text
+            
+            tokens = self.encoding.encode(text + "\n", disallowed_special=())
+            while tokens:
+                room = self.chunk_tokens - len(window.tokens)
+                if len(tokens) <= room:
+                    window.add(tokens, page)
+                    break
+                if window.fresh and len(tokens) <= self.chunk_tokens - self.overlap_tokens:
+                    # Cabe inteiro no próximo chunk: não cortar o parágrafo
+                    yield from flush()
+                    continue
+                cut = self._char_boundary(tokens, room)
+                if not cut:
+                    # Nem um caractere inteiro cabe no espaço restante
+                    if window.fresh:
+                        yield from flush()
+                        continue
+                    # Janela só com o overlap: o caractere entra inteiro, passando do limite
+                    cut = room
+                    while cut < len(tokens) and self._continues_char(tokens[cut]):
+                        cut += 1
+                window.add(tokens[:cut], page)
+                tokens = tokens[cut:]
+                yield from flush()
+        
+        if window.fresh:
+            yield from flush()
+    
+    def _overlap(self, tokens: List[int]) -> List[int]:
+        """Últimos overlap_tokens do chunk, começando num caractere inteiro"""
+        if not self.overlap_tokens:
+            return []
+        start = max(len(tokens) - self.overlap_tokens, 0)
+        while start < len(tokens) and self._continues_char(tokens[start]):
+            start += 1
+        return tokens[start:]
+    
+    def _fits(self, tokens: List[int]) -> bool:
+        return self.length_function(self.encoding.decode(tokens).strip()) <= self.max_length
+    
+    def _fit(self, tokens: List[int], floor: int) -> int:
+        """Quantos tokens do início formam um chunk dentro de max_length.
+        
+        Busca binária pelo maior prefixo que cabe na medida de
+        length_function, terminando num caractere inteiro; nunca menos que
+        floor tokens, para que a divisão sempre avance.
+        """
+        if self.length_function is None or floor >= len(tokens) or self._fits(tokens):
+            return len(tokens)
+        low, high = floor, len(tokens) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._fits(tokens[:middle]):
+                low = middle
+            else:
+                high = middle - 1
+        cut = self._char_boundary(tokens, low)
+        if cut < floor:
+            # Nem o mínimo cabe: o caractere entra inteiro, passando do limite
+            cut = floor
+            while cut < len(tokens) and self._continues_char(tokens[cut]):
+                cut += 1
+        return cut
+    
+    def _continues_char(self, token: int) -> bool:
+        """O token começa no meio de um caractere UTF-8 (byte de continuação)"""
+        return self.encoding.decode_single_token_bytes(token)[0] & 0xC0 == 0x80
+    
+    def _char_boundary(self, tokens: List[int], cut: int) -> int:
+        """Ajusta o corte em tokens[:cut] para não partir um caractere multibyte.
+        
+        Cada chunk é decodificado sozinho: um caractere dividido entre dois
+        chunks viraria U+FFFD nos dois. Recua até o início do caractere;
+        retorna 0 se nenhum caractere inteiro cabe em cut tokens.
+        """
+        while cut > 0 and self._continues_char(tokens[cut]):
+            cut -= 1
+        return cut
+
+
+def text_items(text: str) -> Iterator[Dict[str, Any]]:
+    """Itens a partir de texto puro (um por linha), para quando não há estrutura do Docling"""
+    for line in text.splitlines():
+        if line.strip():
+            yield {"text": line, "label": "text"}
@@ -0,0 +1,231 @@
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from utils.tokens import get_encoding
+
+# Tokens que a API acrescenta por mensagem (papel e separadores) e para
+# iniciar a resposta do assistente
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+# Tamanho dos shingles (n-gramas de tokens) comparados entre chunks
+SHINGLE_TOKENS = 4
+
+
+@dataclass
+class ChatPrompt:
+    messages: List[Dict[str, str]]
+    context_docs: List[Dict[str, Any]]
+    prompt_tokens: int
+    context_tokens: int
+    history_tokens: int
+    dropped_docs: int = 0
+    summarized_turns: int = 0
+    
+    def usage(self) -> Dict[str, int]:
+        """Contagem de tokens do prompt, para a resposta e os logs"""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "context_tokens": self.context_tokens,
+            "history_tokens": self.history_tokens,
+            "context_docs": len(self.context_docs),
+            "dropped_docs": self.dropped_docs,
+            "summarized_turns": self.summarized_turns
+        }
+
+
+@dataclass
+class _Candidate:
+    doc: Dict[str, Any]
+    header: List[int]
+    tokens: List[int]
+    relevance: float
+    shingles: FrozenSet[int]
+
+
+def _shingles(tokens: Sequence[int]) -> FrozenSet[int]:
+    if len(tokens) < SHINGLE_TOKENS:
+        return frozenset([hash(tuple(tokens))])
+    return frozenset(hash(tuple(tokens[i:i + SHINGLE_TOKENS])) for i in range(len(tokens) - SHINGLE_TOKENS + 1))
+
+
+def _similarity(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    """Fração de shingles em comum, relativa ao menor dos dois chunks.
+    
+    Um chunk contido em outro (janelas sobrepostas, o mesmo trecho em dois
+    documentos) tem similaridade 1.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class ContextBuilder:
+    """Monta o prompt do chat dentro de um orçamento de tokens.
+    
+    Os chunks recuperados são escolhidos por maximal marginal relevance: a
+    relevância vem da posição na busca e a redundância é a sobreposição de
+    shingles de tokens com os chunks já escolhidos, o que descarta janelas
+    vizinhas repetidas e quase-duplicatas. O histórico mantém os turnos mais
+    recentes que cabem em history_tokens; os anteriores são condensados
+    (início de cada mensagem) numa única mensagem de resumo. O contexto fica
+    com o que sobra de max_prompt_tokens depois do sistema, da pergunta e
+    do histórico.
+    """
+    
+    def __init__(
+        self,
+        model: str,
+        system_prompt: str,
+        max_prompt_tokens: int = 6000,
+        history_tokens: int = 1500,
+        summary_tokens: int = 300,
+        mmr_lambda: float = 0.7,
+        duplicate_threshold: float = 0.8,
+        min_chunk_tokens: int = 100
+    ):
+        self.encoding = get_encoding(model)
+        self.system_prompt = system_prompt
+        self.max_prompt_tokens = max_prompt_tokens
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.min_chunk_tokens = min_chunk_tokens
+    
+    def _count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def _message_tokens(self, message: Dict[str, str]) -> int:
+        return self._count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+    
+    def build(
+        self,
+        message: str,
+        context_docs: List[Dict[str, Any]],
+        conversation_history: Optional[List[Dict[str, str]]] = None
+    ) -> ChatPrompt:
+        system = {"role": "system", "content": self.system_prompt}
+        fixed = self._message_tokens(system) + self._message_tokens({"content": message}) + REPLY_PRIMING_TOKENS
+        # Cabeçalho "Contexto dos documentos:" e "Pergunta:" da mensagem do usuário
+        fixed += self._count("Contexto dos documentos:\n\n\nPergunta: ")
+        
+        history, history_tokens, summarized = self._pack_history(
+            conversation_history or [],
+            min(self.history_tokens, max(self.max_prompt_tokens - fixed, 0))
+        )
+        selected, context, context_tokens = self._pack_context(
+            context_docs,
+            self.max_prompt_tokens - fixed - history_tokens
+        )
+        
+        user_content = f"Contexto dos documentos:\n{context}\n\nPergunta: {message}" if context else message
+        messages = [system, *history, {"role": "user", "content": user_content}]
+        prompt_tokens = sum(self._message_tokens(item) for item in messages) + REPLY_PRIMING_TOKENS
+        return ChatPrompt(
+            messages=messages,
+            context_docs=selected,
+            prompt_tokens=prompt_tokens,
+            context_tokens=context_tokens,
+            history_tokens=history_tokens,
+            dropped_docs=len(context_docs) - len(selected),
+            summarized_turns=summarized
+        )
+    
+    def _pack_history(self, history: List[Dict[str, str]], budget: int) -> Tuple[List[Dict[str, str]], int, int]:
+        """Turnos recentes que cabem no orçamento e o resumo dos anteriores"""
+        sizes = [self._message_tokens(turn) for turn in history]
+        if sum(sizes) <= budget:
+            return list(history), sum(sizes), 0
+        
+        # Não cabe tudo: o resumo dos turnos antigos tem espaço reservado
+        recent_budget = max(budget - self.summary_tokens, 0)
+        recent: List[Dict[str, str]] = []
+        used = 0
+        position = len(history)
+        while position > 0:
+            tokens = sizes[position - 1]
+            if used + tokens > recent_budget:
+                break
+            used += tokens
+            position -= 1
+            recent.insert(0, history[position])
+        
+        older = history[:position]
+        summary = self._summarize(older, budget - used - MESSAGE_OVERHEAD_TOKENS)
+        if not summary:
+            return recent, used, len(older)
+        
+        summary_message = {"role": "system", "content": summary}
+        return [summary_message, *recent], used + self._message_tokens(summary_message), len(older)
+    
+    def _summarize(self, turns: List[Dict[str, str]], budget: int) -> str:
+        """Resumo extrativo: o início de cada turno, dividindo o orçamento entre eles"""
+        header = "Resumo da conversa anterior:"
+        budget -= self._count(header)
+        if budget <= 0:
+            return ""
+        
+        # Os mais recentes primeiro, até o orçamento acabar
+        per_turn = max(budget // len(turns), 16)
+        lines: List[str] = []
+        for turn in reversed(turns):
+            prefix = f"- {turn.get('role', 'user')}: "
+            room = min(per_turn, budget) - self._count(prefix) - 2
+            if room < 8:
+                break
+            tokens = self.encoding.encode(" ".join((turn.get("content") or "").split()), disallowed_special=())
+            text = self.encoding.decode(tokens[:room]) + ("…" if len(tokens) > room else "")
+            line = prefix + text
+            budget -= self._count(line) + 1
+            lines.insert(0, line)
+        
+        return "\n".join([header, *lines]) if lines else ""
+    
+    def _pack_context(self, context_docs: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], str, int]:
+        """Chunks escolhidos por MMR até o orçamento, texto do contexto e seus tokens"""
+        candidates = []
+        for rank, doc in enumerate(context_docs):
+            filename = doc["metadata"].get("filename", "Unknown")
+            tokens = self.encoding.encode(doc["text"], disallowed_special=())
+            candidates.append(_Candidate(
+                doc=doc,
+                header=self.encoding.encode(f"[{filename}]\n", disallowed_special=()),
+                tokens=tokens,
+                # A ordem da busca é a relevância (os scores dos modos não se comparam)
+                relevance=1.0 - rank / len(context_docs),
+                shingles=_shingles(tokens)
+            ))
+        
+        selected: List[_Candidate] = []
+        parts: List[str] = []
+        used = 0
+        separator = self._count("\n\n")
+        while candidates and budget - used > 0:
+            best, best_score, best_redundancy = None, None, 0.0
+            for candidate in candidates:
+                redundancy = max((_similarity(candidate.shingles, chosen.shingles) for chosen in selected), default=0.0)
+                score = self.mmr_lambda * candidate.relevance - (1 - self.mmr_lambda) * redundancy
+                if best_score is None or score > best_score:
+                    best, best_score, best_redundancy = candidate, score, redundancy
+            candidates.remove(best)
+            if best_redundancy >= self.duplicate_threshold:
+                continue
+            
+            cost = len(best.header) + len(best.tokens) + (separator if parts else 0)
+            room = budget - used
+            if cost <= room:
+                parts.append(self.encoding.decode(best.header + best.tokens))
+            elif room - cost + len(best.tokens) >= self.min_chunk_tokens:
+                # O primeiro que não cabe entra cortado e fecha o contexto
+                kept = room - cost + len(best.tokens)
+                parts.append(self.encoding.decode(best.header + best.tokens[:kept]))
+                cost = room
+                candidates = []
+            else:
+                continue
+            selected.append(best)
+            used += cost
+        
+        context = "\n\n".join(parts)
+        return [candidate.doc for candidate in selected], context, (self._count(context) if context else 0)
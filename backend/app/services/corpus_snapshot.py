@@ -0,0 +1,208 @@
+import json
+import os
+import shutil
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+# Identificação do bundle no manifest.json
+SNAPSHOT_FORMAT = "rag-corpus"
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+# Colunas de texto: chunks (id, texto e metadados em JSON) e documentos
+# (registro do catálogo em JSON e texto original)
+CHUNK_COLUMNS = ("chunk_ids", "chunk_texts", "chunk_metadata")
+DOCUMENT_COLUMNS = ("documents", "document_texts")
+
+# Cabeçalho .npy de tamanho fixo: reescrito no fim com a quantidade real de linhas
+NPY_HEADER_BYTES = 128
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    """Cabeçalho .npy (versão 1.0) de float32 (rows x dim) com NPY_HEADER_BYTES"""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    prefix = b"\x93NUMPY\x01\x00"
+    size = NPY_HEADER_BYTES - len(prefix) - 2
+    return prefix + size.to_bytes(2, "little") + header.ljust(size - 1).encode("latin1") + b"\n"
+
+
+def _fsync_close(fh) -> None:
+    fh.flush()
+    os.fsync(fh.fileno())
+    fh.close()
+
+
+class _TextColumnWriter:
+    """Coluna de strings: blob UTF-8 (<nome>.bin) e offsets int64 (<nome>.offsets.npy)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.fh = open(f"{path}.bin", "wb")
+        self.offsets = array("q", [0])
+    
+    def extend(self, values: List[str]) -> None:
+        position = self.offsets[-1]
+        for value in values:
+            data = value.encode("utf-8")
+            self.fh.write(data)
+            position += len(data)
+            self.offsets.append(position)
+    
+    def close(self) -> None:
+        _fsync_close(self.fh)
+        with open(f"{self.path}.offsets.npy", "wb") as fh:
+            np.save(fh, np.frombuffer(self.offsets, dtype="int64"))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+class _TextColumn:
+    """Leitura de uma coluna de strings mapeada em memória"""
+    
+    def __init__(self, path: str):
+        self.offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+        size = int(self.offsets[-1])
+        self.blob = np.memmap(f"{path}.bin", dtype="uint8", mode="r") if size else np.empty(0, dtype="uint8")
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def slice(self, start: int, end: int) -> List[str]:
+        offsets = self.offsets[start:end + 1]
+        data = self.blob[int(offsets[0]):int(offsets[-1])].tobytes()
+        base = int(offsets[0])
+        return [
+            data[int(offsets[i]) - base:int(offsets[i + 1]) - base].decode("utf-8")
+            for i in range(len(offsets) - 1)
+        ]
+
+
+class CorpusSnapshotWriter:
+    """Grava um bundle do corpus em colunas, em streaming.
+    
+    O bundle é um diretório com:
+      manifest.json                 - formato, modelo e dimensão dos embeddings, contagens
+      embeddings.npy                - float32 (chunks x dim), carregável com mmap
+      <coluna>.bin/.offsets.npy     - strings UTF-8 concatenadas e offsets int64 (n + 1)
+    
+    A linha i de embeddings.npy é o chunk i de chunk_ids, chunk_texts e
+    chunk_metadata. Nada é acumulado em memória além dos offsets. A
+    gravação vai para <path>.partial e só vira <path> no close, então um
+    bundle com o nome final está sempre completo.
+    """
+    
+    def __init__(self, path: str, model: str, dim: int):
+        if os.path.exists(path):
+            raise FileExistsError(f"Snapshot {path} já existe")
+        self.path = path
+        self.partial = f"{path}.partial"
+        self.model = model
+        self.dim = dim
+        shutil.rmtree(self.partial, ignore_errors=True)
+        os.makedirs(self.partial)
+        
+        self.columns = {
+            name: _TextColumnWriter(os.path.join(self.partial, name))
+            for name in CHUNK_COLUMNS + DOCUMENT_COLUMNS
+        }
+        self.embeddings = open(os.path.join(self.partial, EMBEDDINGS_FILE), "wb")
+        self.embeddings.write(_npy_header(0, dim))
+        self.chunks = 0
+        self.documents = 0
+    
+    def add_chunks(
+        self,
+        keys: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        embeddings: np.ndarray
+    ) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype="<f4").reshape(len(keys), self.dim)
+        self.embeddings.write(embeddings.tobytes())
+        self.columns["chunk_ids"].extend(keys)
+        self.columns["chunk_texts"].extend(texts)
+        self.columns["chunk_metadata"].extend([json.dumps(metadata, ensure_ascii=False) for metadata in metadatas])
+        self.chunks += len(keys)
+    
+    def add_documents(self, records: List[Dict[str, Any]], texts: List[str]) -> None:
+        self.columns["documents"].extend([json.dumps(record, ensure_ascii=False) for record in records])
+        self.columns["document_texts"].extend(texts)
+        self.documents += len(records)
+    
+    def close(self) -> Dict[str, Any]:
+        """Fecha as colunas, grava o manifest e publica o bundle; retorna o manifest"""
+        self.embeddings.seek(0)
+        self.embeddings.write(_npy_header(self.chunks, self.dim))
+        _fsync_close(self.embeddings)
+        for column in self.columns.values():
+            column.close()
+        
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "embedding_model": self.model,
+            "dim": self.dim,
+            "chunks": self.chunks,
+            "documents": self.documents,
+            "created_at": datetime.now().isoformat()
+        }
+        with open(os.path.join(self.partial, MANIFEST_FILE), "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, indent=2)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(self.partial, self.path)
+        return manifest
+    
+    def abort(self) -> None:
+        self.embeddings.close()
+        for column in self.columns.values():
+            column.fh.close()
+        shutil.rmtree(self.partial, ignore_errors=True)
+
+
+class CorpusSnapshotReader:
+    """Leitura de um bundle gravado por CorpusSnapshotWriter, mapeado em memória"""
+    
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as fh:
+            self.manifest = json.load(fh)
+        if self.manifest.get("format") != SNAPSHOT_FORMAT or self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} não é um snapshot do corpus na versão {SNAPSHOT_VERSION}")
+        
+        self.path = path
+        self.model = self.manifest["embedding_model"]
+        self.dim = self.manifest["dim"]
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.columns = {
+            name: _TextColumn(os.path.join(path, name))
+            for name in CHUNK_COLUMNS + DOCUMENT_COLUMNS
+        }
+        if self.embeddings.shape != (self.manifest["chunks"], self.dim):
+            raise ValueError(f"Snapshot {path} incompleto: embeddings com forma {self.embeddings.shape}")
+    
+    def chunk_batches(
+        self,
+        batch_size: int
+    ) -> Iterator[Tuple[List[str], List[str], List[Dict[str, Any]], np.ndarray]]:
+        """Lotes de chunks: ids, textos, metadados e embeddings (view do mmap)"""
+        for start in range(0, self.manifest["chunks"], batch_size):
+            end = min(start + batch_size, self.manifest["chunks"])
+            yield (
+                self.columns["chunk_ids"].slice(start, end),
+                self.columns["chunk_texts"].slice(start, end),
+                [json.loads(metadata) for metadata in self.columns["chunk_metadata"].slice(start, end)],
+                self.embeddings[start:end]
+            )
+    
+    def document_batches(self, batch_size: int) -> Iterator[Tuple[List[Dict[str, Any]], List[str]]]:
+        """Lotes de documentos: registros do catálogo e textos originais"""
+        for start in range(0, self.manifest["documents"], batch_size):
+            end = min(start + batch_size, self.manifest["documents"])
+            yield (
+                [json.loads(record) for record in self.columns["documents"].slice(start, end)],
+                self.columns["document_texts"].slice(start, end)
+            )
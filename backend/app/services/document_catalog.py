@@ -0,0 +1,161 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class DocumentCatalog:
+    """Catálogo dos documentos indexados.
+    
+    Uma linha por documento numa tabela SQLite (índices por status,
+    filename e file_id), com os metadados e a quantidade de chunks; o
+    vector store fica só com os chunks. O texto original de cada documento
+    vai comprimido com gzip para text_dir. A listagem é paginada por
+    cursor (seq do último documento da página), então custa o tamanho da
+    página, não o do catálogo.
+    """
+    
+    def __init__(self, path: str, text_dir: str):
+        self.path = path
+        self.text_dir = text_dir
+        self.lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(text_dir, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, filename TEXT, file_id TEXT, "
+            "status TEXT NOT NULL, chunk_count INTEGER NOT NULL DEFAULT 0, content_hash TEXT, "
+            "metadata TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_status ON documents(status, seq)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_filename ON documents(filename, seq)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS documents_file_id ON documents(file_id, seq)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+    
+    def _text_path(self, document_id: str) -> str:
+        return os.path.join(self.text_dir, document_id[:2], f"{document_id}.txt.gz")
+    
+    def write_text(self, document_id: str, text: str) -> None:
+        """Grava o texto original comprimido (troca atômica do arquivo)"""
+        path = self._text_path(document_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(f"{path}.tmp", "wt", encoding="utf-8", compresslevel=6) as fh:
+            fh.write(text)
+        os.replace(f"{path}.tmp", path)
+    
+    def read_text(self, document_id: str) -> Optional[str]:
+        path = self._text_path(document_id)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            return fh.read()
+    
+    @staticmethod
+    def _document(row: sqlite3.Row) -> Dict[str, Any]:
+        metadata = json.loads(row["metadata"])
+        return {
+            "id": row["id"],
+            "filename": row["filename"],
+            "file_id": row["file_id"],
+            "status": row["status"],
+            "chunk_count": row["chunk_count"],
+            "content_hash": row["content_hash"],
+            "pages": metadata.get("pages", 0),
+            "language": metadata.get("language", "unknown"),
+            "metadata": metadata,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+    
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM documents WHERE id = ?", (document_id,)).fetchone()
+        return self._document(row) if row else None
+    
+    def upsert(
+        self,
+        document_id: str,
+        filename: str,
+        chunk_count: int,
+        metadata: Dict[str, Any],
+        file_id: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        status: str = "processed"
+    ) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO documents (id, filename, file_id, status, chunk_count, content_hash, metadata, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET filename = excluded.filename, file_id = excluded.file_id, "
+                "status = excluded.status, chunk_count = excluded.chunk_count, "
+                "content_hash = excluded.content_hash, metadata = excluded.metadata, updated_at = excluded.updated_at",
+                (document_id, filename, file_id, status, chunk_count, content_hash,
+                 json.dumps(metadata, ensure_ascii=False), now, now)
+            )
+    
+    def list(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        filename: Optional[str] = None,
+        file_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Uma página de documentos e o cursor da próxima (None na última)"""
+        try:
+            after = int(cursor) if cursor else 0
+        except ValueError:
+            raise ValueError(f"Cursor inválido: {cursor}") from None
+        conditions, params = ["seq > ?"], [after]
+        for column, value in (("status", status), ("filename", filename), ("file_id", file_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM documents WHERE {' AND '.join(conditions)} ORDER BY seq LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        
+        next_cursor = str(rows[limit - 1]["seq"]) if len(rows) > limit else None
+        return [self._document(row) for row in rows[:limit]], next_cursor
+    
+    def delete(self, document_id: str) -> bool:
+        with self.lock, self.db:
+            cursor = self.db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        path = self._text_path(document_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        return cursor.rowcount > 0
+    
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM catalog_meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+    
+    def set_meta(self, key: str, value: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO catalog_meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+    
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -1,70 +1,142 @@
 import aiohttp
-import asyncio
-from typing import Tuple, Dict, Any, List
+import aiofiles
+from typing import Tuple, Dict, Any, List, Optional, Iterable, Iterator
 import logging
-from docling.document_converter import DocumentConverter
-import tempfile
 import os
+from utils.config import get_settings
+from services.extraction_pool import ExtractionPool
+from services.chunker import Chunk, TokenChunker, text_items
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class FileTooLargeError(Exception):
+    """Arquivo acima de MAX_FILE_SIZE_MB"""
 
 class DocumentService:
     def __init__(self):
-        self.converter = DocumentConverter()
+        # Docling roda em processos próprios, cada um com o conversor já carregado
+        self.extraction_pool = ExtractionPool(
+            processes=settings.extraction_processes,
+            timeout=settings.extraction_timeout,
+            memory_limit_mb=settings.extraction_memory_limit_mb,
+            recycle_rss_mb=settings.extraction_recycle_rss_mb,
+            max_tasks_per_child=settings.extraction_max_tasks_per_child,
+            pages_per_task=settings.extraction_pages_per_task
+        )
+        self.session: Optional[aiohttp.ClientSession] = None
+        chunk_tokens, overlap_tokens = settings.chunk_tokens, settings.chunk_overlap_tokens
+        length_function = None
+        if settings.embedding_provider == "local":
+            # O modelo local trunca a entrada em LOCAL_EMBEDDING_MAX_TOKENS (com os
+            # tokens especiais): o final de um chunk maior ficaria fora do embedding
+            limit = settings.local_embedding_max_tokens - 2
+            if chunk_tokens > limit:
+                logger.warning(
+                    f"CHUNK_TOKENS={chunk_tokens} passa do limite do modelo local "
+                    f"(LOCAL_EMBEDDING_MAX_TOKENS={settings.local_embedding_max_tokens}): chunks de {limit} tokens"
+                )
+                overlap_tokens = overlap_tokens * limit // chunk_tokens
+                chunk_tokens = limit
+            # O tokenizador do modelo costuma gerar mais tokens que o do
+            # tiktoken (ainda mais em português): o limite vale na medida dele
+            from services.local_embeddings import token_counter
+            
+            length_function = token_counter(settings.local_embedding_model_dir)
+        self.chunker = TokenChunker(
+            settings.embedding_model,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=overlap_tokens,
+            length_function=length_function,
+            max_length=settings.local_embedding_max_tokens
+        )
     
-    async def download_from_url(self, url: str) -> bytes:
-        """Download arquivo de URL"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.read()
-                else:
-                    raise Exception(f"Erro ao baixar arquivo: {response.status}")
+    def start(self):
+        """Sobe o pool de extração (carrega os modelos do Docling)"""
+        self.extraction_pool.start()
     
-    async def extract_text(self, content: bytes, filename: str) -> Tuple[str, Dict[str, Any]]:
-        """Extrai texto usando Docling"""
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as tmp_file:
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
-            
-            # Processar com Docling
-            result = await asyncio.to_thread(
-                self.converter.convert,
-                source=tmp_file_path
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        self.extraction_pool.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Sessão HTTP compartilhada (pool de conexões com keep-alive)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=settings.http_pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=settings.http_connect_timeout,
+                    sock_read=settings.http_read_timeout
+                )
             )
+        return self.session
+    
+    async def download_to_file(self, url: str, path: str) -> int:
+        """Baixa a URL direto para o arquivo, em blocos, e retorna o tamanho.
+        
+        Se o arquivo já existe (tentativa anterior interrompida), pede só o
+        restante com Range; servidores sem suporte devolvem 200 e o download
+        recomeça do zero.
+        """
+        max_bytes = settings.max_file_size_mb * 1024 * 1024
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 416 and offset:
+                # Nada além do que já foi baixado
+                return offset
+            if response.status == 200:
+                offset = 0
+            elif response.status != 206 or not offset:
+                raise Exception(f"Erro ao baixar arquivo: {response.status}")
+            
+            if response.content_length and offset + response.content_length > max_bytes:
+                raise FileTooLargeError(f"Arquivo maior que {settings.max_file_size_mb} MB")
             
-            if result and result.document:
-                text = "\n".join([str(item.text) for item in result.document.texts])
-                metadata = {
-                    "filename": filename,
-                    "pages": getattr(result.document, 'page_count', 0),
-                    "language": getattr(result.document, 'language', 'unknown'),
-                    "ocr_applied": getattr(result, 'ocr_applied', False)
-                }
-                return text, metadata
-            else:
-                raise Exception("Falha na conversão com Docling")
+            size = offset
+            async with aiofiles.open(path, "ab" if offset else "wb") as f:
+                async for block in response.content.iter_chunked(settings.download_chunk_size):
+                    size += len(block)
+                    if size > max_bytes:
+                        raise FileTooLargeError(f"Arquivo maior que {settings.max_file_size_mb} MB")
+                    await f.write(block)
+        
+        return size
+    
+    async def extract_file(self, path: str, filename: str) -> Tuple[str, Dict[str, Any], List[Dict[str, Any]]]:
+        """Extrai texto de um arquivo já em disco usando Docling.
+        
+        Retorna também os itens do documento (texto, rótulo e página) em
+        ordem de leitura, usados pelo chunker.
+        """
+        try:
+            # Processar com Docling no pool de processos
+            result = await self.extraction_pool.extract(path)
+            
+            items = result["items"]
+            text = "\n".join(item["text"] for item in items)
+            metadata = {
+                "filename": filename,
+                "pages": result["pages"],
+                "language": result["language"],
+                "ocr_applied": result["ocr_applied"]
+            }
+            return text, metadata, items
                 
         except Exception as e:
             logger.error(f"Erro na extração de texto: {e}")
             raise
-        finally:
-            if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
     
-    async def create_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
-        """Cria chunks do texto"""
+    def chunk_items(self, items: Iterable[Dict[str, Any]]) -> Iterator[Chunk]:
+        """Chunks por tokens respeitando títulos/parágrafos, consumindo os itens sob demanda"""
+        return self.chunker.chunks(items)
+    
+    async def create_chunks(self, text: str) -> List[str]:
+        """Cria chunks de um texto sem estrutura (uma linha por item)"""
         if not text or len(text.strip()) < 10:
             return []
         
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk_text = " ".join(chunk_words)
-            if chunk_text.strip():
-                chunks.append(chunk_text)
-        
-        return chunks
+        return [chunk.text for chunk in self.chunk_items(text_items(text))]
@@ -0,0 +1,165 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Normalização usada na chave do cache (Unicode NFC e espaços colapsados)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """Chave endereçada por conteúdo: sha256(modelo, texto normalizado)"""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Cache persistente de embeddings endereçado por conteúdo.
+    
+    Os vetores ficam em float32 numa tabela SQLite (um BLOB por chave) com
+    um LRU em memória na frente. O tamanho em disco é limitado por
+    max_entries: ao passar do limite, as entradas usadas há mais tempo são
+    removidas. O último uso é gravado em lote a cada consulta, não a cada hit.
+    
+    A API e os workers compartilham o arquivo: a contagem de entradas fica
+    no próprio banco (embeddings_count, mantida por triggers), então o
+    limite vale para o total gravado por todos os processos.
+    """
+    
+    def __init__(self, path: str, max_entries: int = 1000000, memory_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        # Contagem e triggers criados juntos: nenhuma inclusão de outro processo fica de fora
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings_count (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL)"
+        )
+        self.db.execute("INSERT OR IGNORE INTO embeddings_count SELECT 0, COUNT(*) FROM embeddings")
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_inserted AFTER INSERT ON embeddings "
+            "BEGIN UPDATE embeddings_count SET entries = entries + 1; END"
+        )
+        self.db.execute(
+            "CREATE TRIGGER IF NOT EXISTS embeddings_deleted AFTER DELETE ON embeddings "
+            "BEGIN UPDATE embeddings_count SET entries = entries - 1; END"
+        )
+        self.db.commit()
+    
+    def _entries(self) -> int:
+        return self.db.execute("SELECT entries FROM embeddings_count").fetchone()[0]
+    
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+    
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Vetores em cache para cada texto (None quando ausente)"""
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        
+        with self.lock:
+            missing = []
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    self.counters["memory_hits"] += 1
+                else:
+                    missing.append(key)
+            
+            # Consultas em blocos para não passar do limite de variáveis do SQLite
+            unique_missing = list(dict.fromkeys(missing))
+            for start in range(0, len(unique_missing), 500):
+                block = unique_missing[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(block))})",
+                    block
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype="float32")
+                    found[key] = vector
+                    self._remember(key, vector)
+            
+            if found:
+                now = time.time()
+                self.db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.db.commit()
+            
+            disk_hits = sum(1 for key in missing if key in found)
+            self.counters["disk_hits"] += disk_hits
+            self.counters["misses"] += len(missing) - disk_hits
+        
+        return [found.get(key) for key in keys]
+    
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray) -> None:
+        """Grava os vetores gerados e aplica o limite de tamanho"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            rows[cache_key(model, text)] = vector.copy()
+        
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, model, vector.tobytes(), now) for key, vector in rows.items()]
+            )
+            for key, vector in rows.items():
+                self._remember(key, vector)
+            
+            # Na mesma transação da inclusão: outro processo não altera a contagem no meio
+            entries = self._entries()
+            if entries > self.max_entries:
+                self._evict(entries)
+            self.db.commit()
+    
+    def _evict(self, entries: int) -> None:
+        """Remove as entradas menos usadas até 90% do limite"""
+        cursor = self.db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (entries - int(self.max_entries * 0.9),)
+        )
+        self.counters["evictions"] += cursor.rowcount
+    
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": self._entries(),
+                "memory_entries": len(self.memory),
+                "max_entries": self.max_entries
+            }
+    
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
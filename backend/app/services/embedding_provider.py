@@ -0,0 +1,87 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+import numpy as np
+
+# Dimensão dos modelos de embeddings da OpenAI
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072
+}
+# Modelos que aceitam o parâmetro dimensions (a API devolve o vetor encurtado)
+OPENAI_SHORTENABLE = {"text-embedding-3-small", "text-embedding-3-large"}
+
+
+class Throughput:
+    """Itens por segundo na janela recente.
+    
+    Um balde por segundo num anel de tamanho fixo: a memória não cresce
+    com o tempo de vida do processo, consultado ou não.
+    """
+    
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.counts = [0] * window
+        self.seconds = [0] * window
+    
+    def add(self, count: int) -> None:
+        second = int(time.monotonic())
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += count
+    
+    def rate(self) -> float:
+        now = int(time.monotonic())
+        return sum(
+            count for count, second in zip(self.counts, self.seconds)
+            if now - second < self.window
+        ) / self.window
+
+
+class EmbeddingProvider(ABC):
+    """Gerador de embeddings usado pelo EmbeddingService.
+    
+    model identifica o modelo (e a variante, como a quantização) e é a
+    marca gravada no cache de embeddings e nos índices: vetores de modelos
+    diferentes nunca se misturam. dim é a dimensão dos vetores gerados.
+    """
+    
+    model: str
+    dim: int
+    
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings dos textos (float32, uma linha por texto), na mesma ordem"""
+    
+    def stats(self) -> Dict[str, Any]:
+        return {}
+    
+    def close(self) -> None:
+        pass
+
+
+def openai_dimension(model: str, dim: int = 0) -> int:
+    """Dimensão de um modelo da OpenAI.
+    
+    dim (EMBEDDING_DIM), se informado, tem precedência: nos modelos
+    text-embedding-3 vira o parâmetro dimensions da API (até a dimensão
+    nativa); nos demais modelos conhecidos precisa ser a dimensão nativa.
+    """
+    native = OPENAI_DIMENSIONS.get(model)
+    if not dim:
+        if native is None:
+            raise ValueError(f"Dimensão desconhecida para o modelo {model}; defina EMBEDDING_DIM")
+        return native
+    if native is not None and dim != native and (model not in OPENAI_SHORTENABLE or dim > native):
+        raise ValueError(f"EMBEDDING_DIM={dim} inválido: {model} gera vetores de {native} dimensões")
+    return dim
+
+
+def openai_model_mark(model: str, dim: int) -> str:
+    """Marca dos vetores de um modelo da OpenAI: vetores encurtados levam a dimensão"""
+    native = OPENAI_DIMENSIONS.get(model)
+    return model if native is None or dim == native else f"{model}:{dim}"
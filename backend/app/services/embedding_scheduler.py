@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+
+from services.embedding_provider import (
+    OPENAI_DIMENSIONS, OPENAI_SHORTENABLE, EmbeddingProvider, Throughput, openai_model_mark
+)
+from utils.metrics import STAGE_SECONDS, TOKENS
+from utils.tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Erros transitórios em que vale a pena tentar de novo
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError
+)
+
+
+@dataclass
+class _PendingInput:
+    text: str
+    tokens: int
+    future: asyncio.Future
+
+
+class EmbeddingScheduler(EmbeddingProvider):
+    """Agendador de chamadas à API de embeddings compartilhado por todas as ingestões.
+    
+    As entradas de chamadas concorrentes entram numa fila única e são
+    agrupadas em lotes limitados por quantidade de entradas e de tokens.
+    Cada lote vira um embeddings.create, com no máximo max_concurrency
+    requisições em andamento. Um 429 pausa o envio de novos lotes pelo
+    tempo de espera (Retry-After ou backoff exponencial com jitter) antes
+    de repetir a requisição.
+    
+    É o provedor de embeddings da OpenAI; dim é a dimensão dos vetores.
+    Nos modelos text-embedding-3, um dim menor que o nativo é pedido à API
+    em dimensions e entra na marca do modelo (model), para que o cache não
+    misture vetores de dimensões diferentes.
+    """
+    
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        max_batch_inputs: int = 512,
+        max_batch_tokens: int = 250000,
+        max_input_tokens: int = 8191,
+        max_concurrency: int = 4,
+        coalesce_ms: int = 20,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        dim: int = 0
+    ):
+        # As tentativas ficam a cargo do agendador, não do cliente
+        self.client = client.with_options(max_retries=0)
+        self.api_model = model
+        self.dim = dim or OPENAI_DIMENSIONS.get(model, 0)
+        self.model = openai_model_mark(model, self.dim)
+        shortened = model in OPENAI_SHORTENABLE and self.dim != OPENAI_DIMENSIONS[model]
+        self.request_options = {"dimensions": self.dim} if shortened else {}
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_concurrency = max_concurrency
+        self.coalesce_ms = coalesce_ms
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self.pending: Deque[_PendingInput] = deque()
+        self.paused_until = 0.0
+        self.counters = {"inputs": 0, "tokens": 0, "requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+        self.completed = Throughput()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _ensure_dispatcher(self) -> None:
+        """Cria a fila e o despachante no event loop em execução"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._dispatcher = loop.create_task(self._dispatch())
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings dos textos, na mesma ordem"""
+        if not texts:
+            # Mesma forma de um lote com textos, como no modelo local
+            return np.zeros((0, self.dim), dtype="float32")
+        self._ensure_dispatcher()
+        
+        # Tokenizar documentos grandes bloquearia o event loop
+        prepared = await asyncio.to_thread(self._prepare, texts)
+        loop = asyncio.get_running_loop()
+        items = [_PendingInput(text, tokens, loop.create_future()) for text, tokens in prepared]
+        
+        self.pending.extend(items)
+        self._wakeup.set()
+        vectors = await asyncio.gather(*(item.future for item in items))
+        return np.array(vectors, dtype="float32")
+    
+    def _prepare(self, texts: List[str]) -> List[tuple]:
+        """Conta os tokens de cada entrada, truncando as que passam do limite do modelo"""
+        prepared = []
+        for text in texts:
+            tokens = count_tokens(text, self.api_model)
+            if tokens > self.max_input_tokens:
+                logger.warning(f"Entrada com {tokens} tokens truncada em {self.max_input_tokens}")
+                text = truncate_tokens(text, self.api_model, self.max_input_tokens)
+                tokens = self.max_input_tokens
+            prepared.append((text, tokens))
+        return prepared
+    
+    def _take_batch(self) -> List[_PendingInput]:
+        batch: List[_PendingInput] = []
+        tokens = 0
+        while self.pending and len(batch) < self.max_batch_inputs:
+            item = self.pending[0]
+            if item.future.done():
+                # Chamador cancelado antes do envio
+                self.pending.popleft()
+                continue
+            if batch and tokens + item.tokens > self.max_batch_tokens:
+                break
+            batch.append(self.pending.popleft())
+            tokens += item.tokens
+        return batch
+    
+    async def _dispatch(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            
+            # Janela curta para juntar entradas de chamadas concorrentes
+            if self.coalesce_ms:
+                await asyncio.sleep(self.coalesce_ms / 1000)
+            
+            while self.pending:
+                # O slot é obtido antes de montar o lote: enquanto as
+                # requisições em andamento não terminam, a fila continua
+                # crescendo e o próximo lote sai maior
+                await self._slots.acquire()
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                
+                batch = self._take_batch()
+                if not batch:
+                    self._slots.release()
+                    break
+                asyncio.create_task(self._run(batch))
+    
+    async def _run(self, batch: List[_PendingInput]) -> None:
+        try:
+            vectors = await self._request([item.text for item in batch], sum(item.tokens for item in batch))
+        except Exception as e:
+            self.counters["failures"] += 1
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        else:
+            for item, vector in zip(batch, vectors):
+                if not item.future.done():
+                    item.future.set_result(vector)
+        finally:
+            self._slots.release()
+    
+    async def _request(self, texts: List[str], tokens: int) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Lotes atendem várias requisições: só o histograma, sem Server-Timing
+                with STAGE_SECONDS.time(stage="embedding_api"):
+                    response = await self.client.embeddings.create(
+                        input=texts,
+                        model=self.api_model,
+                        **self.request_options
+                    )
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.counters["retries"] += 1
+                if isinstance(e, openai.RateLimitError):
+                    self.counters["rate_limited"] += 1
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                logger.warning(f"Embeddings: {type(e).__name__}, nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            self.counters["requests"] += 1
+            self.counters["inputs"] += len(texts)
+            self.counters["tokens"] += tokens
+            TOKENS.inc(tokens, kind="embedding")
+            self.completed.add(len(texts))
+            vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            if self.dim and vectors and len(vectors[0]) != self.dim:
+                raise ValueError(
+                    f"{self.api_model} devolveu vetores de {len(vectors[0])} dimensões, "
+                    f"mas o índice usa {self.dim} (EMBEDDING_DIM)"
+                )
+            return vectors
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Retry-After do servidor quando houver; senão backoff exponencial com jitter"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contadores e vazão (chunks/s) no último minuto"""
+        return {
+            **self.counters,
+            "queued": len(self.pending),
+            "chunks_per_second": self.completed.rate(),
+            "paused_for": max(0.0, self.paused_until - time.monotonic())
+        }
@@ -0,0 +1,98 @@
+import asyncio
+from typing import List, Dict, Any
+import numpy as np
+from openai import AsyncOpenAI
+import logging
+from utils.config import get_settings
+from services.embedding_cache import EmbeddingCache
+from services.embedding_provider import EmbeddingProvider, openai_dimension
+from services.embedding_scheduler import EmbeddingScheduler
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+def create_provider() -> EmbeddingProvider:
+    """Provedor configurado em EMBEDDING_PROVIDER: openai (API) ou local (ONNX na CPU)"""
+    if settings.embedding_provider == "local":
+        # Dependências (onnxruntime, tokenizers) só carregadas quando usadas
+        from services.local_embeddings import LocalEmbeddingModel
+        
+        return LocalEmbeddingModel(
+            settings.local_embedding_model_dir,
+            name=settings.local_embedding_model_name or None,
+            quantization=settings.local_embedding_quantization,
+            batch_size=settings.local_embedding_batch_size,
+            max_tokens=settings.local_embedding_max_tokens,
+            threads=settings.local_embedding_threads,
+            intra_op_threads=settings.local_embedding_intra_op_threads,
+            coalesce_ms=settings.embedding_coalesce_ms
+        )
+    if settings.embedding_provider != "openai":
+        raise ValueError(f"Provedor de embeddings inválido: {settings.embedding_provider}")
+    
+    client = AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_base_url or None
+    )
+    return EmbeddingScheduler(
+        client,
+        settings.embedding_model,
+        max_batch_inputs=settings.embedding_batch_max_inputs,
+        max_batch_tokens=settings.embedding_batch_max_tokens,
+        max_input_tokens=settings.embedding_max_input_tokens,
+        max_concurrency=settings.embedding_max_concurrency,
+        coalesce_ms=settings.embedding_coalesce_ms,
+        max_retries=settings.embedding_max_retries,
+        dim=openai_dimension(settings.embedding_model, settings.embedding_dim)
+    )
+
+class EmbeddingService:
+    """Geração de embeddings com cache persistente e lotes dinâmicos.
+    
+    Não depende do índice vetorial, então também é usado pelos workers de
+    ingestão, que geram os embeddings fora do processo da API. O provedor
+    define o modelo (marca dos vetores no cache e nos índices) e a
+    dimensão.
+    """
+    
+    def __init__(self):
+        self.provider = create_provider()
+        self.model = self.provider.model
+        self.dim = self.provider.dim
+        self.cache = EmbeddingCache(
+            settings.embedding_cache_path,
+            max_entries=settings.embedding_cache_max_entries,
+            memory_entries=settings.embedding_cache_memory_entries
+        )
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings (float32, uma linha por texto), reaproveitando os que já estão em cache"""
+        cached = await asyncio.to_thread(self.cache.get_many, self.model, texts)
+        
+        # Apenas textos inéditos (e sem repetição) vão para o provedor, em
+        # lotes compartilhados com as demais ingestões em andamento
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        if missing:
+            try:
+                generated = await self.provider.embed(missing)
+            except Exception as e:
+                logger.error(f"Erro ao gerar embeddings: {e}")
+                raise
+            
+            await asyncio.to_thread(self.cache.put_many, self.model, missing, generated)
+            fresh = dict(zip(missing, generated))
+            cached = [vector if vector is not None else fresh[text] for text, vector in zip(texts, cached)]
+        
+        return np.array(cached, dtype="float32")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contadores do cache e do provedor de embeddings"""
+        return {
+            "model": self.model,
+            "cache": self.cache.stats(),
+            "scheduler": self.provider.stats()
+        }
+    
+    def close(self):
+        self.provider.close()
+        self.cache.close()
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import pypdfium2
+from docling.datamodel.base_models import InputFormat
+from docling.document_converter import DocumentConverter
+from docling_core.types.doc import TableItem
+
+logger = logging.getLogger(__name__)
+
+# Conversor de cada processo do pool, criado uma única vez no initializer
+_converter: Optional[DocumentConverter] = None
+
+
+def _init_worker(memory_limit_mb: int) -> None:
+    """Aplica o limite de memória e carrega os modelos do Docling no processo"""
+    global _converter
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    _converter = DocumentConverter()
+    _converter.initialize_pipeline(InputFormat.PDF)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _items(document: Any) -> List[Dict[str, Any]]:
+    """Itens em ordem de leitura (texto, rótulo e página); tabelas viram markdown"""
+    items = []
+    for item, _level in document.iterate_items():
+        if isinstance(item, TableItem):
+            text = item.export_to_markdown(document)
+        else:
+            text = getattr(item, "text", None)
+        if not text:
+            continue
+        label = getattr(item, "label", None)
+        prov = getattr(item, "prov", None)
+        items.append({
+            "text": str(text),
+            "label": str(getattr(label, "value", label)),
+            "page": prov[0].page_no if prov else None
+        })
+    return items
+
+
+def _convert(path: str, page_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Converte o arquivo (ou só o intervalo de páginas, 1-based e inclusivo)"""
+    kwargs = {"page_range": page_range} if page_range else {}
+    result = _converter.convert(source=path, **kwargs)
+    if not result or not result.document:
+        raise RuntimeError("Falha na conversão com Docling")
+    
+    document = result.document
+    return {
+        "items": _items(document),
+        "pages": getattr(document, "page_count", 0) or len(getattr(document, "pages", None) or {}),
+        "language": getattr(document, "language", "unknown"),
+        "ocr_applied": getattr(result, "ocr_applied", False)
+    }
+
+
+def _pdf_page_count(path: str) -> int:
+    try:
+        pdf = pypdfium2.PdfDocument(path)
+    except Exception:
+        return 0
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _rss_mb(pid: int) -> float:
+    """Memória residente do processo em MB (0 se indisponível)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class ExtractionPool:
+    """Pool de processos para a extração com Docling.
+    
+    Cada processo carrega o DocumentConverter (e os modelos de layout/OCR)
+    uma vez no início e atende vários documentos, fora do GIL do processo
+    que o usa. Conversões que passam do timeout derrubam o pool atual, que
+    é substituído por um novo; processos que passam de recycle_rss_mb de
+    memória residente, ou de max_tasks_per_child documentos, são
+    reciclados. PDFs com mais de pages_per_task páginas são divididos em
+    intervalos convertidos em paralelo.
+    """
+    
+    def __init__(
+        self,
+        processes: int = 0,
+        timeout: float = 600.0,
+        memory_limit_mb: int = 0,
+        recycle_rss_mb: int = 4096,
+        max_tasks_per_child: int = 50,
+        pages_per_task: int = 50
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.recycle_rss_mb = recycle_rss_mb
+        self.max_tasks_per_child = max_tasks_per_child
+        self.pages_per_task = pages_per_task
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.counters = {"documents": 0, "tasks": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+    
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: processos limpos (sem herdar o estado do pai) e exigido por max_tasks_per_child
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.memory_limit_mb,),
+            max_tasks_per_child=self.max_tasks_per_child or None
+        )
+    
+    def start(self) -> None:
+        """Sobe os processos já carregando os modelos"""
+        if self.executor is not None:
+            return
+        self.executor = self._new_executor()
+        for _ in range(self.processes):
+            self.executor.submit(_ping)
+    
+    def _replace(self, executor: ProcessPoolExecutor, kill: bool) -> None:
+        """Troca o pool: tarefas novas vão para um pool novo; o antigo termina
+        as que tem (ou é morto, se kill)"""
+        if executor is not self.executor:
+            return
+        self.executor = self._new_executor()
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False)
+        if kill:
+            for process in processes:
+                process.kill()
+    
+    def _check_memory(self, executor: ProcessPoolExecutor) -> None:
+        if not self.recycle_rss_mb:
+            return
+        for process in list((executor._processes or {}).values()):
+            if _rss_mb(process.pid) > self.recycle_rss_mb:
+                logger.info(f"Reciclando pool de extração (processo {process.pid} acima de {self.recycle_rss_mb} MB)")
+                self.counters["recycled"] += 1
+                self._replace(executor, kill=False)
+                return
+    
+    async def _run(self, path: str, page_range: Optional[Tuple[int, int]]) -> Dict[str, Any]:
+        # Um pool quebrado por outra tarefa (timeout/crash) merece uma nova tentativa
+        for attempt in range(2):
+            executor = self.executor
+            future = executor.submit(_convert, path, page_range)
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            except asyncio.TimeoutError:
+                self.counters["timeouts"] += 1
+                self._replace(executor, kill=True)
+                raise TimeoutError(f"Extração de {os.path.basename(path)} excedeu {self.timeout:.0f}s")
+            except BrokenProcessPool:
+                self.counters["crashes"] += 1
+                self._replace(executor, kill=True)
+                if attempt:
+                    raise
+                continue
+            
+            self.counters["tasks"] += 1
+            self._check_memory(executor)
+            return result
+    
+    async def extract(self, path: str) -> Dict[str, Any]:
+        """Itens, páginas, idioma e OCR do documento"""
+        self.start()
+        self.counters["documents"] += 1
+        
+        pages = 0
+        if self.pages_per_task and path.lower().endswith(".pdf"):
+            pages = await asyncio.to_thread(_pdf_page_count, path)
+        
+        if pages <= self.pages_per_task:
+            return await self._run(path, None)
+        
+        ranges = [
+            (start, min(start + self.pages_per_task - 1, pages))
+            for start in range(1, pages + 1, self.pages_per_task)
+        ]
+        parts: List[Dict[str, Any]] = await asyncio.gather(*(self._run(path, page_range) for page_range in ranges))
+        return {
+            "items": [item for part in parts for item in part["items"]],
+            "pages": pages,
+            "language": parts[0]["language"],
+            "ocr_applied": any(part["ocr_applied"] for part in parts)
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "processes": self.processes}
+    
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
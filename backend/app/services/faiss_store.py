@@ -0,0 +1,825 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from services.id_map import IdMap
+from services.index_factory import apply_defaults, create_index, search_params
+from utils.rwlock import RWLock
+
+logger = logging.getLogger(__name__)
+
+
+def init_search_thread(omp_threads: int) -> None:
+    """Threads de busca: OpenMP do FAISS limitado (o ajuste vale por thread)"""
+    if omp_threads:
+        faiss.omp_set_num_threads(omp_threads)
+
+
+class FaissStore:
+    """Índice FAISS persistente com log incremental em disco.
+    
+    Layout de cada geração de dados:
+      vectors.f32     - log de append com os vetores float32 (linha N = id N)
+      keys.log        - log de append com um chunk id por linha (linha N = id N)
+      tombstones.log  - ids removidos, um por linha
+      index.faiss     - snapshot do índice FAISS
+      meta.json       - metadados do snapshot (dimensão, quantidade, tipo)
+    
+    O arquivo CURRENT no diretório de dados aponta para a geração ativa
+    (sem ele, os arquivos ficam direto no diretório) e o MODEL guarda o
+    modelo de embeddings dos vetores: abrir o diretório com outro modelo é
+    um erro, para que vetores de modelos diferentes nunca se misturem. A
+    compactação escreve uma geração nova e só então troca o CURRENT, então
+    um crash no meio mantém a geração anterior intacta.
+    
+    Os logs são a fonte da verdade: o snapshot só evita reindexar tudo na
+    partida. Ao carregar, o snapshot é lido e apenas os ids posteriores a
+    ele são reaplicados a partir do log.
+    
+    Tipos que exigem treino (IVF, quantização escalar) começam com um índice
+    Flat provisório; ao atingir train_min vetores o índice configurado é
+    treinado e populado a partir do log em uma thread de fundo e trocado de
+    forma atômica. O mesmo caminho faz o re-treino quando o corpus cresce
+    retrain_growth vezes desde o último treino.
+    
+    Remoções viram tombstones filtrados na busca por um IDSelector. Quando a
+    fração de ids mortos passa de compact_ratio, a compactação reescreve
+    logs e índice apenas com os vetores vivos (os ids são renumerados).
+    
+    Buscas restritas a alguns documentos usam os intervalos de ids por
+    documento do IdMap: conjuntos pequenos são varridos de forma exata
+    direto do log e os demais viram um IDSelector passado ao índice.
+    
+    Buscas rodam em paralelo (leitura no index_lock) e não passam pelo lock
+    dos logs: só esperam enquanto um lote é incluído no índice (escrita
+    exclusiva). Inclusões grandes são aplicadas em lotes de
+    write_batch_size vetores, liberando os locks entre um lote e outro para
+    as buscas que estão esperando. O snapshot grava o índice segurando só o
+    index_write_lock: as inclusões esperam o fim da gravação e as buscas
+    continuam.
+    """
+    
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.log"
+    TOMBSTONES_FILE = "tombstones.log"
+    INDEX_FILE = "index.faiss"
+    META_FILE = "meta.json"
+    CURRENT_FILE = "CURRENT"
+    MODEL_FILE = "MODEL"
+    STAGING_PROFILE = "staging"
+    
+    def __init__(
+        self,
+        data_dir: str,
+        dim: int,
+        snapshot_every: int = 50000,
+        use_mmap: bool = True,
+        batch_size: int = 5000,
+        index_kind: str = "flat",
+        index_options: Optional[Dict[str, Any]] = None,
+        train_min: int = 100000,
+        train_sample: int = 100000,
+        retrain_growth: float = 4.0,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        compact_ratio: float = 0.2,
+        compact_min: int = 1000,
+        prefilter_flat_max: int = 20000,
+        write_batch_size: int = 2048,
+        model: Optional[str] = None,
+        legacy_model: Optional[str] = None
+    ):
+        self.data_dir = data_dir
+        self.dim = dim
+        self.model = model
+        # Modelo dos vetores gravados antes de existir o arquivo MODEL
+        self.legacy_model = legacy_model
+        self.snapshot_every = snapshot_every
+        self.use_mmap = use_mmap
+        self.batch_size = batch_size
+        self.index_kind = index_kind
+        self.index_options = index_options or {}
+        self.train_min = train_min
+        self.train_sample = train_sample
+        self.retrain_growth = retrain_growth
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.prefilter_flat_max = prefilter_flat_max
+        self.write_batch_size = write_batch_size
+        # Logs, mapa de ids e manutenção (as buscas não usam)
+        self.lock = threading.RLock()
+        # Busca (leitura) contra inclusão (escrita) no índice ativo
+        self.index_lock = RWLock()
+        # Alterações no índice ativo e gravação do snapshot. As inclusões
+        # esperam um snapshot aqui, antes do index_lock, para que um escritor
+        # pendente não barre as buscas novas durante a gravação
+        self.index_write_lock = threading.Lock()
+        
+        self.index = faiss.IndexFlatL2(dim)
+        self.index_spec = "Flat"
+        self.index_profile = self.STAGING_PROFILE
+        self.id_map = IdMap()
+        self.ntotal = 0
+        self.compactions = 0
+        self.filtered_searches = {"flat_scan": 0, "selector": 0}
+        self._deleted: set = set()
+        self._selector: Optional[Tuple[Any, ...]] = None
+        self._trained_ntotal = 0
+        self._snapshot_ntotal = 0
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._maintenance_lock = threading.Lock()
+        self._target_needs_training = not self._create_target(0)[0].is_trained
+        
+        os.makedirs(data_dir, exist_ok=True)
+        self._set_generation(self._read_current())
+        self._check_model()
+        self._remove_stale_generations()
+        self._load()
+        self._open_logs()
+        
+        if self._needs_migration():
+            self.migrate_async()
+        elif self._needs_compaction():
+            self.compact_async()
+        elif self._snapshot_ntotal < 0 or self.ntotal - self._snapshot_ntotal >= self.snapshot_every:
+            self.snapshot_async()
+    
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * 4
+    
+    def _read_current(self) -> str:
+        """Diretório da geração ativa"""
+        current_path = os.path.join(self.data_dir, self.CURRENT_FILE)
+        if os.path.exists(current_path):
+            with open(current_path) as fh:
+                name = fh.read().strip()
+            if name and os.path.isdir(os.path.join(self.data_dir, name)):
+                return os.path.join(self.data_dir, name)
+        return self.data_dir
+    
+    def _check_model(self) -> None:
+        """Recusa vetores de outro modelo (antes de ler os logs) e grava a marca do modelo"""
+        if self.model is None:
+            return
+        
+        model_path = os.path.join(self.data_dir, self.MODEL_FILE)
+        stored = None
+        if os.path.exists(model_path):
+            with open(model_path) as fh:
+                stored = fh.read().strip()
+        elif os.path.exists(self._vectors_path) and os.path.getsize(self._vectors_path):
+            stored = self.legacy_model
+        
+        if stored is not None and stored != self.model:
+            raise ValueError(
+                f"Índice FAISS em {self.data_dir} tem vetores do modelo {stored}, não de {self.model}: "
+                "use outro FAISS_DATA_DIR ou reindexe os documentos"
+            )
+        if not os.path.exists(model_path):
+            with open(f"{model_path}.tmp", "w") as fh:
+                fh.write(self.model)
+            os.replace(f"{model_path}.tmp", model_path)
+    
+    def _remove_stale_generations(self) -> None:
+        """Apaga gerações abandonadas por uma compactação interrompida"""
+        for name in os.listdir(self.data_dir):
+            path = os.path.join(self.data_dir, name)
+            if name.startswith("gen-") and os.path.isdir(path) and path != self._generation_dir:
+                logger.warning(f"Removendo geração FAISS abandonada {name}")
+                shutil.rmtree(path, ignore_errors=True)
+    
+    def _set_generation(self, generation_dir: str) -> None:
+        self._generation_dir = generation_dir
+        self._vectors_path = os.path.join(generation_dir, self.VECTORS_FILE)
+        self._keys_path = os.path.join(generation_dir, self.KEYS_FILE)
+        self._tombstones_path = os.path.join(generation_dir, self.TOMBSTONES_FILE)
+        self._index_path = os.path.join(generation_dir, self.INDEX_FILE)
+        self._meta_path = os.path.join(generation_dir, self.META_FILE)
+    
+    def _open_logs(self) -> None:
+        self._vectors_fh = open(self._vectors_path, "ab")
+        self._keys_fh = open(self._keys_path, "ab")
+        self._tombstones_fh = open(self._tombstones_path, "ab")
+    
+    def _close_logs(self) -> None:
+        for fh in (self._vectors_fh, self._keys_fh, self._tombstones_fh):
+            fh.close()
+    
+    def _load(self) -> None:
+        """Recupera os logs e carrega o snapshot (ou reconstrói a partir do log)"""
+        keys = self._recover_logs()
+        self.id_map = IdMap(keys)
+        self.ntotal = len(keys)
+        self._deleted = self._read_tombstones()
+        self.id_map.remove(self._deleted)
+        
+        snapshot_ntotal = self._read_snapshot()
+        self._snapshot_ntotal = snapshot_ntotal or 0
+        if snapshot_ntotal is None:
+            snapshot_ntotal = 0
+            if self.ntotal:
+                logger.info("Snapshot FAISS ausente ou inválido, reconstruindo a partir do log")
+            
+            # Corpus grande demais para o Flat provisório: treinar já na partida
+            staging = not self._training_due(self.ntotal)
+            index, spec, profile = self._build_index(self.vectors(), self.ntotal, staging)
+            self._install(index, spec, profile, self.ntotal)
+            if not staging and self.ntotal:
+                self._snapshot_ntotal = -1
+        else:
+            self._add_range(self.index, self.vectors(), snapshot_ntotal, self.ntotal)
+        
+        logger.info(
+            f"Índice FAISS carregado: {self.ntotal} vetores ({snapshot_ntotal} do snapshot, "
+            f"{len(self._deleted)} removidos), tipo {self.index_spec}"
+        )
+    
+    def _recover_logs(self) -> List[str]:
+        """Lê os logs e descarta appends incompletos de um crash anterior"""
+        keys: List[str] = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as fh:
+                data = fh.read()
+            # A última linha sem "\n" é um append interrompido
+            keys = [line.decode("utf-8") for line in data.split(b"\n")[:-1]]
+        
+        vector_rows = 0
+        if os.path.exists(self._vectors_path):
+            vector_rows = os.path.getsize(self._vectors_path) // self.row_bytes
+        
+        valid = min(len(keys), vector_rows)
+        keys = keys[:valid]
+        
+        # Truncar os dois logs no último registro completo
+        keys_size = sum(len(key.encode("utf-8")) + 1 for key in keys)
+        for path, size in ((self._keys_path, keys_size), (self._vectors_path, valid * self.row_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                logger.warning(f"Truncando log incompleto {path} em {size} bytes")
+                with open(path, "r+b") as fh:
+                    fh.truncate(size)
+        
+        return keys
+    
+    def _read_tombstones(self) -> set:
+        if not os.path.exists(self._tombstones_path):
+            return set()
+        with open(self._tombstones_path, "rb") as fh:
+            lines = fh.read().split(b"\n")[:-1]
+        return {int(line) for line in lines if line and int(line) < self.ntotal}
+    
+    def _read_snapshot(self) -> Optional[int]:
+        """Carrega o snapshot se for compatível com o log atual"""
+        if not (os.path.exists(self._index_path) and os.path.exists(self._meta_path)):
+            return None
+        
+        try:
+            with open(self._meta_path) as fh:
+                meta = json.load(fh)
+            
+            if meta.get("dim") != self.dim or meta.get("ntotal", 0) > self.ntotal:
+                return None
+            
+            # Com mmap, um IVF é lido com OnDiskInvertedLists somente leitura e
+            # o próximo add falharia: só os tipos que continuam graváveis usam mmap
+            spec = meta.get("spec", "Flat")
+            flags = faiss.IO_FLAG_MMAP if self.use_mmap and not spec.startswith("IVF") else 0
+            index = faiss.read_index(self._index_path, flags)
+            if index.d != self.dim or index.ntotal != meta["ntotal"]:
+                return None
+            
+            self._install(
+                index,
+                spec,
+                meta.get("profile", self.STAGING_PROFILE),
+                meta.get("trained_ntotal", 0)
+            )
+            return meta["ntotal"]
+        
+        except Exception as e:
+            logger.error(f"Erro ao ler snapshot FAISS: {e}")
+            return None
+    
+    def vectors(self) -> np.ndarray:
+        """Vetores do log mapeados em memória (somente leitura)"""
+        with self.lock:
+            path, ntotal = self._vectors_path, self.ntotal
+        return self._map_vectors(path, ntotal)
+    
+    def _map_vectors(self, path: str, ntotal: int) -> np.ndarray:
+        if ntotal == 0:
+            return np.empty((0, self.dim), dtype="float32")
+        return np.memmap(path, dtype="float32", mode="r", shape=(ntotal, self.dim))
+    
+    def keys_page(self, start: int, limit: int) -> Tuple[List[str], Optional[int]]:
+        """Chaves vivas com ids em [start, start + limit) e o início da próxima página (None no fim)"""
+        with self.lock:
+            end = min(start + limit, self.ntotal)
+            keys = [key for key in self.id_map.keys_for(np.arange(start, end)) if key is not None]
+            return keys, (end if end < self.ntotal else None)
+    
+    def get_vectors(self, keys: List[str]) -> Tuple[List[str], np.ndarray]:
+        """Vetores das chaves vivas (as desconhecidas são ignoradas)"""
+        with self.lock:
+            found = [key for key in keys if key in self.id_map]
+            ids = self.id_map.ids_for(found)
+            return found, np.array(self.vectors()[ids], dtype="float32")
+    
+    def _add_range(self, index: faiss.Index, vectors: np.ndarray, start: int, end: int) -> None:
+        """Adiciona ao índice as linhas [start, end) de vectors"""
+        for offset in range(start, end, self.batch_size):
+            batch = np.ascontiguousarray(vectors[offset:min(offset + self.batch_size, end)])
+            index.add(batch)
+    
+    def _target_profile(self) -> str:
+        """Identifica a configuração de índice desejada (persistida no snapshot)"""
+        return json.dumps({"kind": self.index_kind, **self.index_options}, sort_keys=True)
+    
+    def _create_target(self, ntotal: int) -> Tuple[faiss.Index, str]:
+        return create_index(self.index_kind, self.dim, ntotal, **self.index_options)
+    
+    def _training_due(self, ntotal: int) -> bool:
+        """O índice configurado já pode ser construído com ntotal vetores"""
+        return not self._target_needs_training or ntotal >= self.train_min
+    
+    @contextmanager
+    def _index_writes(self) -> Iterator[None]:
+        """Alteração do índice ativo: espera um snapshot em andamento e exclui as buscas"""
+        with self.index_write_lock, self.index_lock.write():
+            yield
+    
+    def _install(self, index: faiss.Index, spec: str, profile: str, trained_ntotal: int) -> None:
+        apply_defaults(index, self.nprobe, self.ef_search)
+        self.index = index
+        self.index_spec = spec
+        self.index_profile = profile
+        self._trained_ntotal = trained_ntotal
+    
+    def _build_index(
+        self,
+        vectors: np.ndarray,
+        ntotal: int,
+        staging: bool = False
+    ) -> Tuple[faiss.Index, str, str]:
+        """Cria, treina e popula um índice com as ntotal primeiras linhas de vectors.
+        
+        Com staging=True cria o Flat provisório em vez do índice configurado.
+        """
+        if staging:
+            index, spec, profile = faiss.IndexFlatL2(self.dim), "Flat", self.STAGING_PROFILE
+        else:
+            index, spec = self._create_target(ntotal)
+            profile = self._target_profile()
+        
+        if not index.is_trained:
+            ivf = faiss.try_extract_index_ivf(index)
+            sample_size = max(self.train_sample, 40 * ivf.nlist if ivf is not None else 0)
+            sample_size = min(ntotal, sample_size)
+            rows = np.sort(np.random.default_rng().choice(ntotal, size=sample_size, replace=False))
+            logger.info(f"Treinando índice {spec} com {sample_size} vetores")
+            index.train(np.ascontiguousarray(vectors[rows]))
+        
+        self._add_range(index, vectors, 0, ntotal)
+        return index, spec, profile
+    
+    def _needs_migration(self) -> bool:
+        """Verifica se o índice deve ser (re)construído no tipo configurado"""
+        if self._maintenance_running():
+            return False
+        
+        if self.index_profile != self._target_profile():
+            return self._training_due(self.ntotal)
+        
+        if self._target_needs_training and self.retrain_growth > 0:
+            return self.ntotal >= self.retrain_growth * max(self._trained_ntotal, 1)
+        
+        return False
+    
+    def _needs_compaction(self) -> bool:
+        """Verifica se a fração de tombstones justifica reescrever o índice"""
+        if self._maintenance_running() or not self.ntotal:
+            return False
+        dead = len(self._deleted)
+        return dead >= self.compact_min and dead / self.ntotal >= self.compact_ratio
+    
+    def _maintenance_running(self) -> bool:
+        return bool(self._maintenance_thread and self._maintenance_thread.is_alive())
+    
+    def _start_maintenance(self, target: Callable[[], None], name: str) -> bool:
+        """Executa migração ou compactação em uma thread de fundo (uma por vez)"""
+        if self._maintenance_running():
+            return False
+        
+        def run():
+            try:
+                target()
+            except Exception as e:
+                logger.error(f"Erro na {name} do índice FAISS: {e}")
+        
+        self._maintenance_thread = threading.Thread(target=run, daemon=True)
+        self._maintenance_thread.start()
+        return True
+    
+    def migrate(self) -> None:
+        """Reconstrói o índice no tipo configurado e troca de forma atômica.
+        
+        A construção roda fora do lock sobre os vetores já gravados; só a
+        aplicação dos vetores que chegaram nesse meio tempo e a troca
+        acontecem com o lock.
+        """
+        with self._maintenance_lock:
+            vectors = self.vectors()
+            ntotal = len(vectors)
+            if ntotal == 0:
+                return
+            
+            logger.info(f"Migrando índice FAISS de {self.index_spec} para {self.index_kind} ({ntotal} vetores)")
+            index, spec, profile = self._build_index(vectors, ntotal)
+            
+            with self.lock:
+                self._add_range(index, self.vectors(), ntotal, self.ntotal)
+                with self._index_writes():
+                    self._install(index, spec, profile, self.ntotal)
+                    self._snapshot_ntotal = -1
+            
+            logger.info(f"Índice FAISS migrado para {spec}")
+            self.snapshot()
+    
+    def migrate_async(self) -> bool:
+        """Dispara a migração/re-treino em uma thread de fundo"""
+        return self._start_maintenance(self.migrate, "migração")
+    
+    def compact(self) -> None:
+        """Reescreve logs e índice sem os vetores removidos.
+        
+        A nova geração é escrita fora do lock com os vetores vivos até o
+        início da compactação; com o lock, aplica os vetores e remoções que
+        chegaram nesse meio tempo e troca a geração ativa.
+        """
+        with self._maintenance_lock:
+            with self.lock:
+                ntotal = self.ntotal
+                deleted = set(self._deleted)
+                keys = self.id_map.keys_list()
+            if not deleted:
+                return
+            
+            vectors = self.vectors()
+            alive = np.ones(ntotal, dtype=bool)
+            alive[list(deleted)] = False
+            live_ids = np.flatnonzero(alive)
+            logger.info(f"Compactando índice FAISS: {len(live_ids)} vivos, {len(deleted)} removidos")
+            
+            generation = f"gen-{int(time.time() * 1000)}"
+            generation_dir = os.path.join(self.data_dir, generation)
+            os.makedirs(generation_dir)
+            new_vectors_path = os.path.join(generation_dir, self.VECTORS_FILE)
+            new_keys_path = os.path.join(generation_dir, self.KEYS_FILE)
+            self._write_rows(new_vectors_path, new_keys_path, vectors, keys, live_ids)
+            
+            live_count = len(live_ids)
+            new_vectors = np.memmap(new_vectors_path, dtype="float32", mode="r", shape=(live_count, self.dim))
+            staging = not self._training_due(live_count)
+            index, spec, profile = self._build_index(new_vectors, live_count, staging)
+            self._write_snapshot(index, generation_dir, live_count, spec, profile, live_count)
+            
+            with self.lock:
+                # Vetores adicionados e removidos durante a compactação
+                keys = self.id_map.keys_list()
+                vectors = self.vectors()
+                tail_ids = np.array(
+                    [i for i in range(ntotal, self.ntotal) if i not in self._deleted],
+                    dtype="int64"
+                )
+                self._write_rows(new_vectors_path, new_keys_path, vectors, keys, tail_ids)
+                if len(tail_ids):
+                    index.add(np.ascontiguousarray(vectors[tail_ids]))
+                
+                remap = np.full(self.ntotal, -1, dtype="int64")
+                remap[live_ids] = np.arange(live_count)
+                remap[tail_ids] = live_count + np.arange(len(tail_ids))
+                carried = sorted(int(remap[i]) for i in self._deleted - deleted if remap[i] >= 0)
+                with open(os.path.join(generation_dir, self.TOMBSTONES_FILE), "wb") as fh:
+                    fh.write("".join(f"{i}\n" for i in carried).encode("utf-8"))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                
+                new_keys = [keys[i] for i in live_ids] + [keys[i] for i in tail_ids]
+                id_map = IdMap(new_keys)
+                id_map.remove(carried)
+                with self._index_writes():
+                    self._switch_generation(generation)
+                    self.id_map = id_map
+                    self.ntotal = len(new_keys)
+                    self._deleted = set(carried)
+                    self._selector = None
+                    self._install(index, spec, profile, live_count)
+                    self._snapshot_ntotal = live_count
+                self.compactions += 1
+            
+            logger.info(f"Índice FAISS compactado: {self.ntotal} vetores na geração {generation}")
+    
+    def compact_async(self) -> bool:
+        """Dispara a compactação em uma thread de fundo"""
+        return self._start_maintenance(self.compact, "compactação")
+    
+    def _write_rows(
+        self,
+        vectors_path: str,
+        keys_path: str,
+        vectors: np.ndarray,
+        keys: List[Optional[str]],
+        rows: np.ndarray
+    ) -> None:
+        """Acrescenta as linhas escolhidas de vectors/keys aos logs informados"""
+        with open(vectors_path, "ab") as vectors_fh, open(keys_path, "ab") as keys_fh:
+            for offset in range(0, len(rows), self.batch_size):
+                batch = rows[offset:offset + self.batch_size]
+                vectors_fh.write(np.ascontiguousarray(vectors[batch]).tobytes())
+                keys_fh.write("".join(f"{keys[i]}\n" for i in batch).encode("utf-8"))
+            for fh in (vectors_fh, keys_fh):
+                fh.flush()
+                os.fsync(fh.fileno())
+    
+    def _switch_generation(self, generation: str) -> None:
+        """Aponta o CURRENT para a nova geração e remove a anterior"""
+        old_dir = self._generation_dir
+        self._close_logs()
+        
+        current_path = os.path.join(self.data_dir, self.CURRENT_FILE)
+        with open(f"{current_path}.tmp", "w") as fh:
+            fh.write(generation)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(f"{current_path}.tmp", current_path)
+        
+        self._set_generation(os.path.join(self.data_dir, generation))
+        self._open_logs()
+        
+        if old_dir == self.data_dir:
+            for name in (self.VECTORS_FILE, self.KEYS_FILE, self.TOMBSTONES_FILE, self.INDEX_FILE, self.META_FILE):
+                path = os.path.join(old_dir, name)
+                if os.path.exists(path):
+                    os.unlink(path)
+        else:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    
+    def add(self, keys: List[str], vectors: np.ndarray, sync: bool = True) -> None:
+        """Grava os vetores no log (durável) e adiciona ao índice, em lotes"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(-1, self.dim)
+        if len(keys) != len(vectors):
+            raise ValueError("Quantidade de chaves e vetores diferente")
+        if not keys:
+            return
+        
+        batch_size = self.write_batch_size or len(keys)
+        for offset in range(0, len(keys), batch_size):
+            try:
+                self._add_batch(keys[offset:offset + batch_size], vectors[offset:offset + batch_size])
+            except Exception:
+                # Lotes já aplicados não podem ficar pela metade no índice
+                self.delete(keys[:offset])
+                raise
+        
+        with self.lock:
+            if sync:
+                os.fsync(self._vectors_fh.fileno())
+                os.fsync(self._keys_fh.fileno())
+            
+            if self._needs_migration():
+                self.migrate_async()
+            elif self.ntotal - self._snapshot_ntotal >= self.snapshot_every:
+                self.snapshot_async()
+    
+    def _add_batch(self, keys: List[str], vectors: np.ndarray) -> None:
+        """Log, índice e mapa de ids de um lote, de forma atômica para buscas e manutenção"""
+        with self.lock:
+            vectors_size = self._vectors_fh.tell()
+            keys_size = self._keys_fh.tell()
+            try:
+                # Vetores primeiro: uma chave só é válida se o vetor já está no disco
+                self._vectors_fh.write(vectors.tobytes())
+                self._vectors_fh.flush()
+                self._keys_fh.write("".join(f"{key}\n" for key in keys).encode("utf-8"))
+                self._keys_fh.flush()
+                with self._index_writes():
+                    self.index.add(vectors)
+                    self.id_map.append(keys)
+                    self.ntotal += len(keys)
+            except Exception:
+                # Falha no log ou no índice desfaz o lote no log: linhas a mais
+                # deslocariam os ids dos próximos lotes e voltariam no replay
+                self._vectors_fh.truncate(vectors_size)
+                self._keys_fh.truncate(keys_size)
+                raise
+    
+    def delete(self, keys: List[str]) -> int:
+        """Marca as chaves como removidas (tombstones) e retorna quantas existiam"""
+        with self.lock:
+            ids = self.id_map.ids_for(keys)
+            if not len(ids):
+                return 0
+            
+            self._tombstones_fh.write("".join(f"{i}\n" for i in ids).encode("utf-8"))
+            self._tombstones_fh.flush()
+            os.fsync(self._tombstones_fh.fileno())
+            
+            with self.index_lock.write():
+                self._deleted.update(ids.tolist())
+                self.id_map.remove(ids.tolist())
+                self._selector = None
+            
+            if self._needs_compaction():
+                self.compact_async()
+            
+            return len(ids)
+    
+    def _live_selector(self) -> Optional[Tuple[Any, ...]]:
+        """Seletor que exclui os tombstones (None se não houver remoções).
+        
+        Retorna a tupla (seletor, objetos referenciados): o IDSelectorNot só
+        guarda um ponteiro para o IDSelectorBatch, que precisa continuar vivo.
+        """
+        if not self._deleted:
+            return None
+        if self._selector is None:
+            dead = np.fromiter(self._deleted, dtype="int64", count=len(self._deleted))
+            batch = faiss.IDSelectorBatch(dead)
+            self._selector = (faiss.IDSelectorNot(batch), batch, dead)
+        return self._selector
+    
+    def _documents_selector(self, id_map: IdMap, document_ids: List[str], allowed: int) -> Tuple[Any, ...]:
+        """IDSelector com os ids vivos dos documentos.
+        
+        Conjuntos esparsos usam o IDSelectorBatch (hash dos ids); os densos,
+        um bitmap de ntotal bits. Retorna o seletor e os objetos que ele
+        referencia, que precisam continuar vivos durante a busca.
+        """
+        if allowed * 64 < len(id_map):
+            ids = id_map.ids_for_documents(document_ids)
+            return faiss.IDSelectorBatch(ids), ids
+        
+        bitmap = id_map.bitmap_for_documents(document_ids)
+        return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+    
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        document_ids: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """Busca os k vizinhos de cada query, já resolvidos em (chunk id, distância).
+        
+        Com document_ids, apenas chunks desses documentos são considerados.
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32").reshape(-1, self.dim)
+        candidate_ids = None
+        # Índice, mapa de ids e tombstones só mudam com a escrita no index_lock
+        with self.index_lock.read():
+            index, id_map = self.index, self.id_map
+            if document_ids is None:
+                selector = self._live_selector()
+            else:
+                selector = None
+                allowed = id_map.count_for_documents(document_ids)
+                if allowed == 0:
+                    return [[] for _ in range(len(queries))]
+                
+                if allowed <= self.prefilter_flat_max:
+                    candidate_ids = id_map.ids_for_documents(document_ids)
+                    vectors = self._map_vectors(self._vectors_path, self.ntotal)
+                    self.filtered_searches["flat_scan"] += 1
+                else:
+                    selector = self._documents_selector(id_map, document_ids, allowed)
+                    self.filtered_searches["selector"] += 1
+            
+            if candidate_ids is None:
+                params = search_params(index, nprobe, ef_search, selector[0] if selector else None)
+                distances, indices = index.search(queries, k, params=params)
+        
+        if candidate_ids is not None:
+            # Poucos candidatos: busca exata direto nos vetores do log
+            candidates = np.ascontiguousarray(vectors[candidate_ids])
+            distances, positions = faiss.knn(queries, candidates, min(k, len(candidate_ids)))
+            indices = np.where(positions >= 0, candidate_ids[positions], -1)
+        
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            keys = id_map.keys_for(row_indices)
+            results.append([
+                (key, float(distance))
+                for key, distance in zip(keys, row_distances)
+                if key is not None
+            ])
+        return results
+    
+    def sync(self) -> None:
+        """Força a gravação dos logs no disco"""
+        with self.lock:
+            for fh in (self._vectors_fh, self._keys_fh, self._tombstones_fh):
+                fh.flush()
+                os.fsync(fh.fileno())
+    
+    def _write_snapshot(
+        self,
+        index: faiss.Index,
+        generation_dir: str,
+        ntotal: int,
+        spec: str,
+        profile: str,
+        trained_ntotal: int
+    ) -> None:
+        index_path = os.path.join(generation_dir, self.INDEX_FILE)
+        meta_path = os.path.join(generation_dir, self.META_FILE)
+        
+        faiss.write_index(index, f"{index_path}.tmp")
+        with open(f"{meta_path}.tmp", "w") as fh:
+            json.dump({
+                "dim": self.dim,
+                "ntotal": ntotal,
+                "spec": spec,
+                "profile": profile,
+                "trained_ntotal": trained_ntotal
+            }, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        
+        # O meta.json é trocado por último: um snapshot sem meta válido é ignorado
+        os.replace(f"{index_path}.tmp", index_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+    
+    def snapshot(self) -> None:
+        """Grava o snapshot do índice de forma atômica.
+        
+        Com o index_write_lock o índice ativo não muda durante a gravação,
+        sem bloquear as buscas.
+        """
+        with self.index_write_lock:
+            if self.ntotal == self._snapshot_ntotal and os.path.exists(self._index_path):
+                return
+            
+            ntotal = self.ntotal
+            self._write_snapshot(
+                self.index,
+                self._generation_dir,
+                ntotal,
+                self.index_spec,
+                self.index_profile,
+                self._trained_ntotal
+            )
+            self._snapshot_ntotal = ntotal
+        
+        logger.info(f"Snapshot FAISS gravado: {ntotal} vetores")
+    
+    def snapshot_async(self) -> None:
+        """Dispara o snapshot em uma thread de fundo"""
+        if self._snapshot_thread and self._snapshot_thread.is_alive():
+            return
+        self._snapshot_thread = threading.Thread(target=self._safe_snapshot, daemon=True)
+        self._snapshot_thread.start()
+    
+    def _safe_snapshot(self) -> None:
+        try:
+            self.snapshot()
+        except Exception as e:
+            logger.error(f"Erro ao gravar snapshot FAISS: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estado atual do índice"""
+        dead = len(self._deleted)
+        return {
+            "ntotal": self.ntotal,
+            "live_vectors": self.ntotal - dead,
+            "dead_vectors": dead,
+            "dead_ratio": dead / self.ntotal if self.ntotal else 0.0,
+            "compactions": self.compactions,
+            "filtered_searches": dict(self.filtered_searches),
+            "index_spec": self.index_spec,
+            "index_kind": self.index_kind,
+            "model": self.model,
+            "matches_config": self.index_profile == self._target_profile(),
+            "trained_ntotal": self._trained_ntotal,
+            "maintenance_running": self._maintenance_running(),
+            "snapshot_ntotal": max(self._snapshot_ntotal, 0)
+        }
+    
+    def close(self) -> None:
+        """Grava o snapshot final e fecha os logs"""
+        for thread in (self._maintenance_thread, self._snapshot_thread):
+            if thread:
+                thread.join()
+        self.snapshot()
+        self._close_logs()
@@ -0,0 +1,155 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+CHUNK_SEPARATOR = "_chunk_"
+
+
+def document_id_of(key: str) -> str:
+    """Extrai o document_id de um chunk id no formato {document_id}_chunk_{n}"""
+    return key.rsplit(CHUNK_SEPARATOR, 1)[0]
+
+
+def chunk_keys(document_id: str, chunks: List[str]) -> List[str]:
+    """Chunk ids derivados do conteúdo: {document_id}_chunk_{hash}.
+    
+    O mesmo texto no mesmo documento gera sempre o mesmo id, então uma nova
+    versão do documento reaproveita os chunks que não mudaram. Textos
+    repetidos no documento recebem o sufixo -n a partir da segunda ocorrência.
+    """
+    keys = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:24]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        suffix = f"-{occurrence}" if occurrence else ""
+        keys.append(f"{document_id}{CHUNK_SEPARATOR}{digest}{suffix}")
+    return keys
+
+
+class IdMap:
+    """Mapeamento bidirecional entre ids int64 do FAISS e chunk ids.
+    
+    Os ids do FAISS são densos e crescentes (id N = N-ésimo vetor do log),
+    então o sentido id -> chave é uma lista indexada pelo próprio id e o
+    sentido chave -> id é um dicionário. As duas consultas são O(1).
+    Ids removidos continuam ocupando a posição na lista (como None) até a
+    próxima compactação do índice.
+    
+    Também mantém, por documento, os intervalos de ids que ele ocupa (os
+    chunks de um documento são gravados juntos, então normalmente é um só
+    intervalo) e um vetor de ids vivos, usados na busca filtrada.
+    """
+    
+    def __init__(self, keys: Optional[Iterable[str]] = None):
+        self._keys: List[Optional[str]] = []
+        self._ids: Dict[str, int] = {}
+        self._ranges: Dict[str, List[Tuple[int, int]]] = {}
+        self._live_per_document: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self.append(list(keys or []))
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._ids
+    
+    def append(self, keys: List[str]) -> range:
+        """Registra novas chaves e retorna os ids atribuídos"""
+        start = len(self._keys)
+        end = start + len(keys)
+        
+        if end > len(self._alive):
+            alive = np.zeros(max(end, 2 * len(self._alive), 1024), dtype=bool)
+            alive[:start] = self._alive[:start]
+            self._alive = alive
+        self._alive[start:end] = True
+        
+        for i, key in enumerate(keys):
+            faiss_id = start + i
+            self._ids[key] = faiss_id
+            document_id = document_id_of(key)
+            ranges = self._ranges.setdefault(document_id, [])
+            if ranges and ranges[-1][1] == faiss_id:
+                ranges[-1] = (ranges[-1][0], faiss_id + 1)
+            else:
+                ranges.append((faiss_id, faiss_id + 1))
+            self._live_per_document[document_id] = self._live_per_document.get(document_id, 0) + 1
+        
+        self._keys.extend(keys)
+        return range(start, end)
+    
+    @property
+    def live_count(self) -> int:
+        return len(self._ids)
+    
+    def remove(self, faiss_ids: Iterable[int]) -> None:
+        """Libera os ids removidos; eles passam a resolver para None"""
+        for faiss_id in faiss_ids:
+            key = self._keys[faiss_id]
+            if key is None:
+                continue
+            # A chave pode ter sido gravada de novo depois (id mais recente)
+            if self._ids.get(key) == faiss_id:
+                del self._ids[key]
+            self._keys[faiss_id] = None
+            self._alive[faiss_id] = False
+            
+            document_id = document_id_of(key)
+            self._live_per_document[document_id] -= 1
+            if not self._live_per_document[document_id]:
+                del self._live_per_document[document_id]
+                del self._ranges[document_id]
+    
+    def alive(self, faiss_ids: np.ndarray) -> np.ndarray:
+        """Máscara dos ids que não foram removidos"""
+        return self._alive[faiss_ids]
+    
+    def keys_list(self) -> List[Optional[str]]:
+        """Cópia da lista id -> chave"""
+        return list(self._keys)
+    
+    def key(self, faiss_id: int) -> Optional[str]:
+        if 0 <= faiss_id < len(self._keys):
+            return self._keys[faiss_id]
+        return None
+    
+    def id(self, key: str) -> Optional[int]:
+        return self._ids.get(key)
+    
+    def keys_for(self, faiss_ids: np.ndarray) -> List[Optional[str]]:
+        """Resolve um vetor de ids (ids -1 do FAISS viram None)"""
+        return [self.key(int(faiss_id)) for faiss_id in faiss_ids]
+    
+    def ids_for(self, keys: Iterable[str]) -> np.ndarray:
+        """Resolve chaves em ids, ignorando as desconhecidas"""
+        ids = [self._ids[key] for key in keys if key in self._ids]
+        return np.array(ids, dtype="int64")
+    
+    def count_for_documents(self, document_ids: Iterable[str]) -> int:
+        """Quantidade de ids vivos dos documentos informados"""
+        return sum(self._live_per_document.get(document_id, 0) for document_id in set(document_ids))
+    
+    def ids_for_documents(self, document_ids: Iterable[str]) -> np.ndarray:
+        """Ids vivos dos documentos informados, em ordem crescente"""
+        ranges = [
+            np.arange(start, end, dtype="int64")
+            for document_id in set(document_ids)
+            for start, end in self._ranges.get(document_id, [])
+        ]
+        if not ranges:
+            return np.zeros(0, dtype="int64")
+        ids = np.sort(np.concatenate(ranges))
+        return ids[self._alive[ids]]
+    
+    def bitmap_for_documents(self, document_ids: Iterable[str]) -> np.ndarray:
+        """Bitmap (um bit por id, ordem little-endian) dos ids vivos dos documentos"""
+        bits = np.zeros(len(self._keys), dtype=bool)
+        for document_id in set(document_ids):
+            for start, end in self._ranges.get(document_id, []):
+                bits[start:end] = True
+        bits &= self._alive[:len(self._keys)]
+        return np.packbits(bits, bitorder="little")
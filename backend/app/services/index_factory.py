@@ -0,0 +1,103 @@
+import math
+from typing import Optional, Tuple
+
+import faiss
+
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def auto_nlist(ntotal: int) -> int:
+    """Quantidade de listas IVF proporcional a sqrt(n), como recomenda o FAISS"""
+    nlist = 4 * int(math.sqrt(max(ntotal, 1)))
+    return max(16, min(nlist, 65536))
+
+
+def index_spec(
+    kind: str,
+    dim: int,
+    ntotal: int = 0,
+    nlist: int = 0,
+    pq_m: int = 64,
+    hnsw_m: int = 32,
+    scalar_quantizer: str = ""
+) -> str:
+    """Monta a string do faiss.index_factory para o tipo configurado"""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Tipo de índice desconhecido: {kind}")
+    
+    encoding = scalar_quantizer or "Flat"
+    
+    if kind == "flat":
+        return encoding
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m}" if encoding == "Flat" else f"HNSW{hnsw_m}_{encoding}"
+    
+    nlist = nlist or auto_nlist(ntotal)
+    if kind == "ivf_flat":
+        return f"IVF{nlist},{encoding}"
+    if dim % pq_m:
+        raise ValueError(f"pq_m={pq_m} precisa dividir a dimensão {dim}")
+    return f"IVF{nlist},PQ{pq_m}"
+
+
+def create_index(
+    kind: str,
+    dim: int,
+    ntotal: int = 0,
+    nlist: int = 0,
+    pq_m: int = 64,
+    hnsw_m: int = 32,
+    hnsw_ef_construction: int = 200,
+    scalar_quantizer: str = ""
+) -> Tuple[faiss.Index, str]:
+    """Cria um índice vazio e retorna junto com sua spec.
+    
+    Índices IVF e de quantização escalar saem com is_trained=False e
+    precisam de train() antes do primeiro add().
+    """
+    spec = index_spec(kind, dim, ntotal, nlist, pq_m, hnsw_m, scalar_quantizer)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_L2)
+    
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efConstruction = hnsw_ef_construction
+    
+    return index, spec
+
+
+def search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    sel: Optional[faiss.IDSelector] = None
+) -> Optional[faiss.SearchParameters]:
+    """Parâmetros de busca por requisição conforme o tipo real do índice.
+    
+    Valores não informados mantêm os padrões já aplicados no índice; sel
+    restringe a busca aos ids aceitos pelo seletor.
+    """
+    extra = {"sel": sel} if sel is not None else {}
+    
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if nprobe is None and sel is None:
+            return None
+        return faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe, **extra)
+    
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        if ef_search is None and sel is None:
+            return None
+        return faiss.SearchParametersHNSW(efSearch=ef_search or hnsw.efSearch, **extra)
+    
+    return faiss.SearchParameters(**extra) if sel is not None else None
+
+
+def apply_defaults(index: faiss.Index, nprobe: int, ef_search: int) -> None:
+    """Aplica os valores padrão de nprobe/efSearch no índice"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
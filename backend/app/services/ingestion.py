@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from services.job_queue import JobQueue
+from utils.metrics import BYTES, stage_timer
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _write_items(path: str, items: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def _read_items(path: str) -> Iterator[Dict[str, Any]]:
+    """Itens do documento, um por linha, lidos sob demanda"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class IngestionPipeline:
+    """Etapas da ingestão executadas a partir da fila de jobs.
+    
+    download, extract e embed rodam nos workers; index roda no processo da
+    API, único dono do índice vetorial. Cada etapa grava o que produziu no
+    spool do job e devolve, para o payload, os nomes desses arquivos.
+    """
+    
+    def __init__(
+        self,
+        queue: JobQueue,
+        document_service: Optional[Any] = None,
+        embedding_service: Optional[Any] = None,
+        vector_service: Optional[Any] = None
+    ):
+        self.queue = queue
+        self.document_service = document_service
+        self.embedding_service = embedding_service
+        self.vector_service = vector_service
+    
+    def _path(self, job: Dict[str, Any], name: str) -> str:
+        return os.path.join(self.queue.spool_dir(job["id"]), name)
+    
+    async def download(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        source_file = "source" + os.path.splitext(job["filename"] or "")[1]
+        with stage_timer("download"):
+            size = await self.document_service.download_to_file(job["payload"]["file_url"], self._path(job, source_file))
+        BYTES.inc(size, source="download")
+        return {"source_file": source_file, "bytes": size}
+    
+    async def extract(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        with stage_timer("extraction"):
+            text, metadata, items = await self.document_service.extract_file(
+                self._path(job, job["payload"]["source_file"]),
+                job["filename"]
+            )
+        await asyncio.to_thread(_write_text, self._path(job, "text.txt"), text)
+        await asyncio.to_thread(_write_items, self._path(job, "items.jsonl"), items)
+        return {"text_file": "text.txt", "items_file": "items.jsonl", "metadata": metadata, "pages": metadata.get("pages")}
+    
+    def _chunk(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
+        items = _read_items(self._path(job, job["payload"]["items_file"]))
+        return [
+            {"text": chunk.text, "metadata": chunk.metadata()}
+            for chunk in self.document_service.chunk_items(items)
+        ]
+    
+    async def embed(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Tokenização é CPU: fora do event loop
+        with stage_timer("chunking"):
+            chunks = await asyncio.to_thread(self._chunk, job)
+        with stage_timer("embedding"):
+            embeddings = await self.embedding_service.embed([chunk["text"] for chunk in chunks])
+        
+        await asyncio.to_thread(_write_text, self._path(job, "chunks.json"), json.dumps(chunks, ensure_ascii=False))
+        await asyncio.to_thread(np.save, self._path(job, "embeddings.npy"), embeddings)
+        return {
+            "chunks_file": "chunks.json",
+            "embeddings_file": "embeddings.npy",
+            "embedding_model": self.embedding_service.model,
+            "chunk_count": len(chunks)
+        }
+    
+    async def index(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        payload = job["payload"]
+        # Worker e API com modelos diferentes misturariam vetores no índice
+        model = self.vector_service.embedding_service.model
+        if payload.get("embedding_model", model) != model:
+            raise ValueError(f"Embeddings gerados com {payload['embedding_model']}, mas o índice usa {model}")
+        
+        text = await asyncio.to_thread(_read_text, self._path(job, payload["text_file"]))
+        chunks = json.loads(await asyncio.to_thread(_read_text, self._path(job, payload["chunks_file"])))
+        embeddings = await asyncio.to_thread(np.load, self._path(job, payload["embeddings_file"]))
+        
+        # document_id, chunk_count e chunks novos/reaproveitados/removidos
+        with stage_timer("index"):
+            return await self.vector_service.store_document(
+                chunks=[chunk["text"] for chunk in chunks],
+                filename=job["filename"],
+                original_text=text,
+                metadata=payload["metadata"],
+                embeddings=embeddings if chunks else None,
+                chunk_metadatas=[chunk["metadata"] for chunk in chunks],
+                source_id=job["file_id"]
+            )
@@ -0,0 +1,181 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Set
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from services.job_queue import JobQueue
+from utils.metrics import JOB_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+# Eventos lidos por consulta à fila
+EVENTS_BATCH = 1000
+
+
+class JobEventHub:
+    """Entrega os eventos dos jobs assim que são gravados na fila.
+    
+    Os eventos são gravados por qualquer processo (workers e API) em
+    job_events; o hub, no processo da API, acompanha a tabela a cada
+    poll_interval com uma única consulta pela sequência e repassa cada
+    evento aos assinantes do job (streams de /job-events) e, se o job tem
+    callback_url, a um POST para essa URL. Os callbacks de um job saem em
+    ordem, com até retries novas tentativas; jobs diferentes não esperam
+    uns pelos outros. Eventos gravados com a API parada não geram callback.
+    
+    O callback_url vem do cliente, então o servidor não pode ser usado para
+    alcançar a rede interna: só http(s), sem seguir redirects, e o host
+    precisa estar em allowed_hosts ou, sem lista, resolver apenas para
+    endereços públicos (verificado ao criar o job e a cada entrega).
+    """
+    
+    def __init__(
+        self,
+        queue: JobQueue,
+        poll_interval: float = 0.25,
+        callback_timeout: float = 10.0,
+        callback_retries: int = 3,
+        allowed_hosts: Iterable[str] = ()
+    ):
+        self.queue = queue
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.poll_interval = poll_interval
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.callbacks: Dict[str, Deque[Dict[str, Any]]] = {}
+        self.deliveries: Set[asyncio.Task] = set()
+        self.last_seq = 0
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.task: Optional[asyncio.Task] = None
+    
+    async def start(self) -> None:
+        self.last_seq = await asyncio.to_thread(self.queue.last_event_seq)
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.callback_timeout))
+        self.task = asyncio.create_task(self._tail())
+    
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        # Callbacks em andamento têm até um timeout para terminar
+        if self.deliveries:
+            _, unfinished = await asyncio.wait(set(self.deliveries), timeout=self.callback_timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+    
+    async def check_callback_url(self, url: str) -> None:
+        """Levanta ValueError se o callback_url não é um destino permitido"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("callback_url precisa ser uma URL http(s)")
+        host = parts.hostname.lower()
+        if self.allowed_hosts:
+            if host not in self.allowed_hosts:
+                raise ValueError(f"Host {host} fora de JOBS_CALLBACK_ALLOWED_HOSTS")
+            return
+        
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            raise ValueError(f"Host {host} não encontrado") from None
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                raise ValueError(f"callback_url aponta para um endereço interno ({address})")
+    
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Fila que recebe os próximos eventos do job"""
+        events: asyncio.Queue = asyncio.Queue()
+        self.subscribers.setdefault(job_id, set()).add(events)
+        return events
+    
+    def unsubscribe(self, job_id: str, events: asyncio.Queue) -> None:
+        subscribers = self.subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(events)
+            if not subscribers:
+                del self.subscribers[job_id]
+    
+    async def _tail(self) -> None:
+        while True:
+            try:
+                events = await asyncio.to_thread(self.queue.events_after, self.last_seq, EVENTS_BATCH)
+            except Exception as e:
+                logger.error(f"Erro ao ler eventos de jobs: {e}")
+                events = []
+            
+            for event in events:
+                self.last_seq = event["seq"]
+                self._publish(event)
+            # Lote cheio: ainda há eventos atrasados, sem esperar
+            if len(events) < EVENTS_BATCH:
+                await asyncio.sleep(self.poll_interval)
+    
+    def _publish(self, event: Dict[str, Any]) -> None:
+        callback_url = event.pop("callback_url", None)
+        for subscriber in self.subscribers.get(event["job_id"], ()):
+            subscriber.put_nowait(event)
+        if not callback_url:
+            return
+        
+        pending = self.callbacks.get(event["job_id"])
+        if pending is not None:
+            # Já há uma entrega em andamento para o job: entra no fim da fila dele
+            pending.append({**event, "callback_url": callback_url})
+            return
+        self.callbacks[event["job_id"]] = deque([{**event, "callback_url": callback_url}])
+        task = asyncio.create_task(self._deliver(event["job_id"]))
+        self.deliveries.add(task)
+        task.add_done_callback(self.deliveries.discard)
+    
+    async def _deliver(self, job_id: str) -> None:
+        """Envia os callbacks pendentes do job, um por vez e em ordem"""
+        pending = self.callbacks[job_id]
+        try:
+            while pending:
+                event = pending.popleft()
+                await self._post(event.pop("callback_url"), event)
+        finally:
+            del self.callbacks[job_id]
+    
+    async def _post(self, url: str, event: Dict[str, Any]) -> None:
+        for attempt in range(self.callback_retries + 1):
+            try:
+                # O DNS pode ter mudado desde a criação do job
+                await self.check_callback_url(url)
+                async with self.session.post(url, json=event, allow_redirects=False) as response:
+                    if response.status < 400:
+                        JOB_CALLBACKS.inc(result="delivered")
+                        return
+                    error = f"HTTP {response.status}"
+            except ValueError as e:
+                # Destino recusado: novas tentativas não mudam nada
+                error = str(e)
+                break
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            if attempt < self.callback_retries:
+                await asyncio.sleep(2 ** attempt)
+        
+        JOB_CALLBACKS.inc(result="failed")
+        logger.warning(f"Callback do job {event['job_id']} ({event['event']}) não entregue em {url}: {error}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_seq": self.last_seq,
+            "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values()),
+            "pending_callbacks": sum(len(pending) for pending in self.callbacks.values())
+        }
+
@@ -0,0 +1,515 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.metrics import JOBS_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# Etapas da ingestão, na ordem; cada job avança de uma para a seguinte
+STAGES = ("download", "extract", "embed", "index")
+STAGE_PROGRESS = {"download": 10, "extract": 30, "embed": 50, "index": 80}
+
+# Eventos que encerram o job (depois deles o stream de eventos fecha)
+FINAL_EVENTS = ("completed", "failed")
+# Campos das atualizações das etapas publicados nos eventos (contagens e ids)
+EVENT_FIELDS = (
+    "bytes", "pages", "chunk_count", "chunks_new", "chunks_reused", "chunks_removed",
+    "unchanged", "document_id", "embedding_model"
+)
+
+StageHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class LeaseLostError(Exception):
+    """O job deixou de ser do worker (devolvido à fila por falta de heartbeat)"""
+
+
+class JobQueue:
+    """Fila durável de jobs de ingestão em SQLite.
+    
+    Cada job guarda a etapa em que está e um payload JSON com o que as
+    etapas anteriores produziram (arquivos intermediários ficam no spool
+    do job). Um worker reivindica um job de uma etapa, executa e o devolve
+    à fila na etapa seguinte, então etapas diferentes de jobs diferentes
+    rodam em paralelo e em processos distintos. Jobs reivindicados por um
+    worker que parou de mandar heartbeat voltam para a fila.
+    
+    Cada mudança de etapa grava um evento em job_events, na mesma transação
+    da mudança do job: a sequência dos eventos é a ordem em que aconteceram,
+    vindos de qualquer processo (API ou workers). Jobs terminados e seus
+    eventos são apagados por expire.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        spool_dir: str,
+        max_attempts: int = 3,
+        retry_base: float = 10.0
+    ):
+        self.path = path
+        self.spool_root = spool_dir
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(spool_dir, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL, progress INTEGER NOT NULL, "
+            "filename TEXT, file_id TEXT, payload TEXT NOT NULL, result TEXT, error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, "
+            "locked_by TEXT, heartbeat_at REAL, started_at TEXT NOT NULL, completed_at TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs(status, stage, available_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(status, completed_at)")
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "callback_url" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN callback_url TEXT")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, event TEXT NOT NULL, "
+            "data TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events(job_id, seq)")
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+    
+    def _event(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        """Grava um evento do job (chamado dentro da transação da mudança)"""
+        self.db.execute(
+            "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data, ensure_ascii=False), time.time())
+        )
+    
+    def spool_dir(self, job_id: str) -> str:
+        """Diretório dos arquivos intermediários do job"""
+        path = os.path.join(self.spool_root, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+    
+    def remove_spool(self, job_id: str) -> None:
+        shutil.rmtree(os.path.join(self.spool_root, job_id), ignore_errors=True)
+    
+    def enqueue(
+        self,
+        stage: str,
+        payload: Dict[str, Any],
+        filename: Optional[str] = None,
+        file_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        callback_url: Optional[str] = None
+    ) -> str:
+        """Cria o job na etapa stage; callback_url recebe os eventos do job por POST"""
+        job_id = job_id or str(uuid.uuid4())
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, stage, progress, filename, file_id, payload, available_at, started_at, "
+                "callback_url) VALUES (?, 'processing', ?, 0, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, stage, filename, file_id, json.dumps(payload), time.time(),
+                    datetime.now().isoformat(), callback_url
+                )
+            )
+            self._event(job_id, "queued", {"stage": stage, "filename": filename, "file_id": file_id})
+        return job_id
+    
+    def claim(self, stage: str, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Reivindica o job mais antigo disponível na etapa"""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'processing' AND stage = ? "
+                "AND locked_by IS NULL AND available_at <= ? ORDER BY available_at LIMIT 1",
+                (stage, now)
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET locked_by = ?, heartbeat_at = ? WHERE id = ?",
+                    (worker_id, now, row["id"])
+                )
+                self._event(row["id"], "stage_started", {
+                    "stage": stage,
+                    "progress": row["progress"],
+                    "attempt": row["attempts"] + 1,
+                    "worker": worker_id
+                })
+        
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["locked_by"] = worker_id
+        return job
+    
+    def heartbeat(self, job_id: str, worker_id: str) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND locked_by = ?",
+                (time.time(), job_id, worker_id)
+            )
+    
+    def advance(self, job: Dict[str, Any], updates: Dict[str, Any], seconds: Optional[float] = None) -> None:
+        """Conclui a etapa atual (que levou seconds): o job volta à fila na próxima etapa ou termina.
+        
+        Levanta LeaseLostError se o job não é mais do worker que o reivindicou.
+        """
+        payload = {**job["payload"], **updates}
+        next_index = STAGES.index(job["stage"]) + 1
+        final = next_index == len(STAGES)
+        counts = {field: payload[field] for field in EVENT_FIELDS if field in payload}
+        
+        with self._transaction() as db:
+            self._event(job["id"], "stage_completed", {
+                "stage": job["stage"],
+                "seconds": seconds,
+                **{field: updates[field] for field in EVENT_FIELDS if field in updates}
+            })
+            if not final:
+                stage = STAGES[next_index]
+                cursor = db.execute(
+                    "UPDATE jobs SET stage = ?, progress = ?, payload = ?, attempts = 0, error = NULL, "
+                    "locked_by = NULL, available_at = ? WHERE id = ? AND locked_by = ?",
+                    (stage, STAGE_PROGRESS[stage], json.dumps(payload), time.time(), job["id"], job["locked_by"])
+                )
+                self._check_lease(cursor, job)
+            else:
+                cursor = db.execute(
+                    "UPDATE jobs SET status = 'completed', progress = 100, payload = ?, result = ?, error = NULL, "
+                    "locked_by = NULL, completed_at = ? WHERE id = ? AND locked_by = ?",
+                    (json.dumps(payload), json.dumps(updates), datetime.now().isoformat(), job["id"], job["locked_by"])
+                )
+                self._check_lease(cursor, job)
+                self._event(job["id"], "completed", {
+                    "progress": 100,
+                    "stage_seconds": self._stage_seconds(job["id"]),
+                    **counts
+                })
+        if final:
+            self.remove_spool(job["id"])
+    
+    def fail(self, job: Dict[str, Any], error: str, seconds: Optional[float] = None) -> bool:
+        """Registra a falha da etapa; retorna True se o job esgotou as tentativas.
+        
+        Levanta LeaseLostError se o job não é mais do worker que o reivindicou.
+        """
+        attempts = job["attempts"] + 1
+        final = attempts >= self.max_attempts
+        retry_in = self.retry_base * 2 ** (attempts - 1)
+        
+        with self._transaction() as db:
+            if final:
+                cursor = db.execute(
+                    "UPDATE jobs SET status = 'error', attempts = ?, error = ?, locked_by = NULL, "
+                    "completed_at = ? WHERE id = ? AND locked_by = ?",
+                    (attempts, error, datetime.now().isoformat(), job["id"], job["locked_by"])
+                )
+                self._check_lease(cursor, job)
+                self._event(job["id"], "failed", {
+                    "stage": job["stage"],
+                    "seconds": seconds,
+                    "attempt": attempts,
+                    "error": error
+                })
+            else:
+                cursor = db.execute(
+                    "UPDATE jobs SET attempts = ?, error = ?, locked_by = NULL, available_at = ? "
+                    "WHERE id = ? AND locked_by = ?",
+                    (attempts, error, time.time() + retry_in, job["id"], job["locked_by"])
+                )
+                self._check_lease(cursor, job)
+                self._event(job["id"], "stage_failed", {
+                    "stage": job["stage"],
+                    "seconds": seconds,
+                    "attempt": attempts,
+                    "error": error,
+                    "retry_in": retry_in
+                })
+        
+        if final:
+            self.remove_spool(job["id"])
+        return final
+    
+    @staticmethod
+    def _check_lease(cursor: sqlite3.Cursor, job: Dict[str, Any]) -> None:
+        """Nenhuma linha alterada: o job foi devolvido à fila (e desfaz a transação)"""
+        if cursor.rowcount == 0:
+            raise LeaseLostError(f"Job {job['id']} não pertence mais ao worker {job['locked_by']}")
+    
+    def requeue_stale(self, stale_seconds: float) -> int:
+        """Devolve à fila jobs de workers que pararam de mandar heartbeat.
+        
+        A etapa interrompida conta como uma tentativa, como em fail: um job
+        que derruba o worker (falta de memória num PDF enorme, por exemplo)
+        volta com backoff e, esgotadas as tentativas, termina com erro.
+        """
+        failed = []
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT id, stage, locked_by, attempts FROM jobs "
+                "WHERE status = 'processing' AND locked_by IS NOT NULL AND heartbeat_at < ?",
+                (time.time() - stale_seconds,)
+            ).fetchall()
+            for row in rows:
+                attempts = row["attempts"] + 1
+                error = f"Worker {row['locked_by']} parou de responder na etapa {row['stage']}"
+                if attempts >= self.max_attempts:
+                    db.execute(
+                        "UPDATE jobs SET status = 'error', attempts = ?, error = ?, locked_by = NULL, "
+                        "completed_at = ? WHERE id = ?",
+                        (attempts, error, datetime.now().isoformat(), row["id"])
+                    )
+                    self._event(row["id"], "failed", {
+                        "stage": row["stage"],
+                        "seconds": None,
+                        "attempt": attempts,
+                        "error": error
+                    })
+                    failed.append(row["id"])
+                else:
+                    retry_in = self.retry_base * 2 ** (attempts - 1)
+                    db.execute(
+                        "UPDATE jobs SET attempts = ?, error = ?, locked_by = NULL, available_at = ? WHERE id = ?",
+                        (attempts, error, time.time() + retry_in, row["id"])
+                    )
+                    self._event(row["id"], "stage_requeued", {
+                        "stage": row["stage"],
+                        "worker": row["locked_by"],
+                        "attempt": attempts,
+                        "retry_in": retry_in
+                    })
+        
+        for job_id in failed:
+            self.remove_spool(job_id)
+        return len(rows)
+    
+    def expire(self, ttl_seconds: float) -> int:
+        """Apaga jobs terminados (concluídos ou com erro) há mais de ttl_seconds e seus eventos"""
+        cutoff = (datetime.now() - timedelta(seconds=ttl_seconds)).isoformat()
+        with self._transaction() as db:
+            db.execute(
+                "DELETE FROM job_events WHERE job_id IN ("
+                "SELECT id FROM jobs WHERE status IN ('completed', 'error') AND completed_at < ?)",
+                (cutoff,)
+            )
+            cursor = db.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'error') AND completed_at < ?",
+                (cutoff,)
+            )
+        return cursor.rowcount
+    
+    def _stage_seconds(self, job_id: str) -> Dict[str, float]:
+        """Duração de cada etapa concluída (a última tentativa)"""
+        timings = {}
+        for row in self.db.execute(
+            "SELECT data FROM job_events WHERE job_id = ? AND event = 'stage_completed' ORDER BY seq",
+            (job_id,)
+        ):
+            data = json.loads(row["data"])
+            if data.get("seconds") is not None:
+                timings[data["stage"]] = data["seconds"]
+        return timings
+    
+    @staticmethod
+    def _event_row(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "seq": row["seq"],
+            "job_id": row["job_id"],
+            "event": row["event"],
+            "data": json.loads(row["data"]),
+            "created_at": row["created_at"]
+        }
+    
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """Eventos do job com sequência maior que after, em ordem"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after)
+            ).fetchall()
+        return [self._event_row(row) for row in rows]
+    
+    def events_after(self, after: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Eventos de todos os jobs depois de after, com o callback_url do job"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT e.*, j.callback_url FROM job_events e LEFT JOIN jobs j ON j.id = e.job_id "
+                "WHERE e.seq > ? ORDER BY e.seq LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return [{**self._event_row(row), "callback_url": row["callback_url"]} for row in rows]
+    
+    def last_event_seq(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events").fetchone()[0]
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status público do job"""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            stage_seconds = self._stage_seconds(job_id)
+        
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "filename": row["filename"],
+            "file_id": row["file_id"],
+            "attempts": row["attempts"],
+            "started_at": row["started_at"],
+            "completed_at": row["completed_at"],
+            "stage_seconds": stage_seconds
+        }
+        if row["error"]:
+            job["error"] = row["error"]
+        if row["result"]:
+            job.update(json.loads(row["result"]))
+        return job
+    
+    def counts(self) -> Dict[str, int]:
+        """Jobs por status/etapa, para monitoramento"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT status, stage, COUNT(*) FROM jobs GROUP BY status, stage"
+            ).fetchall()
+        counts: Dict[str, int] = {}
+        for status, stage, count in rows:
+            key = f"{status}:{stage}" if status == "processing" else status
+            counts[key] = counts.get(key, 0) + count
+        return counts
+    
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+class JobRunner:
+    """Executa etapas da fila com concorrência própria por etapa.
+    
+    handlers mapeia etapa -> (função async que recebe o job e retorna as
+    atualizações do payload, quantidade de jobs simultâneos). Com
+    finished_ttl, o runner também apaga os jobs terminados há mais tempo.
+    """
+    
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, Tuple[StageHandler, int]],
+        worker_id: str,
+        poll_interval: float = 1.0,
+        heartbeat_interval: float = 30.0,
+        stale_seconds: float = 900.0,
+        finished_ttl: float = 0.0
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_seconds = stale_seconds
+        self.finished_ttl = finished_ttl
+        self.tasks: List[asyncio.Task] = []
+        self.running: set = set()
+    
+    def start(self) -> None:
+        for stage, (handler, concurrency) in self.handlers.items():
+            self.tasks.append(asyncio.create_task(self._stage_loop(stage, handler, concurrency)))
+        self.tasks.append(asyncio.create_task(self._maintenance_loop()))
+    
+    async def stop(self) -> None:
+        """Para de reivindicar jobs e espera os que estão em execução"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+    
+    async def _stage_loop(self, stage: str, handler: StageHandler, concurrency: int) -> None:
+        slots = asyncio.Semaphore(concurrency)
+        while True:
+            await slots.acquire()
+            try:
+                job = await asyncio.to_thread(self.queue.claim, stage, self.worker_id)
+            except Exception as e:
+                logger.error(f"Erro ao consultar a fila ({stage}): {e}")
+                job = None
+            
+            if job is None:
+                slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+            
+            task = asyncio.create_task(self._run(job, handler, slots))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+    
+    async def _run(self, job: Dict[str, Any], handler: StageHandler, slots: asyncio.Semaphore) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        JOBS_IN_FLIGHT.inc(stage=job["stage"])
+        start = time.perf_counter()
+        try:
+            try:
+                updates = await handler(job)
+            except Exception as e:
+                final = await asyncio.to_thread(self.queue.fail, job, str(e), round(time.perf_counter() - start, 3))
+                logger.error(
+                    f"Job {job['id']} falhou na etapa {job['stage']}: {e}"
+                    + (" (sem novas tentativas)" if final else "")
+                )
+            else:
+                await asyncio.to_thread(self.queue.advance, job, updates, round(time.perf_counter() - start, 3))
+        except LeaseLostError:
+            # Outro worker refaz a etapa: o resultado deste é descartado
+            logger.warning(f"Job {job['id']} devolvido à fila durante a etapa {job['stage']}; resultado descartado")
+        finally:
+            JOBS_IN_FLIGHT.dec(stage=job["stage"])
+            heartbeat.cancel()
+            slots.release()
+    
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await asyncio.to_thread(self.queue.heartbeat, job_id, self.worker_id)
+    
+    async def _maintenance_loop(self) -> None:
+        while True:
+            try:
+                requeued = await asyncio.to_thread(self.queue.requeue_stale, self.stale_seconds)
+                if requeued:
+                    logger.warning(f"{requeued} job(s) sem heartbeat devolvidos à fila (ou encerrados com erro)")
+            except Exception as e:
+                logger.error(f"Erro ao devolver jobs à fila: {e}")
+            if self.finished_ttl:
+                try:
+                    expired = await asyncio.to_thread(self.queue.expire, self.finished_ttl)
+                    if expired:
+                        logger.info(f"{expired} job(s) terminados expirados")
+                except Exception as e:
+                    logger.error(f"Erro ao expirar jobs: {e}")
+            await asyncio.sleep(self.stale_seconds / 4)
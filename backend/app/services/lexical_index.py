@@ -0,0 +1,565 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.id_map import IdMap
+from utils.rwlock import RWLock
+
+logger = logging.getLogger(__name__)
+
+# Termos com pontuação interna (CVE-2021-44228, host.exemplo.com, 10.0.0.1,
+# user@dominio) são mantidos inteiros, além de suas partes
+TOKEN_PATTERN = re.compile(r"\w(?:[\w.:/@-]*\w)?")
+SEPARATOR_PATTERN = re.compile(r"[.:/@-]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = SEPARATOR_PATTERN.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if len(part) > 1)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    """Hash de 64 bits do termo (o índice não guarda os termos em si)"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _map_array(path: str, dtype: str) -> np.ndarray:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class LexicalIndex:
+    """Índice invertido BM25 persistente, para buscas por termos exatos.
+    
+    Layout de cada geração de dados:
+      docs.log        - log de append, uma linha JSON por chunk com o tamanho
+                        e a frequência de cada termo (linha N = doc N)
+      keys.log        - log de append com um chunk id por linha (linha N = doc N)
+      tombstones.log  - docs removidos, um por linha
+      terms.u64       - hashes dos termos do segmento, em ordem crescente
+      offsets.i64     - início das postings de cada termo no segmento
+      postings.i32    - docs de cada termo
+      freqs.f32       - frequência do termo em cada posting
+      lengths.f32     - tamanho (em termos) de cada doc do segmento
+      meta.json       - docs e bytes do docs.log cobertos pelo segmento
+    
+    O segmento é lido com mmap e consultado por busca binária nos hashes;
+    os docs gravados depois dele ficam num delta em memória, reconstruído
+    do docs.log na partida. Quando delta e remoções passam de merge_every
+    docs, um merge em background escreve uma geração nova só com os docs
+    vivos e troca o CURRENT, como na compactação do FaissStore.
+    
+    Buscas rodam em paralelo (leitura no index_lock) e não passam pelo lock
+    dos logs: só esperam enquanto um lote de docs, uma remoção ou a troca de
+    geração do merge é aplicada à memória (escrita exclusiva). Inclusões
+    grandes entram em lotes de write_batch_size docs, liberando os locks
+    entre um lote e outro para as buscas.
+    """
+    
+    DOCS_FILE = "docs.log"
+    KEYS_FILE = "keys.log"
+    TOMBSTONES_FILE = "tombstones.log"
+    TERMS_FILE = "terms.u64"
+    OFFSETS_FILE = "offsets.i64"
+    POSTINGS_FILE = "postings.i32"
+    FREQS_FILE = "freqs.f32"
+    LENGTHS_FILE = "lengths.f32"
+    META_FILE = "meta.json"
+    CURRENT_FILE = "CURRENT"
+    
+    def __init__(
+        self,
+        data_dir: str,
+        k1: float = 1.2,
+        b: float = 0.75,
+        merge_every: int = 20000,
+        write_batch_size: int = 2048
+    ):
+        self.data_dir = data_dir
+        self.k1 = k1
+        self.b = b
+        self.merge_every = merge_every
+        self.write_batch_size = write_batch_size
+        # Logs e manutenção (as buscas não usam)
+        self.lock = threading.RLock()
+        # Busca (leitura) contra alterações do estado em memória (escrita)
+        self.index_lock = RWLock()
+        self.merges = 0
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._maintenance_lock = threading.Lock()
+        
+        os.makedirs(data_dir, exist_ok=True)
+        self._set_generation(self._read_current())
+        self._remove_stale_generations()
+        self._load()
+        self._open_logs()
+        
+        if self._needs_merge():
+            self.merge_async()
+    
+    def _read_current(self) -> str:
+        current_path = os.path.join(self.data_dir, self.CURRENT_FILE)
+        if os.path.exists(current_path):
+            with open(current_path) as fh:
+                name = fh.read().strip()
+            if name and os.path.isdir(os.path.join(self.data_dir, name)):
+                return os.path.join(self.data_dir, name)
+        return self.data_dir
+    
+    def _remove_stale_generations(self) -> None:
+        for name in os.listdir(self.data_dir):
+            path = os.path.join(self.data_dir, name)
+            if name.startswith("gen-") and os.path.isdir(path) and path != self._generation_dir:
+                logger.warning(f"Removendo geração léxica abandonada {name}")
+                shutil.rmtree(path, ignore_errors=True)
+    
+    def _set_generation(self, generation_dir: str) -> None:
+        self._generation_dir = generation_dir
+        self._docs_path = os.path.join(generation_dir, self.DOCS_FILE)
+        self._keys_path = os.path.join(generation_dir, self.KEYS_FILE)
+        self._tombstones_path = os.path.join(generation_dir, self.TOMBSTONES_FILE)
+    
+    def _open_logs(self) -> None:
+        self._docs_fh = open(self._docs_path, "ab")
+        self._keys_fh = open(self._keys_path, "ab")
+        self._tombstones_fh = open(self._tombstones_path, "ab")
+    
+    def _close_logs(self) -> None:
+        for fh in (self._docs_fh, self._keys_fh, self._tombstones_fh):
+            fh.close()
+    
+    def _read_meta(self, keys: int) -> Tuple[int, int]:
+        """Docs e bytes do docs.log cobertos pelo segmento (0, 0 sem segmento válido)"""
+        meta_path = os.path.join(self._generation_dir, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return 0, 0
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+            if meta["docs"] > keys:
+                logger.error("Segmento léxico maior que o log, reconstruindo a partir do log")
+                return 0, 0
+            return meta["docs"], meta["log_size"]
+        except Exception as e:
+            logger.error(f"Erro ao ler segmento léxico: {e}")
+            return 0, 0
+    
+    def _load(self) -> None:
+        """Carrega o segmento (mmap) e reaplica o restante do docs.log no delta"""
+        keys: List[str] = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as fh:
+                keys = [line.decode("utf-8") for line in fh.read().split(b"\n")[:-1]]
+        
+        segment_docs, log_size = self._read_meta(len(keys))
+        if segment_docs:
+            directory = self._generation_dir
+            terms = _map_array(os.path.join(directory, self.TERMS_FILE), "uint64")
+            offsets = _map_array(os.path.join(directory, self.OFFSETS_FILE), "int64")
+            postings = _map_array(os.path.join(directory, self.POSTINGS_FILE), "int32")
+            freqs = _map_array(os.path.join(directory, self.FREQS_FILE), "float32")
+            segment_lengths = np.array(_map_array(os.path.join(directory, self.LENGTHS_FILE), "float32"))
+        else:
+            terms = np.zeros(0, dtype="uint64")
+            offsets = np.zeros(1, dtype="int64")
+            postings = np.zeros(0, dtype="int32")
+            freqs = np.zeros(0, dtype="float32")
+            segment_lengths = np.zeros(0, dtype="float32")
+        
+        # Docs posteriores ao segmento; a última linha sem "\n" é um append interrompido
+        tail: List[bytes] = []
+        if os.path.exists(self._docs_path):
+            with open(self._docs_path, "rb") as fh:
+                fh.seek(log_size)
+                tail = fh.read().split(b"\n")[:-1]
+        valid = min(len(keys), segment_docs + len(tail))
+        keys, tail = keys[:valid], tail[:valid - segment_docs]
+        
+        docs_size = log_size + sum(len(line) + 1 for line in tail)
+        keys_size = sum(len(key.encode("utf-8")) + 1 for key in keys)
+        for path, size in ((self._docs_path, docs_size), (self._keys_path, keys_size)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                logger.warning(f"Truncando log incompleto {path} em {size} bytes")
+                with open(path, "r+b") as fh:
+                    fh.truncate(size)
+        
+        id_map = IdMap(keys)
+        lengths = np.zeros(max(len(keys), 1024), dtype="float32")
+        lengths[:segment_docs] = segment_lengths[:segment_docs]
+        delta: Dict[int, List[Tuple[int, float]]] = {}
+        for doc, line in enumerate(tail, start=segment_docs):
+            length, frequencies = json.loads(line)
+            lengths = self._index_into(lengths, delta, doc, length, frequencies)
+        
+        deleted = set()
+        if os.path.exists(self._tombstones_path):
+            with open(self._tombstones_path, "rb") as fh:
+                deleted = {int(line) for line in fh.read().split(b"\n")[:-1] if line and int(line) < valid}
+        id_map.remove(deleted)
+        total_length = float(lengths[:valid].sum() - lengths[list(deleted)].sum())
+        
+        # Tudo lido: as buscas só esperam a troca do estado
+        with self.index_lock.write():
+            self._terms, self._offsets, self._postings, self._freqs = terms, offsets, postings, freqs
+            self._segment_docs = segment_docs
+            self.id_map = id_map
+            self._lengths = lengths
+            self._delta = delta
+            self._deleted = deleted
+            self._total_length = total_length
+        
+        logger.info(
+            f"Índice léxico carregado: {valid} docs ({segment_docs} do segmento, "
+            f"{len(deleted)} removidos), {len(terms)} termos no segmento"
+        )
+    
+    @staticmethod
+    def _index_into(
+        lengths: np.ndarray,
+        delta: Dict[int, List[Tuple[int, float]]],
+        doc: int,
+        length: int,
+        frequencies: List[Tuple[int, int]]
+    ) -> np.ndarray:
+        """Registra o doc no delta; retorna lengths (realocado se precisou crescer)"""
+        if doc >= len(lengths):
+            grown = np.zeros(max(doc + 1, 2 * len(lengths)), dtype="float32")
+            grown[:len(lengths)] = lengths
+            lengths = grown
+        lengths[doc] = length
+        for term, frequency in frequencies:
+            delta.setdefault(term, []).append((doc, frequency))
+        return lengths
+    
+    @property
+    def doc_count(self) -> int:
+        return self.id_map.live_count
+    
+    def add(self, keys: List[str], texts: List[str]) -> None:
+        """Indexa os chunks (grava no log antes de atualizar a memória), em lotes"""
+        if not keys:
+            return
+        rows = []
+        for text in texts:
+            counts = Counter(term_hash(term) for term in tokenize(text))
+            rows.append((sum(counts.values()), list(counts.items())))
+        
+        batch_size = self.write_batch_size or len(keys)
+        for offset in range(0, len(keys), batch_size):
+            try:
+                self._add_batch(keys[offset:offset + batch_size], rows[offset:offset + batch_size])
+            except Exception:
+                self.delete(keys[:offset])
+                raise
+        
+        with self.lock:
+            os.fsync(self._docs_fh.fileno())
+            os.fsync(self._keys_fh.fileno())
+            if self._needs_merge():
+                self.merge_async()
+    
+    def _add_batch(self, keys: List[str], rows: List[Tuple[int, List[Tuple[int, int]]]]) -> None:
+        with self.lock:
+            docs_size = self._docs_fh.tell()
+            keys_size = self._keys_fh.tell()
+            try:
+                # Docs primeiro: uma chave só é válida se o doc já está no disco
+                self._docs_fh.write("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"))
+                self._docs_fh.flush()
+                self._keys_fh.write("".join(f"{key}\n" for key in keys).encode("utf-8"))
+                self._keys_fh.flush()
+            except Exception:
+                self._docs_fh.truncate(docs_size)
+                self._keys_fh.truncate(keys_size)
+                raise
+            
+            with self.index_lock.write():
+                start = len(self.id_map)
+                self.id_map.append(keys)
+                for doc, (length, frequencies) in enumerate(rows, start=start):
+                    self._lengths = self._index_into(self._lengths, self._delta, doc, length, frequencies)
+                    self._total_length += length
+    
+    def delete(self, keys: List[str]) -> int:
+        """Marca os chunks como removidos e retorna quantos existiam"""
+        with self.lock:
+            ids = self.id_map.ids_for(keys)
+            if not len(ids):
+                return 0
+            
+            self._tombstones_fh.write("".join(f"{i}\n" for i in ids).encode("utf-8"))
+            self._tombstones_fh.flush()
+            os.fsync(self._tombstones_fh.fileno())
+            
+            with self.index_lock.write():
+                self._deleted.update(ids.tolist())
+                self.id_map.remove(ids.tolist())
+                self._total_length -= float(self._lengths[ids].sum())
+            
+            if self._needs_merge():
+                self.merge_async()
+            
+            return len(ids)
+    
+    def _term_postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Docs e frequências do termo (segmento + delta)"""
+        docs, freqs = [], []
+        position = int(np.searchsorted(self._terms, np.uint64(term)))
+        if position < len(self._terms) and int(self._terms[position]) == term:
+            start, end = self._offsets[position], self._offsets[position + 1]
+            docs.append(np.asarray(self._postings[start:end]))
+            freqs.append(np.asarray(self._freqs[start:end]))
+        delta = self._delta.get(term)
+        if delta:
+            docs.append(np.array([doc for doc, _ in delta], dtype="int32"))
+            freqs.append(np.array([freq for _, freq in delta], dtype="float32"))
+        if not docs:
+            return np.zeros(0, dtype="int32"), np.zeros(0, dtype="float32")
+        return np.concatenate(docs), np.concatenate(freqs)
+    
+    def search(self, query: str, k: int, document_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Os k chunks de maior score BM25 para a query, como (chunk id, score).
+        
+        Com document_ids, apenas chunks desses documentos são considerados.
+        """
+        terms = list(dict.fromkeys(term_hash(term) for term in tokenize(query)))
+        if not terms:
+            return []
+        
+        # Só leitura do estado em memória: buscas simultâneas não se esperam
+        with self.index_lock.read():
+            live = self.id_map.live_count
+            if not live:
+                return []
+            allowed = None
+            if document_ids is not None:
+                allowed = self.id_map.ids_for_documents(document_ids)
+                if not len(allowed):
+                    return []
+            average_length = self._total_length / live
+            
+            hit_docs, hit_scores = [], []
+            for term in terms:
+                docs, freqs = self._term_postings(term)
+                alive = self.id_map.alive(docs)
+                docs, freqs = docs[alive], freqs[alive]
+                if not len(docs):
+                    continue
+                # idf sobre o corpus inteiro, mesmo numa busca filtrada
+                idf = math.log(1 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+                if allowed is not None:
+                    inside = np.isin(docs, allowed, assume_unique=True)
+                    docs, freqs = docs[inside], freqs[inside]
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[docs] / average_length)
+                hit_docs.append(docs)
+                hit_scores.append(idf * freqs * (self.k1 + 1) / (freqs + norm))
+            
+            if not hit_docs:
+                return []
+            docs, inverse = np.unique(np.concatenate(hit_docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+            if len(docs) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(docs))
+            top = top[np.argsort(-scores[top])]
+            return [(self.id_map.key(int(docs[i])), float(scores[i])) for i in top]
+    
+    def _needs_merge(self) -> bool:
+        if self._maintenance_running():
+            return False
+        pending = len(self.id_map) - self._segment_docs + len(self._deleted)
+        return pending >= self.merge_every
+    
+    def _maintenance_running(self) -> bool:
+        return bool(self._maintenance_thread and self._maintenance_thread.is_alive())
+    
+    def merge(self) -> None:
+        """Reescreve o índice (segmento e logs) só com os docs vivos.
+        
+        A geração nova é escrita fora do lock com os docs gravados até o
+        início do merge; com o lock, recebe os docs e remoções que chegaram
+        nesse meio tempo e passa a ser a ativa. As buscas só esperam a troca
+        do estado em memória, depois que a geração nova já foi lida.
+        """
+        with self._maintenance_lock:
+            with self.lock:
+                ndocs = len(self.id_map)
+                deleted = set(self._deleted)
+                keys = self.id_map.keys_list()
+                log_size = self._docs_fh.tell()
+                keys_size = self._keys_fh.tell()
+                docs_path = self._docs_path
+            
+            generation = f"gen-{int(time.time() * 1000)}"
+            generation_dir = os.path.join(self.data_dir, generation)
+            os.makedirs(generation_dir)
+            new_docs_path = os.path.join(generation_dir, self.DOCS_FILE)
+            new_keys_path = os.path.join(generation_dir, self.KEYS_FILE)
+            
+            live_ids = np.array([i for i in range(ndocs) if i not in deleted], dtype="int64")
+            terms, postings, freqs, lengths = [], [], [], []
+            with open(docs_path, "rb") as source, \
+                    open(new_docs_path, "wb") as docs_fh, \
+                    open(new_keys_path, "wb") as keys_fh:
+                new_doc = 0
+                for doc in range(ndocs):
+                    line = source.readline()
+                    if doc in deleted:
+                        continue
+                    length, frequencies = json.loads(line)
+                    docs_fh.write(line)
+                    keys_fh.write(f"{keys[doc]}\n".encode("utf-8"))
+                    lengths.append(length)
+                    if frequencies:
+                        pairs = np.array(frequencies, dtype="uint64")
+                        terms.append(pairs[:, 0])
+                        freqs.append(pairs[:, 1].astype("float32"))
+                        postings.append(np.full(len(pairs), new_doc, dtype="int32"))
+                    new_doc += 1
+                segment_size = docs_fh.tell()
+                for fh in (docs_fh, keys_fh):
+                    fh.flush()
+                    os.fsync(fh.fileno())
+            
+            self._write_segment(generation_dir, terms, postings, freqs, lengths, segment_size)
+            
+            with self.lock:
+                # Docs gravados e removidos durante o merge (copiados como estão nos logs)
+                total = len(self.id_map)
+                for source_path, new_path, offset in (
+                    (self._docs_path, new_docs_path, log_size),
+                    (self._keys_path, new_keys_path, keys_size)
+                ):
+                    with open(source_path, "rb") as source, open(new_path, "ab") as target:
+                        source.seek(offset)
+                        target.write(source.read())
+                        target.flush()
+                        os.fsync(target.fileno())
+                
+                remap = np.full(total, -1, dtype="int64")
+                remap[live_ids] = np.arange(len(live_ids))
+                remap[ndocs:] = len(live_ids) + np.arange(total - ndocs)
+                carried = sorted(int(remap[i]) for i in self._deleted - deleted)
+                with open(os.path.join(generation_dir, self.TOMBSTONES_FILE), "wb") as fh:
+                    fh.write("".join(f"{i}\n" for i in carried).encode("utf-8"))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                
+                self._switch_generation(generation)
+                self._load()
+                self.merges += 1
+            
+            logger.info(f"Índice léxico consolidado: {len(self.id_map)} docs na geração {generation}")
+    
+    def merge_async(self) -> bool:
+        """Dispara o merge em uma thread de fundo"""
+        if self._maintenance_running():
+            return False
+        
+        def run():
+            try:
+                self.merge()
+            except Exception as e:
+                logger.error(f"Erro no merge do índice léxico: {e}")
+        
+        self._maintenance_thread = threading.Thread(target=run, daemon=True)
+        self._maintenance_thread.start()
+        return True
+    
+    def _write_segment(
+        self,
+        generation_dir: str,
+        terms: List[np.ndarray],
+        postings: List[np.ndarray],
+        freqs: List[np.ndarray],
+        lengths: List[int],
+        log_size: int
+    ) -> None:
+        """Grava o segmento: postings agrupadas por termo, em ordem de doc"""
+        terms_all = np.concatenate(terms) if terms else np.zeros(0, dtype="uint64")
+        order = np.argsort(terms_all, kind="stable")
+        terms_all = terms_all[order]
+        unique_terms, starts = np.unique(terms_all, return_index=True)
+        offsets = np.append(starts, len(terms_all)).astype("int64")
+        
+        arrays = {
+            self.TERMS_FILE: unique_terms.astype("uint64"),
+            self.OFFSETS_FILE: offsets,
+            self.POSTINGS_FILE: (np.concatenate(postings) if postings else np.zeros(0, dtype="int32"))[order],
+            self.FREQS_FILE: (np.concatenate(freqs) if freqs else np.zeros(0, dtype="float32"))[order],
+            self.LENGTHS_FILE: np.array(lengths, dtype="float32")
+        }
+        for name, array in arrays.items():
+            with open(os.path.join(generation_dir, name), "wb") as fh:
+                fh.write(np.ascontiguousarray(array).tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+        
+        meta_path = os.path.join(generation_dir, self.META_FILE)
+        with open(f"{meta_path}.tmp", "w") as fh:
+            json.dump({"docs": len(lengths), "log_size": log_size}, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(f"{meta_path}.tmp", meta_path)
+    
+    def _switch_generation(self, generation: str) -> None:
+        """Aponta o CURRENT para a nova geração e remove a anterior"""
+        old_dir = self._generation_dir
+        self._close_logs()
+        
+        current_path = os.path.join(self.data_dir, self.CURRENT_FILE)
+        with open(f"{current_path}.tmp", "w") as fh:
+            fh.write(generation)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(f"{current_path}.tmp", current_path)
+        
+        self._set_generation(os.path.join(self.data_dir, generation))
+        self._open_logs()
+        
+        if old_dir == self.data_dir:
+            for name in (
+                self.DOCS_FILE, self.KEYS_FILE, self.TOMBSTONES_FILE, self.TERMS_FILE, self.OFFSETS_FILE,
+                self.POSTINGS_FILE, self.FREQS_FILE, self.LENGTHS_FILE, self.META_FILE
+            ):
+                path = os.path.join(old_dir, name)
+                if os.path.exists(path):
+                    os.unlink(path)
+        else:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "docs": len(self.id_map),
+                "live_docs": self.id_map.live_count,
+                "dead_docs": len(self._deleted),
+                "segment_docs": self._segment_docs,
+                "delta_docs": len(self.id_map) - self._segment_docs,
+                "segment_terms": len(self._terms),
+                "delta_terms": len(self._delta),
+                "merges": self.merges,
+                "maintenance_running": self._maintenance_running()
+            }
+    
+    def close(self) -> None:
+        if self._maintenance_thread:
+            self._maintenance_thread.join()
+        self._close_logs()
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import onnxruntime
+from tokenizers import Tokenizer
+
+from services.embedding_provider import EmbeddingProvider, Throughput
+from utils.metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model.int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+@dataclass
+class _PendingText:
+    text: str
+    future: asyncio.Future
+
+
+def quantize_int8(model_path: str, output_path: str) -> None:
+    """Quantização dinâmica dos pesos para int8 (ativações continuam float)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    
+    quantize_dynamic(model_path, f"{output_path}.tmp", weight_type=QuantType.QInt8)
+    os.replace(f"{output_path}.tmp", output_path)
+
+
+def token_counter(model_dir: str) -> Callable[[str], int]:
+    """Tamanho de um texto em tokens do modelo (com os especiais), sem truncar"""
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return lambda text: len(tokenizer.encode(text).ids)
+
+
+class LocalEmbeddingModel(EmbeddingProvider):
+    """Embeddings na CPU com um modelo ONNX no estilo sentence-transformers.
+    
+    model_dir tem o model.onnx e o tokenizer.json (formato da biblioteca
+    tokenizers) exportados do modelo. Em modo int8 é usado o
+    model.int8.onnx, gerado por quantização dinâmica na primeira carga se
+    não existir.
+    
+    Chamadas concorrentes entram numa fila única: a cada janela de
+    coalesce_ms as entradas pendentes são ordenadas por tamanho e divididas
+    em lotes de até batch_size, para que o padding de cada lote seja o
+    mínimo. Os lotes rodam em threads próprias (o ONNX Runtime solta o GIL),
+    até threads lotes ao mesmo tempo, cada um com intra_op_threads threads
+    de cálculo. A saída é o vetor da frase (pooling pela média dos tokens,
+    quando o modelo devolve os estados dos tokens), normalizado.
+    """
+    
+    def __init__(
+        self,
+        model_dir: str,
+        name: Optional[str] = None,
+        quantization: str = "float32",
+        batch_size: int = 32,
+        max_tokens: int = 256,
+        threads: int = 1,
+        intra_op_threads: int = 0,
+        coalesce_ms: int = 5
+    ):
+        if quantization not in ("float32", "int8"):
+            raise ValueError(f"Quantização inválida: {quantization}")
+        self.model_dir = model_dir
+        self.quantization = quantization
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.threads = max(threads, 1)
+        self.coalesce_ms = coalesce_ms
+        name = name or os.path.basename(os.path.normpath(model_dir))
+        self.model = f"local:{name}" + (":int8" if quantization == "int8" else "")
+        
+        model_path = os.path.join(model_dir, MODEL_FILE)
+        if quantization == "int8":
+            int8_path = os.path.join(model_dir, INT8_MODEL_FILE)
+            if not os.path.exists(int8_path):
+                logger.info(f"Quantizando {model_path} para int8")
+                quantize_int8(model_path, int8_path)
+            model_path = int8_path
+        
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+        
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        # A sessão é thread-safe: uma só para todos os lotes
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="local-embeddings")
+        
+        self.pending: Deque[_PendingText] = deque()
+        self.counters = {"inputs": 0, "batches": 0, "tokens": 0, "padding_tokens": 0, "truncated_inputs": 0}
+        self.completed = Throughput()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        # Dimensão do vetor da frase, pela saída do próprio modelo
+        self.dim = int(self._infer(["dim"])[0].shape[1])
+        logger.info(f"Modelo de embeddings local {self.model} carregado ({self.dim} dimensões)")
+    
+    def _infer(self, texts: List[str]) -> Tuple[np.ndarray, int, int, int]:
+        """Um lote pelo modelo: tokenização, inferência, pooling e normalização.
+        
+        Retorna os vetores, os tokens reais e totais (com padding) do lote e
+        quantas entradas foram truncadas em max_tokens.
+        """
+        encodings = self.tokenizer.encode_batch(texts)
+        truncated = sum(1 for encoding in encodings if encoding.overflowing)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype="int64")
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype="int64")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype="int64")
+        
+        output = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+        if output.ndim == 3:
+            # Estados dos tokens: média dos tokens reais (sem padding)
+            mask = attention_mask[:, :, None].astype("float32")
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        
+        output = np.ascontiguousarray(output, dtype="float32")
+        output /= np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        
+        return output, int(attention_mask.sum()), int(attention_mask.size), truncated
+    
+    def _ensure_dispatcher(self) -> None:
+        """Cria a fila e o despachante no event loop em execução"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.threads)
+        self._dispatcher = loop.create_task(self._dispatch())
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings dos textos, na mesma ordem"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        self._ensure_dispatcher()
+        
+        loop = asyncio.get_running_loop()
+        items = [_PendingText(text, loop.create_future()) for text in texts]
+        self.pending.extend(items)
+        self._wakeup.set()
+        return np.stack(await asyncio.gather(*(item.future for item in items)))
+    
+    async def _dispatch(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            
+            # Janela curta para juntar entradas de chamadas concorrentes
+            if self.coalesce_ms:
+                await asyncio.sleep(self.coalesce_ms / 1000)
+            
+            # Textos de tamanho parecido no mesmo lote: menos padding
+            items = sorted(
+                (item for item in self.pending if not item.future.done()),
+                key=lambda item: len(item.text)
+            )
+            self.pending.clear()
+            for start in range(0, len(items), self.batch_size):
+                await self._slots.acquire()
+                asyncio.create_task(self._run(items[start:start + self.batch_size]))
+    
+    async def _run(self, batch: List[_PendingText]) -> None:
+        try:
+            with STAGE_SECONDS.time(stage="embedding_local"):
+                vectors, tokens, padded_tokens, truncated = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    self._infer,
+                    [item.text for item in batch]
+                )
+        except Exception as e:
+            logger.error(f"Erro no modelo de embeddings local: {e}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        else:
+            self.counters["inputs"] += len(batch)
+            self.counters["batches"] += 1
+            self.counters["tokens"] += tokens
+            self.counters["padding_tokens"] += padded_tokens - tokens
+            if truncated:
+                # Só o início dessas entradas entrou no embedding
+                if not self.counters["truncated_inputs"]:
+                    logger.warning(f"Entradas passando de {self.max_tokens} tokens truncadas pelo modelo local")
+                self.counters["truncated_inputs"] += truncated
+            self.completed.add(len(batch))
+            for item, vector in zip(batch, vectors):
+                if not item.future.done():
+                    item.future.set_result(vector)
+        finally:
+            self._slots.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Contadores e vazão (chunks/s) no último minuto"""
+        return {
+            **self.counters,
+            "queued": len(self.pending),
+            "chunks_per_second": self.completed.rate()
+        }
+    
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,348 @@
+import asyncio
+import base64
+import hashlib
+import heapq
+import logging
+import threading
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+
+from services.faiss_store import FaissStore
+from services.id_map import document_id_of
+from utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash: ao passar de N para N + 1 buckets, só 1/(N + 1) das chaves muda"""
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(document_id: str, shards: int) -> int:
+    """Shard do documento (todos os chunks de um documento ficam no mesmo shard)"""
+    digest = hashlib.sha256(document_id.encode("utf-8")).digest()
+    return jump_hash(int.from_bytes(digest[:8], "big"), shards)
+
+
+def encode_vectors(vectors: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vectors, dtype="float32").tobytes()).decode("ascii")
+
+
+def decode_vectors(data: str, dim: int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="float32").reshape(-1, dim)
+
+
+def create_faiss_store(data_dir: str, dim: int, model: Optional[str] = None) -> FaissStore:
+    """FaissStore com a configuração de índice do ambiente"""
+    return FaissStore(
+        data_dir=data_dir,
+        dim=dim,
+        snapshot_every=settings.faiss_snapshot_every,
+        use_mmap=settings.faiss_mmap,
+        batch_size=settings.faiss_rebuild_batch_size,
+        index_kind=settings.faiss_index_type,
+        index_options={
+            "nlist": settings.faiss_nlist,
+            "pq_m": settings.faiss_pq_m,
+            "hnsw_m": settings.faiss_hnsw_m,
+            "hnsw_ef_construction": settings.faiss_hnsw_ef_construction,
+            "scalar_quantizer": settings.faiss_scalar_quantizer
+        },
+        train_min=settings.faiss_train_min,
+        train_sample=settings.faiss_train_sample,
+        retrain_growth=settings.faiss_retrain_growth,
+        nprobe=settings.faiss_nprobe,
+        ef_search=settings.faiss_ef_search,
+        compact_ratio=settings.faiss_compact_ratio,
+        compact_min=settings.faiss_compact_min,
+        prefilter_flat_max=settings.faiss_prefilter_flat_max,
+        write_batch_size=settings.index_write_batch_size,
+        model=model,
+        # Antes da marcação, todos os vetores vinham da API da OpenAI
+        legacy_model=settings.embedding_model
+    )
+
+
+def create_index_store(dim: int, model: Optional[str] = None) -> Any:
+    """Índice vetorial do processo: local (FAISS_DATA_DIR) ou particionado (FAISS_SHARDS)"""
+    urls = [url.strip().rstrip("/") for url in settings.faiss_shards.split(",") if url.strip()]
+    if not urls:
+        return create_faiss_store(settings.faiss_data_dir, dim, model)
+    return ShardedFaissStore(
+        urls,
+        dim,
+        model=model,
+        timeout=settings.faiss_shard_timeout,
+        write_batch_size=settings.index_write_batch_size
+    )
+
+
+class ShardClient:
+    """Chamadas HTTP de um processo para os servidores de shard (shard_server.py).
+    
+    O cliente tem um event loop próprio numa thread: os métodos síncronos
+    (chamados do pool de threads do VectorService) enviam as requisições a
+    todos os shards de uma vez e esperam o conjunto.
+    """
+    
+    def __init__(self, urls: List[str], timeout: float = 30.0):
+        self.urls = urls
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="shard-client", daemon=True)
+        self._thread.start()
+        self._session: aiohttp.ClientSession = self.call(self._open_session())
+    
+    async def _open_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+    
+    def call(self, coroutine: Awaitable[Any]) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+    
+    async def request(self, url: str, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Any:
+        async with self._session.request(method, f"{url}{path}", json=payload) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Shard {url}{path}: HTTP {response.status} {await response.text()}")
+            return await response.json()
+    
+    def scatter(self, method: str, path: str, payloads: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """A mesma rota em vários shards em paralelo ({url: payload} -> {url: resposta})"""
+        async def run() -> List[Any]:
+            return await asyncio.gather(*(
+                self.request(url, method, path, payload) for url, payload in payloads.items()
+            ))
+        
+        return dict(zip(payloads, self.call(run())))
+    
+    def broadcast(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.scatter(method, path, {url: payload for url in self.urls})
+    
+    def close(self) -> None:
+        self.call(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class ShardedFaissStore:
+    """Índice vetorial particionado por documento entre processos de shard.
+    
+    Cada shard é um shard_server.py com o seu próprio FaissStore (logs,
+    snapshot e threads de busca). O documento vai para o shard dado por
+    jump consistent hash do document_id sobre a lista de FAISS_SHARDS, então
+    inclusões e remoções vão direto ao shard dono. As buscas vão a todos os
+    shards em paralelo (ou só aos donos dos documentos filtrados) e os top-k
+    de cada um são fundidos pela distância.
+    
+    Expõe a mesma interface do FaissStore usada pelo VectorService. Mudar
+    a quantidade de shards exige redistribuir os documentos antes (ver
+    rebalance).
+    """
+    
+    def __init__(
+        self,
+        urls: List[str],
+        dim: int,
+        model: Optional[str] = None,
+        timeout: float = 30.0,
+        write_batch_size: int = 2048
+    ):
+        self.urls = urls
+        self.dim = dim
+        self.model = model
+        self.write_batch_size = write_batch_size
+        self.client = ShardClient(urls, timeout=timeout)
+        
+        for url, info in self.client.broadcast("GET", "/info").items():
+            if info["dim"] != dim or (model is not None and info["model"] != model):
+                self.client.close()
+                raise ValueError(
+                    f"Shard {url} tem vetores de {info['model']} ({info['dim']} dimensões), "
+                    f"não de {model} ({dim} dimensões)"
+                )
+        logger.info(f"Índice FAISS particionado em {len(urls)} shards")
+    
+    def shard_url(self, document_id: str) -> str:
+        return self.urls[shard_for(document_id, len(self.urls))]
+    
+    def _group(self, keys: List[str]) -> Dict[str, List[int]]:
+        """Posições das chaves agrupadas pelo shard do documento"""
+        groups: Dict[str, List[int]] = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(self.shard_url(document_id_of(key)), []).append(position)
+        return groups
+    
+    @property
+    def ntotal(self) -> int:
+        return sum(info["ntotal"] for info in self.client.broadcast("GET", "/info").values())
+    
+    def add(self, keys: List[str], vectors: np.ndarray, sync: bool = True) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(keys), self.dim)
+        groups = self._group(keys)
+        # Posições já enviadas a cada shard (inclusive o lote em andamento:
+        # após um timeout o shard pode ter gravado o lote mesmo assim)
+        sent: Dict[str, List[int]] = {url: [] for url in groups}
+        
+        async def add_to(url: str, positions: List[int]) -> None:
+            # Lotes de write_batch_size em sequência em cada shard
+            for start in range(0, len(positions), self.write_batch_size):
+                batch = positions[start:start + self.write_batch_size]
+                sent[url].extend(batch)
+                await self.client.request(url, "POST", "/add", {
+                    "keys": [keys[i] for i in batch],
+                    "vectors": encode_vectors(vectors[batch]),
+                    "sync": sync
+                })
+        
+        async def run() -> List[Any]:
+            return await asyncio.gather(
+                *(add_to(url, positions) for url, positions in groups.items()),
+                return_exceptions=True
+            )
+        
+        errors = [result for result in self.client.call(run()) if isinstance(result, BaseException)]
+        if errors:
+            # Sem vetores órfãos nos shards que gravaram: desfaz tudo, como o FaissStore.add
+            written = [(url, positions) for url, positions in sent.items() if positions]
+            
+            async def rollback() -> List[Any]:
+                return await asyncio.gather(*(
+                    self.client.request(url, "POST", "/delete", {"keys": [keys[i] for i in positions]})
+                    for url, positions in written
+                ), return_exceptions=True)
+            
+            for (url, _), result in zip(written, self.client.call(rollback())):
+                if isinstance(result, BaseException):
+                    logger.error(f"Erro ao desfazer a inclusão parcial no shard {url}: {result}")
+            raise errors[0]
+    
+    def delete(self, keys: List[str]) -> int:
+        groups = self._group(keys)
+        responses = self.client.scatter("POST", "/delete", {
+            url: {"keys": [keys[i] for i in positions]}
+            for url, positions in groups.items()
+        })
+        return sum(response["deleted"] for response in responses.values())
+    
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        document_ids: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        queries = np.ascontiguousarray(queries, dtype="float32").reshape(-1, self.dim)
+        encoded = encode_vectors(queries)
+        
+        # Com filtro, só os shards donos dos documentos participam
+        if document_ids is None:
+            targets: Dict[str, Optional[List[str]]] = {url: None for url in self.urls}
+        else:
+            targets = {}
+            for document_id in document_ids:
+                targets.setdefault(self.shard_url(document_id), []).append(document_id)
+        
+        responses = self.client.scatter("POST", "/search", {
+            url: {
+                "queries": encoded,
+                "k": k,
+                "nprobe": nprobe,
+                "ef_search": ef_search,
+                "document_ids": shard_documents
+            }
+            for url, shard_documents in targets.items()
+        })
+        
+        results = []
+        for row in range(len(queries)):
+            hits = (tuple(hit) for response in responses.values() for hit in response["results"][row])
+            results.append(heapq.nsmallest(k, hits, key=lambda hit: hit[1]))
+        return results
+    
+    def sync(self) -> None:
+        self.client.broadcast("POST", "/sync")
+    
+    def snapshot(self) -> None:
+        self.client.broadcast("POST", "/snapshot")
+    
+    def migrate_async(self) -> bool:
+        return any(response["started"] for response in self.client.broadcast("POST", "/migrate").values())
+    
+    def compact_async(self) -> bool:
+        return any(response["started"] for response in self.client.broadcast("POST", "/compact").values())
+    
+    def stats(self) -> Dict[str, Any]:
+        """Soma dos contadores dos shards, com o estado de cada um em shards"""
+        shards = self.client.broadcast("GET", "/stats")
+        totals: Dict[str, Any] = {}
+        for name in ("ntotal", "live_vectors", "dead_vectors", "compactions", "trained_ntotal", "snapshot_ntotal"):
+            totals[name] = sum(stats[name] for stats in shards.values())
+        first = next(iter(shards.values()))
+        return {
+            **totals,
+            "dead_ratio": totals["dead_vectors"] / totals["ntotal"] if totals["ntotal"] else 0.0,
+            "index_spec": first["index_spec"],
+            "index_kind": first["index_kind"],
+            "model": first["model"],
+            "matches_config": all(stats["matches_config"] for stats in shards.values()),
+            "maintenance_running": any(stats["maintenance_running"] for stats in shards.values()),
+            "shards": shards
+        }
+    
+    def close(self) -> None:
+        self.client.close()
+
+
+def rebalance(sources: List[str], targets: List[str], batch_size: int = 2048, timeout: float = 300.0) -> Dict[str, int]:
+    """Redistribui os documentos dos shards sources para o layout targets.
+    
+    Cada documento fica no shard de targets dado por shard_for; os que
+    estão em outro lugar são copiados (vetores lidos do log do shard de
+    origem) e removidos da origem. Shards que saem do layout são esvaziados.
+    Pode ser repetido depois de uma interrupção: a cópia remove antes as
+    chaves que já tenham chegado ao destino. A ingestão deve estar parada.
+    """
+    client = ShardClient(list(dict.fromkeys(sources + targets)), timeout=timeout)
+    moved: Dict[str, int] = {"documents": 0, "vectors": 0}
+    try:
+        for source in client.urls:
+            # Primeiro a lista completa: remoções podem disparar a compactação, que renumera os ids
+            keys: List[str] = []
+            start: Optional[int] = 0
+            while start is not None:
+                page = client.call(client.request(source, "GET", f"/keys?start={start}&limit={batch_size}"))
+                keys.extend(page["keys"])
+                start = page["next"]
+            
+            moving: Dict[str, List[str]] = {}
+            for key in keys:
+                target = targets[shard_for(document_id_of(key), len(targets))]
+                if target != source:
+                    moving.setdefault(target, []).append(key)
+            
+            for target, target_keys in moving.items():
+                for offset in range(0, len(target_keys), batch_size):
+                    batch = target_keys[offset:offset + batch_size]
+                    data = client.call(client.request(source, "POST", "/vectors", {"keys": batch}))
+                    client.call(client.request(target, "POST", "/delete", {"keys": data["keys"]}))
+                    client.call(client.request(target, "POST", "/add", {
+                        "keys": data["keys"],
+                        "vectors": data["vectors"],
+                        "sync": True
+                    }))
+                    client.call(client.request(source, "POST", "/delete", {"keys": data["keys"]}))
+                    moved["vectors"] += len(data["keys"])
+                moved["documents"] += len({document_id_of(key) for key in target_keys})
+                logger.info(f"{len(target_keys)} vetores movidos de {source} para {target}")
+    finally:
+        client.close()
+    return moved
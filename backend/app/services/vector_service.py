@@ -1,203 +1,836 @@
 import asyncio
-from typing import List, Dict, Any, Optional
+import contextvars
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Iterator, Tuple
 import numpy as np
-import faiss
 import chromadb
-from openai import AsyncOpenAI
 import uuid
 import logging
 from utils.config import get_settings
+from services.faiss_store import init_search_thread
+from services.sharded_store import create_index_store
+from services.embedding_service import EmbeddingService
+from services.id_map import chunk_keys
+from services.lexical_index import LexicalIndex
+from services.document_catalog import DocumentCatalog
+from services.corpus_snapshot import CorpusSnapshotReader, CorpusSnapshotWriter
+from utils.metrics import stage_timer
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Namespace dos document ids estáveis (uuid5)
+DOCUMENT_NAMESPACE = uuid.UUID("5b0f4a8e-2f6c-4c1e-9d1a-7f3e2b6c8a10")
+
+
+def document_id_for(source_id: Optional[str], content_hash: str) -> str:
+    """Id estável do documento: pelo file_id de origem ou, sem ele, pelo conteúdo"""
+    name = f"file:{source_id}" if source_id else f"sha256:{content_hash}"
+    return str(uuid.uuid5(DOCUMENT_NAMESPACE, name))
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, float]]], k: int = 60) -> Dict[str, float]:
+    """Funde rankings (já ordenados do melhor para o pior) somando 1 / (k + posição)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
 class VectorService:
+    """Chunks no ChromaDB, índices FAISS e léxico e catálogo de documentos.
+    
+    As chamadas bloqueantes (ChromaDB, FAISS, SQLite, disco) rodam num pool
+    de threads próprio, fora do event loop, então uma ingestão grande não
+    trava as buscas. As escritas (gravar e remover documentos) passam uma
+    de cada vez por write_lock; as buscas rodam em paralelo com elas.
+    """
+    
     def __init__(self):
-        self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
-        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        init_search_thread(settings.faiss_omp_threads)
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.vector_store_threads or None,
+            thread_name_prefix="vector-store",
+            initializer=init_search_thread,
+            initargs=(settings.faiss_omp_threads,)
+        )
+        self.write_lock = asyncio.Lock()
+        self.embedding_service = EmbeddingService()
+        self.chroma_client = chromadb.PersistentClient(path=settings.chroma_path)
         self.collection = self.chroma_client.get_or_create_collection("documents")
-        self.embedding_dim = 1536
-        self.faiss_index = faiss.IndexFlatL2(self.embedding_dim)
-        self.faiss_id_map = {}
-        self.next_faiss_id = 0
+        # Dimensão e marca dos vetores vêm do provedor de embeddings
+        self.embedding_dim = self.embedding_service.dim
+        self._check_collection_model()
+        # Chamados com os ids de documentos gravados ou removidos (ex.: cache de respostas)
+        self.document_listeners: List[Callable[[List[str]], None]] = []
+        # FAISS_SHARDS vazio: índice local; senão, os servidores de shard
+        self.faiss_store = create_index_store(self.embedding_dim, model=self.embedding_service.model)
+        
+        self.catalog = DocumentCatalog(settings.document_catalog_path, settings.processed_texts_path)
+        self.lexical_index = LexicalIndex(
+            settings.lexical_data_dir,
+            k1=settings.lexical_bm25_k1,
+            b=settings.lexical_bm25_b,
+            merge_every=settings.lexical_merge_every,
+            write_batch_size=settings.index_write_batch_size
+        )
+        
+        # Log vazio com Chroma populado: migrar os embeddings já existentes
+        if self.faiss_store.ntotal == 0 and self.collection.count() > 0:
+            self.rebuild_from_chroma()
+        if self.lexical_index.doc_count == 0 and self.collection.count() > 0:
+            self.rebuild_lexical_from_chroma()
+        if not self.catalog.get_meta("chroma_documents_migrated"):
+            self.migrate_documents_from_chroma()
     
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Gera embeddings usando OpenAI"""
-        try:
-            response = await self.openai_client.embeddings.create(
-                input=texts,
-                model="text-embedding-ada-002"
+    def _check_collection_model(self) -> None:
+        """Recusa uma coleção do ChromaDB com embeddings de outro modelo e a marca com o atual"""
+        metadata = self.collection.metadata or {}
+        stored = metadata.get("embedding_model")
+        if stored is None and self.collection.count() > 0:
+            stored = settings.embedding_model
+        
+        if stored is not None and stored != self.embedding_service.model:
+            raise ValueError(
+                f"Coleção do ChromaDB em {settings.chroma_path} tem embeddings do modelo {stored}, "
+                f"não de {self.embedding_service.model}: use outro CHROMA_PATH ou reindexe os documentos"
             )
-            return [item.embedding for item in response.data]
-        except Exception as e:
-            logger.error(f"Erro ao gerar embeddings: {e}")
-            raise
+        if "embedding_model" not in metadata:
+            self.collection.modify(metadata={**metadata, "embedding_model": self.embedding_service.model})
+    
+    def rebuild_from_chroma(self) -> int:
+        """Reconstrói o índice FAISS a partir dos embeddings do ChromaDB em lotes"""
+        batch_size = settings.faiss_rebuild_batch_size
+        offset = 0
+        restored = 0
+        
+        logger.info("Reconstruindo índice FAISS a partir do ChromaDB")
+        while True:
+            batch = self.collection.get(
+                include=["embeddings", "metadatas"],
+                limit=batch_size,
+                offset=offset
+            )
+            if not batch["ids"]:
+                break
+            offset += len(batch["ids"])
+            
+            # Apenas chunks; o registro principal do documento não tem vetor útil
+            keys, vectors = [], []
+            for chunk_id, embedding, metadata in zip(batch["ids"], batch["embeddings"], batch["metadatas"]):
+                if not metadata or not metadata.get("document_id"):
+                    continue
+                if embedding is None or len(embedding) != self.embedding_dim:
+                    continue
+                keys.append(chunk_id)
+                vectors.append(embedding)
+            
+            if keys:
+                self.faiss_store.add(keys, np.array(vectors, dtype="float32"), sync=False)
+                restored += len(keys)
+        
+        self.faiss_store.sync()
+        self.faiss_store.snapshot()
+        logger.info(f"Índice FAISS reconstruído: {restored} vetores")
+        return restored
+    
+    def rebuild_lexical_from_chroma(self) -> int:
+        """Reconstrói o índice léxico a partir dos textos dos chunks no ChromaDB"""
+        batch_size = settings.faiss_rebuild_batch_size
+        offset = 0
+        restored = 0
+        
+        logger.info("Reconstruindo índice léxico a partir do ChromaDB")
+        while True:
+            batch = self.collection.get(
+                include=["documents", "metadatas"],
+                limit=batch_size,
+                offset=offset
+            )
+            if not batch["ids"]:
+                break
+            offset += len(batch["ids"])
+            
+            keys, texts = [], []
+            for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                if not metadata or not metadata.get("document_id"):
+                    continue
+                keys.append(chunk_id)
+                texts.append(text or "")
+            
+            self.lexical_index.add(keys, texts)
+            restored += len(keys)
+        
+        logger.info(f"Índice léxico reconstruído: {restored} chunks")
+        return restored
+    
+    def migrate_documents_from_chroma(self) -> int:
+        """Move os registros de documento (texto original) do ChromaDB para o catálogo"""
+        batch_size = settings.faiss_rebuild_batch_size
+        migrated = 0
+        
+        while True:
+            # Os registros migrados saem do Chroma, então a próxima página começa no início
+            batch = self.collection.get(
+                where={"status": "processed"},
+                include=["documents", "metadatas"],
+                limit=batch_size
+            )
+            if not batch["ids"]:
+                break
+            
+            for document_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                metadata = dict(metadata or {})
+                self.catalog.write_text(document_id, text or "")
+                self.catalog.upsert(
+                    document_id,
+                    filename=metadata.pop("filename", None),
+                    chunk_count=metadata.pop("chunk_count", 0),
+                    file_id=metadata.pop("file_id", None),
+                    content_hash=metadata.pop("content_hash", None),
+                    status=metadata.pop("status", "processed"),
+                    metadata=metadata
+                )
+            self.collection.delete(ids=batch["ids"])
+            migrated += len(batch["ids"])
+        
+        self.catalog.set_meta("chroma_documents_migrated", "1")
+        if migrated:
+            logger.info(f"{migrated} documentos migrados do ChromaDB para o catálogo")
+        return migrated
+    
+    def add_document_listener(self, listener: Callable[[List[str]], None]):
+        """Registra quem precisa saber de documentos gravados/removidos"""
+        self.document_listeners.append(listener)
+    
+    def _notify_documents(self, document_ids: List[str]):
+        for listener in self.document_listeners:
+            try:
+                listener(document_ids)
+            except Exception as e:
+                logger.error(f"Erro ao notificar alteração de documentos: {e}")
+    
+    async def _run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """Executa a chamada bloqueante no pool do vector store (com o contexto atual)"""
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, function, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+    
+    def close(self):
+        """Persiste o estado do índice"""
+        self.executor.shutdown(wait=True)
+        self.faiss_store.close()
+        self.lexical_index.close()
+        self.catalog.close()
+        self.embedding_service.close()
+    
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Gera embeddings usando OpenAI (com cache)"""
+        embeddings = await self.embedding_service.embed(texts)
+        return embeddings.tolist()
+    
+    async def embed_query(self, query: str) -> np.ndarray:
+        """Embedding da query (1 x dim), reaproveitável em search_similar"""
+        with stage_timer("query_embedding"):
+            return await self.embedding_service.embed([query])
     
     async def store_document(
         self,
         chunks: List[str],
         filename: str,
         original_text: str,
-        metadata: Dict[str, Any]
-    ) -> str:
-        """Armazena documento no vector store"""
+        metadata: Dict[str, Any],
+        embeddings: Optional[np.ndarray] = None,
+        chunk_metadatas: Optional[List[Dict[str, Any]]] = None,
+        source_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Grava (ou atualiza) o documento no vector store.
+        
+        O document_id é estável (derivado do file_id ou, sem ele, do
+        conteúdo) e os chunk ids vêm do hash do texto de cada chunk: numa
+        nova versão do documento só os chunks novos são gravados (e têm
+        embedding gerado, se não vieram do worker), os que sumiram são
+        removidos e os demais só têm os metadados atualizados. Reenviar o
+        mesmo arquivo não altera nada.
+        """
         try:
-            document_id = str(uuid.uuid4())
-            
-            if not chunks:
-                return document_id
-            
-            # Gerar embeddings
-            embeddings = await self.generate_embeddings(chunks)
-            
-            # Preparar dados para ChromaDB
-            chunk_ids = [f"{document_id}_chunk_{i}" for i in range(len(chunks))]
-            chunk_metadatas = [
-                {
+            async with self.write_lock:
+                content_hash = hashlib.sha256(original_text.encode("utf-8")).hexdigest()
+                document_id = document_id_for(source_id, content_hash)
+                keys = chunk_keys(document_id, chunks)
+                
+                existing_keys, previous = await self._run(self._document_state, document_id)
+                
+                result = {
                     "document_id": document_id,
-                    "filename": filename,
-                    "chunk_index": i,
-                    **metadata
+                    "chunk_count": len(chunks),
+                    "chunks_new": 0,
+                    "chunks_reused": 0,
+                    "chunks_removed": 0,
+                    "unchanged": False
                 }
-                for i in range(len(chunks))
-            ]
+                
+                if (
+                    previous.get("content_hash") == content_hash
+                    and previous.get("filename") == filename
+                    and existing_keys == keys
+                ):
+                    result.update(chunks_reused=len(keys), unchanged=True)
+                    logger.info(f"Documento {filename} sem alterações: {document_id}")
+                    return result
+                
+                known = set(existing_keys)
+                new_positions = [i for i, key in enumerate(keys) if key not in known]
+                reused_positions = [i for i, key in enumerate(keys) if key in known]
+                obsolete = sorted(known - set(keys))
+                
+                # Embeddings só dos chunks novos
+                new_embeddings_np = None
+                if new_positions:
+                    if embeddings is None:
+                        new_embeddings = await self.generate_embeddings([chunks[i] for i in new_positions])
+                    else:
+                        new_embeddings = np.asarray(embeddings)[new_positions]
+                    new_embeddings_np = np.asarray(new_embeddings, dtype="float32")
+                
+                # Preparar dados para ChromaDB
+                metadatas = [
+                    {
+                        "document_id": document_id,
+                        "filename": filename,
+                        "chunk_index": i,
+                        **metadata,
+                        **(chunk_metadatas[i] if chunk_metadatas else {})
+                    }
+                    for i in range(len(chunks))
+                ]
+                
+                await self._run(
+                    self._write_document,
+                    document_id,
+                    chunks,
+                    keys,
+                    metadatas,
+                    new_positions,
+                    new_embeddings_np,
+                    reused_positions,
+                    obsolete
+                )
+                
+                # Documento no catálogo; o texto original vai comprimido para o disco
+                await self._run(self.catalog.write_text, document_id, original_text)
+                await self._run(
+                    self.catalog.upsert,
+                    document_id,
+                    filename=filename,
+                    chunk_count=len(chunks),
+                    metadata=metadata,
+                    file_id=source_id,
+                    content_hash=content_hash
+                )
+                
+                result.update(
+                    chunks_new=len(new_positions),
+                    chunks_reused=len(reused_positions),
+                    chunks_removed=len(obsolete)
+                )
             
-            # Armazenar no ChromaDB
-            self.collection.add(
-                ids=chunk_ids,
-                documents=chunks,
-                embeddings=embeddings,
-                metadatas=chunk_metadatas
+            self._notify_documents([document_id])
+            logger.info(
+                f"Documento {filename} armazenado: {document_id} "
+                f"({result['chunks_new']} chunks novos, {result['chunks_reused']} reaproveitados, "
+                f"{result['chunks_removed']} removidos)"
             )
+            return result
             
-            # Armazenar documento principal
-            self.collection.add(
-                ids=[document_id],
-                documents=[original_text],
-                metadatas=[{
-                    "filename": filename,
-                    "chunk_count": len(chunks),
-                    "status": "processed",
-                    **metadata
-                }]
+        except Exception as e:
+            logger.error(f"Erro ao armazenar documento: {e}")
+            raise
+    
+    def _document_state(self, document_id: str) -> Tuple[List[str], Dict[str, Any]]:
+        """Chunk ids gravados (na ordem do documento) e registro do catálogo"""
+        existing = self.collection.get(where={"document_id": document_id}, include=["metadatas"])
+        previous = self.catalog.get(document_id) or {}
+        existing_keys = [
+            chunk_id for chunk_id, _ in sorted(
+                zip(existing["ids"], existing["metadatas"]),
+                key=lambda item: item[1].get("chunk_index", 0)
             )
+        ]
+        return existing_keys, previous
+    
+    def _write_document(
+        self,
+        document_id: str,
+        chunks: List[str],
+        keys: List[str],
+        metadatas: List[Dict[str, Any]],
+        new_positions: List[int],
+        new_embeddings: Optional[np.ndarray],
+        reused_positions: List[int],
+        obsolete: List[str]
+    ) -> None:
+        """Aplica a diferença entre as versões nos índices e no ChromaDB"""
+        if new_positions:
+            self._add_chunks(
+                [keys[i] for i in new_positions],
+                [chunks[i] for i in new_positions],
+                [metadatas[i] for i in new_positions],
+                new_embeddings
+            )
+        
+        if reused_positions:
+            # Mesmo texto, possivelmente em outra posição ou seção
+            self.collection.update(
+                ids=[keys[i] for i in reused_positions],
+                metadatas=[metadatas[i] for i in reused_positions]
+            )
+        
+        if obsolete:
+            self.faiss_store.delete(obsolete)
+            self.lexical_index.delete(obsolete)
+            self.collection.delete(ids=obsolete)
+    
+    def _add_chunks(
+        self,
+        keys: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        embeddings: np.ndarray,
+        sync: bool = True
+    ) -> None:
+        """Grava chunks novos nos índices e no ChromaDB (desfaz tudo se uma escrita falhar)"""
+        try:
+            # Gravar nos logs do FAISS e do índice léxico antes do
+            # ChromaDB: após um crash os índices nunca ficam atrás do Chroma
+            with stage_timer("faiss_add"):
+                self.faiss_store.add(keys, embeddings, sync=sync)
+            with stage_timer("lexical_add"):
+                self.lexical_index.add(keys, texts)
             
-            # Adicionar ao FAISS
-            embeddings_np = np.array(embeddings, dtype="float32")
-            self.faiss_index.add(embeddings_np)
-            
-            # Mapear IDs do FAISS
-            for i, chunk_id in enumerate(chunk_ids):
-                self.faiss_id_map[self.next_faiss_id + i] = chunk_id
-            
-            self.next_faiss_id += len(embeddings)
-            
-            logger.info(f"Documento {filename} armazenado: {document_id}")
-            return document_id
+            # Em lotes, como nos índices: cada add converte e copia os
+            # embeddings segurando o GIL, o que atrasa as buscas
+            batch_size = settings.index_write_batch_size
+            with stage_timer("chroma_add"):
+                for start in range(0, len(keys), batch_size):
+                    end = start + batch_size
+                    self.collection.add(
+                        ids=keys[start:end],
+                        documents=texts[start:end],
+                        embeddings=embeddings[start:end].tolist(),
+                        metadatas=metadatas[start:end]
+                    )
+        except Exception:
+            # Não deixar vetores órfãos nos índices nem lotes pela metade
+            self.faiss_store.delete(keys)
+            self.lexical_index.delete(keys)
+            self.collection.delete(ids=keys)
+            raise
+    
+    async def export_corpus(self, path: str) -> Dict[str, Any]:
+        """Grava o corpus (chunks, embeddings e catálogo) num snapshot em path.
+        
+        O corpus é percorrido pelo catálogo, em grupos de documentos com até
+        CORPUS_SNAPSHOT_BATCH_SIZE chunks (um documento maior forma um grupo
+        sozinho). Só a leitura de cada grupo segura o write_lock, então a
+        ingestão espera no máximo uma leitura de grupo, nunca a exportação
+        inteira; as buscas continuam normalmente. Cada documento sai
+        consistente com os seus chunks, mas documentos gravados ou removidos
+        durante a exportação podem ou não entrar no snapshot.
+        """
+        batch_size = settings.corpus_snapshot_batch_size
+        writer = await self._run(CorpusSnapshotWriter, path, self.embedding_service.model, self.embedding_dim)
+        try:
+            cursor = None
+            while True:
+                documents, cursor = await self._run(self.catalog.list, batch_size, cursor)
+                for group in self._export_groups(documents, batch_size):
+                    async with self.write_lock:
+                        batch = await self._run(self._read_export_group, group)
+                    await self._run(self._write_export_group, writer, *batch)
+                if cursor is None:
+                    break
             
-        except Exception as e:
-            logger.error(f"Erro ao armazenar documento: {e}")
+            manifest = await self._run(writer.close)
+        except Exception:
+            await self._run(writer.abort)
             raise
+        
+        logger.info(f"Snapshot do corpus gravado em {path}: {manifest['chunks']} chunks, {manifest['documents']} documentos")
+        return manifest
+    
+    @staticmethod
+    def _export_groups(documents: List[Dict[str, Any]], batch_size: int) -> Iterator[List[str]]:
+        """Ids dos documentos em grupos de até batch_size chunks"""
+        group, chunks = [], 0
+        for document in documents:
+            if group and chunks + document["chunk_count"] > batch_size:
+                yield group
+                group, chunks = [], 0
+            group.append(document["id"])
+            chunks += document["chunk_count"]
+        if group:
+            yield group
+    
+    def _read_export_group(
+        self,
+        document_ids: List[str]
+    ) -> Tuple[List[Dict[str, Any]], List[str], Dict[str, Any]]:
+        """Registros, textos e chunks atuais dos documentos (chamar com o write_lock)"""
+        records, texts = [], []
+        for document_id in document_ids:
+            # Relido: o documento pode ter mudado ou sumido desde a página do catálogo
+            document = self.catalog.get(document_id)
+            if document is None:
+                continue
+            records.append({
+                field: document[field]
+                for field in ("id", "filename", "file_id", "status", "chunk_count", "content_hash", "metadata")
+            })
+            texts.append(self.catalog.read_text(document_id) or "")
+        
+        chunks = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        if records:
+            chunks = self.collection.get(
+                where={"document_id": {"$in": [record["id"] for record in records]}},
+                include=["documents", "metadatas", "embeddings"]
+            )
+        return records, texts, chunks
+    
+    @staticmethod
+    def _write_export_group(
+        writer: CorpusSnapshotWriter,
+        records: List[Dict[str, Any]],
+        texts: List[str],
+        chunks: Dict[str, Any]
+    ) -> None:
+        rows = [
+            row for row in zip(chunks["ids"], chunks["documents"], chunks["metadatas"], chunks["embeddings"])
+            if row[3] is not None
+        ]
+        if rows:
+            writer.add_chunks(
+                [row[0] for row in rows],
+                [row[1] or "" for row in rows],
+                [row[2] for row in rows],
+                np.array([row[3] for row in rows], dtype="float32")
+            )
+        writer.add_documents(records, texts)
+    
+    async def import_corpus(self, path: str) -> Dict[str, Any]:
+        """Carrega um snapshot do corpus, sem gerar embeddings (ver _import_corpus)"""
+        async with self.write_lock:
+            result = await self._run(self._import_corpus, path)
+        self._notify_documents(result.pop("document_ids"))
+        return result
+    
+    def _import_corpus(self, path: str) -> Dict[str, Any]:
+        """Grava os chunks do snapshot nos índices e no ChromaDB e os documentos no catálogo.
+        
+        Documentos que já existem com outro conteúdo são substituídos; chunks
+        já presentes no ChromaDB são pulados, então uma importação
+        interrompida pode ser repetida. O catálogo é gravado por último: o
+        documento só aparece depois que todos os seus chunks estão no lugar.
+        """
+        reader = CorpusSnapshotReader(path)
+        if reader.model != self.embedding_service.model or reader.dim != self.embedding_dim:
+            raise ValueError(
+                f"Snapshot com embeddings de {reader.model} ({reader.dim} dimensões), "
+                f"mas o índice usa {self.embedding_service.model} ({self.embedding_dim} dimensões)"
+            )
+        batch_size = settings.corpus_snapshot_batch_size
+        result = {"chunks_imported": 0, "chunks_skipped": 0, "documents": 0, "documents_replaced": 0}
+        document_ids = []
+        
+        for records, _ in reader.document_batches(batch_size):
+            for record in records:
+                document_ids.append(record["id"])
+                existing = self.catalog.get(record["id"])
+                if existing is not None and (
+                    existing["content_hash"] != record["content_hash"]
+                    or existing["chunk_count"] != record["chunk_count"]
+                ):
+                    self._delete_document(record["id"])
+                    result["documents_replaced"] += 1
+        
+        for keys, texts, metadatas, embeddings in reader.chunk_batches(batch_size):
+            present = set(self.collection.get(ids=keys, include=[])["ids"])
+            positions = [i for i, key in enumerate(keys) if key not in present]
+            result["chunks_skipped"] += len(keys) - len(positions)
+            if not positions:
+                continue
+            
+            new_keys = [keys[i] for i in positions]
+            # Restos de uma importação interrompida: nos índices, mas não no Chroma
+            self.faiss_store.delete(new_keys)
+            self.lexical_index.delete(new_keys)
+            self._add_chunks(
+                new_keys,
+                [texts[i] for i in positions],
+                [metadatas[i] for i in positions],
+                np.ascontiguousarray(embeddings[positions]),
+                sync=False
+            )
+            result["chunks_imported"] += len(positions)
+        
+        self.faiss_store.sync()
+        self.faiss_store.snapshot()
+        
+        for records, texts in reader.document_batches(batch_size):
+            for record, text in zip(records, texts):
+                self.catalog.write_text(record["id"], text)
+                self.catalog.upsert(
+                    record["id"],
+                    filename=record["filename"],
+                    chunk_count=record["chunk_count"],
+                    metadata=record["metadata"],
+                    file_id=record["file_id"],
+                    content_hash=record["content_hash"],
+                    status=record["status"]
+                )
+            result["documents"] += len(records)
+        
+        logger.info(
+            f"Snapshot {path} importado: {result['chunks_imported']} chunks "
+            f"({result['chunks_skipped']} já existiam), {result['documents']} documentos"
+        )
+        return {**result, "document_ids": document_ids}
+    
+    async def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeddings de várias queries (n x dim) numa única chamada ao serviço de embeddings"""
+        with stage_timer("query_embedding"):
+            return await self.embedding_service.embed(queries)
     
     async def search_similar(
         self,
         query: str,
         top_k: int = 5,
-        file_ids: Optional[List[str]] = None
+        file_ids: Optional[List[str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query_embedding: Optional[np.ndarray] = None,
+        mode: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """Busca documentos similares"""
+        """Busca documentos similares (ver search_batch)"""
         try:
-            # Gerar embedding da query
-            query_embedding = await self.generate_embeddings([query])
-            query_embedding_np = np.array(query_embedding, dtype="float32")
-            
-            # Buscar no FAISS
-            distances, indices = self.faiss_index.search(query_embedding_np, top_k * 2)
-            
-            # Recuperar chunk IDs
-            chunk_ids = [
-                self.faiss_id_map.get(idx) 
-                for idx in indices[0] 
-                if idx >= 0 and self.faiss_id_map.get(idx)
-            ]
-            
-            if not chunk_ids:
-                return []
+            results = await self.search_batch(
+                [query],
+                top_k=top_k,
+                file_ids=file_ids,
+                nprobe=nprobe,
+                ef_search=ef_search,
+                query_embeddings=query_embedding,
+                mode=mode
+            )
+            return results[0]
             
-            # Buscar no ChromaDB
-            results = self.collection.get(
+        except Exception as e:
+            logger.error(f"Erro na busca: {e}")
+            return []
+    
+    async def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        file_ids: Optional[List[str]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        query_embeddings: Optional[np.ndarray] = None,
+        mode: Optional[str] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Busca documentos similares para várias queries de uma vez.
+        
+        Os embeddings saem numa chamada só, o FAISS recebe a matriz de
+        queries numa única busca e os chunks de todas as respostas vêm do
+        ChromaDB num único get.
+        
+        mode: "vector" (distância L2, menor é melhor), "lexical" (BM25, sem
+        gerar embedding) ou "hybrid" (fusão por reciprocal rank dos dois,
+        maior é melhor). O padrão vem de SEARCH_MODE.
+        """
+        mode = mode or settings.search_mode
+        if mode not in ("vector", "lexical", "hybrid"):
+            raise ValueError(f"Modo de busca inválido: {mode}")
+        if not queries:
+            return []
+        candidates = top_k * settings.hybrid_candidates_factor if mode == "hybrid" else top_k
+        
+        if mode != "lexical" and query_embeddings is None:
+            # Gerar embeddings das queries (se ainda não foram gerados)
+            query_embeddings = await self.embed_queries(queries)
+        
+        async def vector_search() -> List[List[Tuple[str, float]]]:
+            if mode == "lexical":
+                return [[] for _ in queries]
+            query_embeddings_np = np.asarray(query_embeddings, dtype="float32").reshape(len(queries), -1)
+            # Buscar no FAISS já restrito aos documentos pedidos (ids
+            # resolvidos em chunk ids com a distância)
+            with stage_timer("faiss_search"):
+                return await self._run(
+                    self.faiss_store.search,
+                    query_embeddings_np,
+                    candidates,
+                    nprobe=nprobe,
+                    ef_search=ef_search,
+                    document_ids=file_ids or None
+                )
+        
+        async def lexical_search() -> List[List[Tuple[str, float]]]:
+            if mode == "vector":
+                return [[] for _ in queries]
+            # Termos exatos (CVEs, hosts, hashes, IPs) no índice invertido
+            with stage_timer("lexical_search"):
+                return await self._run(lambda: [
+                    self.lexical_index.search(query, candidates, document_ids=file_ids or None)
+                    for query in queries
+                ])
+        
+        # As duas buscas são independentes: em paralelo no pool
+        vector_hits, lexical_hits = await asyncio.gather(vector_search(), lexical_search())
+        
+        all_scores = []
+        for vector_ranking, lexical_ranking in zip(vector_hits, lexical_hits):
+            if mode == "vector":
+                scores = dict(vector_ranking)
+            elif mode == "lexical":
+                scores = dict(lexical_ranking)
+            else:
+                fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking], k=settings.hybrid_rrf_k)
+                scores = {key: fused[key] for key in sorted(fused, key=fused.get, reverse=True)[:top_k]}
+            all_scores.append(scores)
+        
+        chunk_ids = list(dict.fromkeys(chunk_id for scores in all_scores for chunk_id in scores))
+        if not chunk_ids:
+            return [[] for _ in queries]
+        
+        # Buscar no ChromaDB os chunks de todas as queries
+        with stage_timer("chroma_get"):
+            results = await self._run(
+                self.collection.get,
                 ids=chunk_ids,
                 include=["documents", "metadatas"]
             )
+        records = {
+            chunk_id: (results["documents"][i], results["metadatas"][i])
+            for i, chunk_id in enumerate(results["ids"])
+        }
+        
+        batch_results = []
+        for scores, vector_ranking, lexical_ranking in zip(all_scores, vector_hits, lexical_hits):
+            vector_scores, lexical_scores = dict(vector_ranking), dict(lexical_ranking)
             
             # Filtrar por file_ids se especificado
             filtered_results = []
-            for i, chunk_id in enumerate(results["ids"]):
-                metadata = results["metadatas"][i]
-                document_id = metadata.get("document_id")
-                
-                if file_ids and document_id not in file_ids:
+            for chunk_id, score in scores.items():
+                if chunk_id not in records:
+                    continue
+                text, metadata = records[chunk_id]
+                if file_ids and metadata.get("document_id") not in file_ids:
                     continue
                 
-                filtered_results.append({
+                result = {
                     "id": chunk_id,
-                    "text": results["documents"][i],
+                    "text": text,
                     "metadata": metadata,
-                    "score": float(distances[0][indices[0].tolist().index(
-                        next(k for k, v in self.faiss_id_map.items() if v == chunk_id)
-                    )])
-                })
+                    "score": score
+                }
+                if mode == "hybrid":
+                    if chunk_id in vector_scores:
+                        result["vector_score"] = vector_scores[chunk_id]
+                    if chunk_id in lexical_scores:
+                        result["lexical_score"] = lexical_scores[chunk_id]
+                filtered_results.append(result)
             
             # Ordenar por score e limitar
-            filtered_results.sort(key=lambda x: x["score"])
-            return filtered_results[:top_k]
-            
-        except Exception as e:
-            logger.error(f"Erro na busca: {e}")
-            return []
+            filtered_results.sort(key=lambda x: x["score"], reverse=mode != "vector")
+            batch_results.append(filtered_results[:top_k])
+        
+        return batch_results
+    
+    def index_stats(self) -> Dict[str, Any]:
+        """Estado do índice FAISS e do índice léxico"""
+        return {**self.faiss_store.stats(), "lexical": self.lexical_index.stats()}
+    
+    def embedding_stats(self) -> Dict[str, Any]:
+        """Contadores do cache e do agendador de embeddings"""
+        return self.embedding_service.stats()
     
-    async def list_documents(self) -> List[Dict[str, Any]]:
-        """Lista documentos processados"""
+    def retrain_index(self) -> bool:
+        """Dispara o re-treino/migração do índice em background"""
+        return self.faiss_store.migrate_async()
+    
+    def compact_index(self) -> bool:
+        """Dispara a compactação dos vetores removidos em background"""
+        return self.faiss_store.compact_async()
+    
+    async def list_documents(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        filename: Optional[str] = None,
+        file_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lista documentos processados (uma página e o cursor da próxima)"""
         try:
-            results = self.collection.get(
-                where={"status": "processed"},
-                include=["metadatas"]
+            documents, next_cursor = await self._run(
+                self.catalog.list,
+                limit=limit,
+                cursor=cursor,
+                status=status,
+                filename=filename,
+                file_id=file_id
             )
+            return [
+                {
+                    "id": document["id"],
+                    "filename": document["filename"],
+                    "file_id": document["file_id"],
+                    "status": document["status"],
+                    "chunk_count": document["chunk_count"],
+                    "pages": document["pages"],
+                    "language": document["language"]
+                }
+                for document in documents
+            ], next_cursor
             
-            documents = []
-            for i, doc_id in enumerate(results["ids"]):
-                metadata = results["metadatas"][i]
-                documents.append({
-                    "id": doc_id,
-                    "filename": metadata.get("filename"),
-                    "chunk_count": metadata.get("chunk_count", 0),
-                    "pages": metadata.get("pages", 0),
-                    "language": metadata.get("language", "unknown")
-                })
-            
-            return documents
-            
+        except ValueError:
+            # Cursor inválido: erro de quem chamou
+            raise
         except Exception as e:
             logger.error(f"Erro ao listar documentos: {e}")
-            return []
+            return [], None
     
     async def delete_document(self, document_id: str) -> bool:
         """Remove documento"""
         try:
-            # Buscar chunks do documento
-            results = self.collection.get(
-                where={"document_id": document_id},
-                include=["ids"]
-            )
+            async with self.write_lock:
+                removed = await self._run(self._delete_document, document_id)
+            self._notify_documents([document_id])
             
-            all_ids = results["ids"] + [document_id]
-            
-            # Remover do ChromaDB
-            self.collection.delete(ids=all_ids)
-            
-            logger.info(f"Documento {document_id} removido")
+            logger.info(f"Documento {document_id} removido ({removed} vetores)")
             return True
             
         except Exception as e:
             logger.error(f"Erro ao remover documento: {e}")
             return False
+    
+    def _delete_document(self, document_id: str) -> int:
+        # Buscar chunks do documento
+        results = self.collection.get(
+            where={"document_id": document_id},
+            include=[]
+        )
+        
+        all_ids = results["ids"] + [document_id]
+        
+        # Tombstones no FAISS: os vetores deixam de aparecer na busca
+        removed = self.faiss_store.delete(results["ids"])
+        self.lexical_index.delete(results["ids"])
+        
+        # Remover do ChromaDB e do catálogo
+        self.collection.delete(ids=all_ids)
+        self.catalog.delete(document_id)
+        return removed
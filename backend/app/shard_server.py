@@ -0,0 +1,187 @@
+"""Servidor de shard do índice FAISS.
+
+Cada processo serve um FaissStore próprio (diretório de dados separado) e
+a API fala com os shards pela lista FAISS_SHARDS. Para 3 shards:
+    
+    python shard_server.py serve --port 9201 --data-dir ./faiss_shards/0
+    python shard_server.py serve --port 9202 --data-dir ./faiss_shards/1
+    python shard_server.py serve --port 9203 --data-dir ./faiss_shards/2
+    FAISS_SHARDS=http://localhost:9201,http://localhost:9202,http://localhost:9203
+
+Ao mudar a quantidade de shards, com a ingestão parada, os documentos
+são redistribuídos antes de trocar FAISS_SHARDS:
+    
+    python shard_server.py rebalance --from URLS_ATUAIS --to URLS_NOVAS
+
+Com EMBEDDING_PROVIDER=local, --model e --dim são obrigatórios (a marca e a
+dimensão do modelo, vistas em /index/stats da API).
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from aiohttp import web
+
+from services.embedding_provider import openai_dimension, openai_model_mark
+from services.faiss_store import FaissStore, init_search_thread
+from services.sharded_store import create_faiss_store, decode_vectors, encode_vectors, rebalance
+from utils.config import get_settings
+from utils.metrics import REGISTRY, STAGE_SECONDS, stats_family
+
+settings = get_settings()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def create_app(store: FaissStore, executor: ThreadPoolExecutor) -> web.Application:
+    """Rotas do shard: a interface do FaissStore em JSON (vetores em base64)"""
+    async def run(function: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+    
+    async def info(request: web.Request) -> web.Response:
+        return web.json_response({"dim": store.dim, "model": store.model, "ntotal": store.ntotal})
+    
+    async def add(request: web.Request) -> web.Response:
+        payload = await request.json()
+        vectors = decode_vectors(payload["vectors"], store.dim)
+        with STAGE_SECONDS.time(stage="shard_add"):
+            await run(store.add, payload["keys"], vectors, payload.get("sync", True))
+        return web.json_response({"added": len(payload["keys"])})
+    
+    async def delete(request: web.Request) -> web.Response:
+        payload = await request.json()
+        return web.json_response({"deleted": await run(store.delete, payload["keys"])})
+    
+    async def search(request: web.Request) -> web.Response:
+        payload = await request.json()
+        queries = decode_vectors(payload["queries"], store.dim)
+        with STAGE_SECONDS.time(stage="shard_search"):
+            results = await run(
+                lambda: store.search(
+                    queries,
+                    payload["k"],
+                    nprobe=payload.get("nprobe"),
+                    ef_search=payload.get("ef_search"),
+                    document_ids=payload.get("document_ids")
+                )
+            )
+        return web.json_response({"results": results})
+    
+    async def sync(request: web.Request) -> web.Response:
+        await run(store.sync)
+        return web.json_response({"ok": True})
+    
+    async def snapshot(request: web.Request) -> web.Response:
+        await run(store.snapshot)
+        return web.json_response({"ok": True})
+    
+    async def migrate(request: web.Request) -> web.Response:
+        return web.json_response({"started": store.migrate_async()})
+    
+    async def compact(request: web.Request) -> web.Response:
+        return web.json_response({"started": store.compact_async()})
+    
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(await run(store.stats))
+    
+    async def keys(request: web.Request) -> web.Response:
+        start = int(request.query.get("start", "0"))
+        limit = int(request.query.get("limit", "2048"))
+        page, next_start = await run(store.keys_page, start, limit)
+        return web.json_response({"keys": page, "next": next_start})
+    
+    async def vectors(request: web.Request) -> web.Response:
+        payload = await request.json()
+        found, data = await run(store.get_vectors, payload["keys"])
+        return web.json_response({"keys": found, "vectors": encode_vectors(data)})
+    
+    async def metrics(request: web.Request) -> web.Response:
+        body = await asyncio.to_thread(REGISTRY.render)
+        return web.Response(body=body.encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    
+    # Vetores de ingestão em lotes de INDEX_WRITE_BATCH_SIZE passam do limite padrão de 1 MB
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_get("/info", info)
+    app.router.add_post("/add", add)
+    app.router.add_post("/delete", delete)
+    app.router.add_post("/search", search)
+    app.router.add_post("/sync", sync)
+    app.router.add_post("/snapshot", snapshot)
+    app.router.add_post("/migrate", migrate)
+    app.router.add_post("/compact", compact)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/keys", keys)
+    app.router.add_post("/vectors", vectors)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def serve(args: argparse.Namespace) -> None:
+    if args.model is None or args.dim is None:
+        if settings.embedding_provider != "openai":
+            raise SystemExit("Com EMBEDDING_PROVIDER local, informe --model e --dim")
+    dim = args.dim or openai_dimension(args.model or settings.embedding_model, settings.embedding_dim)
+    model = args.model or openai_model_mark(settings.embedding_model, dim)
+    
+    init_search_thread(settings.faiss_omp_threads)
+    executor = ThreadPoolExecutor(
+        max_workers=settings.vector_store_threads or None,
+        thread_name_prefix="shard-store",
+        initializer=init_search_thread,
+        initargs=(settings.faiss_omp_threads,)
+    )
+    store = create_faiss_store(args.data_dir, dim, model)
+    REGISTRY.register_collector(lambda: [
+        stats_family("rag_faiss_shard_stats", "Índice FAISS do shard", store.stats(), port=str(args.port))
+    ])
+    
+    runner = web.AppRunner(create_app(store, executor), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logger.info(f"Shard {args.data_dir} em {args.host}:{args.port} ({store.ntotal} vetores, {model})")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    
+    logger.info("Encerrando shard")
+    await runner.cleanup()
+    executor.shutdown(wait=True)
+    store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    serve_parser = commands.add_parser("serve", help="Serve um shard do índice")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--data-dir", required=True)
+    serve_parser.add_argument("--model", help="Marca do modelo de embeddings (padrão: EMBEDDING_MODEL)")
+    serve_parser.add_argument("--dim", type=int, help="Dimensão dos vetores (padrão: a do modelo da OpenAI)")
+    
+    rebalance_parser = commands.add_parser("rebalance", help="Redistribui os documentos para outra lista de shards")
+    rebalance_parser.add_argument("--from", dest="sources", required=True, help="URLs atuais, separadas por vírgula")
+    rebalance_parser.add_argument("--to", dest="targets", required=True, help="URLs novas, separadas por vírgula")
+    rebalance_parser.add_argument("--batch-size", type=int, default=settings.index_write_batch_size)
+    
+    args = parser.parse_args()
+    if args.command == "serve":
+        asyncio.run(serve(args))
+    else:
+        moved = rebalance(
+            [url.strip().rstrip("/") for url in args.sources.split(",") if url.strip()],
+            [url.strip().rstrip("/") for url in args.targets.split(",") if url.strip()],
+            batch_size=args.batch_size
+        )
+        logger.info(f"{moved['documents']} documentos ({moved['vectors']} vetores) redistribuídos")
+
+
+if __name__ == "__main__":
+    main()
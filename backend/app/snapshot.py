@@ -0,0 +1,46 @@
+"""Exportação e importação do corpus em snapshots.
+
+O snapshot é um diretório com os chunks, os metadados, os embeddings
+(float32, em .npy) e o catálogo de documentos em colunas mapeáveis em
+memória (ver services/corpus_snapshot.py). Importar não gera embeddings:
+os vetores vão direto para o ChromaDB e o índice FAISS.
+
+Com a API parada (ela é a dona dos índices):
+    
+    python snapshot.py export ./snapshots/corpus-2024
+    python snapshot.py import ./snapshots/corpus-2024
+
+Com a API no ar, use /admin/snapshots.
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from services.vector_service import VectorService
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def run(args: argparse.Namespace) -> None:
+    vector_service = VectorService()
+    try:
+        if args.command == "export":
+            result = await vector_service.export_corpus(args.path)
+        else:
+            result = await vector_service.import_corpus(args.path)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    finally:
+        vector_service.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("export", help="Grava o corpus num novo snapshot").add_argument("path")
+    commands.add_parser("import", help="Carrega um snapshot no corpus").add_argument("path")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
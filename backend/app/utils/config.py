@@ -3,9 +3,146 @@ import os
 
 class Settings(BaseSettings):
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")  # vazio = API oficial
     google_drive_folder_id: str = os.getenv("GOOGLE_DRIVE_FOLDER_ID", "")
     slack_webhook_url: str = os.getenv("SLACK_WEBHOOK_URL", "")
     
+    # Armazenamento vetorial
+    chroma_path: str = os.getenv("CHROMA_PATH", "./chroma_db")
+    # Catálogo de documentos e textos originais (comprimidos)
+    document_catalog_path: str = os.getenv("DOCUMENT_CATALOG_PATH", "./processed_texts/catalog.db")
+    processed_texts_path: str = os.getenv("PROCESSED_TEXTS_PATH", "./processed_texts")
+    faiss_data_dir: str = os.getenv("FAISS_DATA_DIR", "./faiss_data")
+    faiss_snapshot_every: int = int(os.getenv("FAISS_SNAPSHOT_EVERY", "50000"))
+    # Snapshot lido com mmap (índices IVF são sempre lidos em memória)
+    faiss_mmap: bool = os.getenv("FAISS_MMAP", "true").lower() == "true"
+    faiss_rebuild_batch_size: int = int(os.getenv("FAISS_REBUILD_BATCH_SIZE", "5000"))
+    
+    # Tipo de índice FAISS: flat, hnsw, ivf_flat ou ivf_pq
+    faiss_index_type: str = os.getenv("FAISS_INDEX_TYPE", "flat")
+    faiss_scalar_quantizer: str = os.getenv("FAISS_SCALAR_QUANTIZER", "")  # ex.: SQ8, SQfp16
+    faiss_nlist: int = int(os.getenv("FAISS_NLIST", "0"))  # 0 = automático (4 * sqrt(n))
+    faiss_pq_m: int = int(os.getenv("FAISS_PQ_M", "64"))
+    faiss_hnsw_m: int = int(os.getenv("FAISS_HNSW_M", "32"))
+    faiss_hnsw_ef_construction: int = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+    faiss_train_min: int = int(os.getenv("FAISS_TRAIN_MIN", "100000"))
+    faiss_train_sample: int = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))
+    faiss_retrain_growth: float = float(os.getenv("FAISS_RETRAIN_GROWTH", "4.0"))
+    faiss_nprobe: int = int(os.getenv("FAISS_NPROBE", "16"))
+    faiss_ef_search: int = int(os.getenv("FAISS_EF_SEARCH", "64"))
+    faiss_compact_ratio: float = float(os.getenv("FAISS_COMPACT_RATIO", "0.2"))
+    faiss_compact_min: int = int(os.getenv("FAISS_COMPACT_MIN", "1000"))
+    # Buscas filtradas com até esta quantidade de chunks fazem varredura exata
+    faiss_prefilter_flat_max: int = int(os.getenv("FAISS_PREFILTER_FLAT_MAX", "20000"))
+    
+    # Concorrência do vector store: pool de threads das chamadas bloqueantes,
+    # threads OpenMP por busca no FAISS e vetores por lote de escrita nos índices
+    vector_store_threads: int = int(os.getenv("VECTOR_STORE_THREADS", "0"))  # 0 = padrão do Python
+    faiss_omp_threads: int = int(os.getenv("FAISS_OMP_THREADS", "0"))  # 0 = padrão do FAISS (todos os núcleos)
+    index_write_batch_size: int = int(os.getenv("INDEX_WRITE_BATCH_SIZE", "2048"))
+    
+    # Índice FAISS particionado: URLs dos servidores de shard (shard_server.py),
+    # separadas por vírgula; vazio = índice local em FAISS_DATA_DIR
+    faiss_shards: str = os.getenv("FAISS_SHARDS", "")
+    faiss_shard_timeout: float = float(os.getenv("FAISS_SHARD_TIMEOUT", "30"))
+    
+    # Snapshots do corpus (export/import em colunas, com os embeddings)
+    corpus_snapshot_dir: str = os.getenv("CORPUS_SNAPSHOT_DIR", "./snapshots")
+    corpus_snapshot_batch_size: int = int(os.getenv("CORPUS_SNAPSHOT_BATCH_SIZE", "5000"))
+    
+    # Índice léxico (BM25) e busca híbrida
+    lexical_data_dir: str = os.getenv("LEXICAL_DATA_DIR", "./lexical_data")
+    lexical_merge_every: int = int(os.getenv("LEXICAL_MERGE_EVERY", "20000"))
+    lexical_bm25_k1: float = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+    lexical_bm25_b: float = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+    search_mode: str = os.getenv("SEARCH_MODE", "hybrid")  # vector, lexical ou hybrid
+    hybrid_rrf_k: int = int(os.getenv("HYBRID_RRF_K", "60"))
+    hybrid_candidates_factor: int = int(os.getenv("HYBRID_CANDIDATES_FACTOR", "4"))  # candidatos de cada busca = top_k * fator
+    
+    # Chat: modelo e orçamento de tokens do prompt (contexto e histórico)
+    chat_model: str = os.getenv("CHAT_MODEL", "gpt-4")
+    chat_prompt_max_tokens: int = int(os.getenv("CHAT_PROMPT_MAX_TOKENS", "6000"))
+    chat_history_max_tokens: int = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "1500"))
+    chat_history_summary_tokens: int = int(os.getenv("CHAT_HISTORY_SUMMARY_TOKENS", "300"))  # resumo dos turnos que não cabem
+    chat_context_candidates: int = int(os.getenv("CHAT_CONTEXT_CANDIDATES", "10"))  # chunks recuperados antes do MMR
+    chat_mmr_lambda: float = float(os.getenv("CHAT_MMR_LAMBDA", "0.7"))  # 1 = só relevância, 0 = só diversidade
+    chat_duplicate_threshold: float = float(os.getenv("CHAT_DUPLICATE_THRESHOLD", "0.8"))  # sobreposição que descarta o chunk
+    chat_min_chunk_tokens: int = int(os.getenv("CHAT_MIN_CHUNK_TOKENS", "100"))  # menor trecho cortado que ainda entra
+    
+    # Consultas em lote (/search/batch e /chat/batch)
+    batch_max_queries: int = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+    chat_batch_concurrency: int = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))  # completions simultâneas
+    
+    # Métricas (/metrics no formato do Prometheus)
+    timing_headers: bool = os.getenv("TIMING_HEADERS", "false").lower() == "true"  # header Server-Timing por requisição
+    worker_metrics_port: int = int(os.getenv("WORKER_METRICS_PORT", "9100"))  # 0 = sem /metrics no worker
+    
+    # Embeddings: provedor openai (API) ou local (modelo ONNX na CPU)
+    embedding_provider: str = os.getenv("EMBEDDING_PROVIDER", "openai")
+    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+    embedding_dim: int = int(os.getenv("EMBEDDING_DIM", "0"))  # 0 = a do modelo; menor encurta os text-embedding-3
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.db")
+    embedding_cache_max_entries: int = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+    embedding_cache_memory_entries: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+    embedding_batch_max_inputs: int = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "512"))
+    embedding_batch_max_tokens: int = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+    embedding_max_input_tokens: int = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))
+    embedding_max_concurrency: int = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    embedding_coalesce_ms: int = int(os.getenv("EMBEDDING_COALESCE_MS", "20"))
+    embedding_max_retries: int = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+    # Modelo local: diretório com model.onnx e tokenizer.json
+    local_embedding_model_dir: str = os.getenv("LOCAL_EMBEDDING_MODEL_DIR", "./models/embeddings")
+    local_embedding_model_name: str = os.getenv("LOCAL_EMBEDDING_MODEL_NAME", "")  # vazio = nome do diretório
+    local_embedding_quantization: str = os.getenv("LOCAL_EMBEDDING_QUANTIZATION", "float32")  # float32 ou int8
+    local_embedding_batch_size: int = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+    local_embedding_max_tokens: int = int(os.getenv("LOCAL_EMBEDDING_MAX_TOKENS", "256"))
+    local_embedding_threads: int = int(os.getenv("LOCAL_EMBEDDING_THREADS", "1"))  # lotes em paralelo
+    local_embedding_intra_op_threads: int = int(os.getenv("LOCAL_EMBEDDING_INTRA_OP_THREADS", "0"))  # 0 = padrão do ONNX Runtime
+    
+    # Chunking (tokens do tokenizer do modelo de embeddings; com o modelo local,
+    # chunks divididos para caber em LOCAL_EMBEDDING_MAX_TOKENS do tokenizador dele)
+    chunk_tokens: int = int(os.getenv("CHUNK_TOKENS", "800"))
+    chunk_overlap_tokens: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", "100"))
+    
+    # Cache semântico de respostas do chat
+    answer_cache_enabled: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    answer_cache_threshold: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))  # similaridade de cosseno
+    answer_cache_ttl: float = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    answer_cache_max_entries: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+    
+    # Fila de jobs de ingestão e workers (worker.py)
+    jobs_db_path: str = os.getenv("JOBS_DB_PATH", "./jobs/jobs.db")
+    jobs_spool_dir: str = os.getenv("JOBS_SPOOL_DIR", "./jobs/spool")
+    jobs_max_attempts: int = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+    jobs_retry_base_seconds: float = float(os.getenv("JOBS_RETRY_BASE_SECONDS", "10"))
+    jobs_poll_interval: float = float(os.getenv("JOBS_POLL_INTERVAL", "1.0"))
+    jobs_stale_seconds: float = float(os.getenv("JOBS_STALE_SECONDS", "900"))
+    jobs_finished_ttl: float = float(os.getenv("JOBS_FINISHED_TTL", "604800"))  # jobs terminados expiram (0 = nunca)
+    jobs_events_poll_interval: float = float(os.getenv("JOBS_EVENTS_POLL_INTERVAL", "0.25"))
+    jobs_callback_timeout: float = float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10"))
+    jobs_callback_retries: int = int(os.getenv("JOBS_CALLBACK_RETRIES", "3"))
+    # Hosts aceitos em callback_url, separados por vírgula (ex.: n8n numa rede interna);
+    # vazio = qualquer host que resolva só para endereços públicos
+    jobs_callback_allowed_hosts: str = os.getenv("JOBS_CALLBACK_ALLOWED_HOSTS", "")
+    worker_download_concurrency: int = int(os.getenv("WORKER_DOWNLOAD_CONCURRENCY", "4"))
+    worker_extract_concurrency: int = int(os.getenv("WORKER_EXTRACT_CONCURRENCY", "2"))
+    worker_embed_concurrency: int = int(os.getenv("WORKER_EMBED_CONCURRENCY", "2"))
+    
+    # Download/upload de arquivos
+    max_file_size_mb: int = int(os.getenv("MAX_FILE_SIZE_MB", "200"))
+    download_chunk_size: int = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    http_pool_size: int = int(os.getenv("HTTP_POOL_SIZE", "20"))
+    http_connect_timeout: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    http_read_timeout: float = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+    
+    # Pool de processos do Docling (por worker)
+    extraction_processes: int = int(os.getenv("EXTRACTION_PROCESSES", "0"))  # 0 = núcleos da máquina
+    extraction_timeout: float = float(os.getenv("EXTRACTION_TIMEOUT", "600"))
+    extraction_memory_limit_mb: int = int(os.getenv("EXTRACTION_MEMORY_LIMIT_MB", "0"))  # limite rígido (RLIMIT_AS)
+    extraction_recycle_rss_mb: int = int(os.getenv("EXTRACTION_RECYCLE_RSS_MB", "4096"))
+    extraction_max_tasks_per_child: int = int(os.getenv("EXTRACTION_MAX_TASKS_PER_CHILD", "50"))
+    extraction_pages_per_task: int = int(os.getenv("EXTRACTION_PAGES_PER_TASK", "50"))
+    
     class Config:
         env_file = ".env"
 
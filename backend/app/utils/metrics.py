@@ -0,0 +1,291 @@
+"""Métricas no formato texto do Prometheus.
+
+Registro em memória com contadores, gauges e histogramas com labels,
+barato o suficiente para ficar sempre ligado: cada observação é uma busca
+binária nos buckets e uma soma sob um lock. Valores que já existem em
+outros serviços (tamanho do índice, jobs na fila, caches) entram por
+coletores chamados só na hora do scrape.
+
+As etapas medidas com stage_timer também são acumuladas na requisição
+corrente (quando ela ativou a coleta), para o header Server-Timing.
+"""
+import bisect
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+# Segundos; cobre de buscas sub-milissegundo a extrações longas
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0
+)
+# Tokens por prompt; até a janela dos modelos de contexto longo
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000, 128000)
+
+# Etapas medidas na requisição corrente: [(etapa, segundos)]
+request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+    
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _labels(self, key: Labels) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+    
+    @abstractmethod
+    def samples(self) -> Iterable[Sample]:
+        """Amostras (nome, labels, valor) da métrica no momento do scrape"""
+
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Labels, float] = {}
+    
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def samples(self) -> Iterable[Sample]:
+        with self.lock:
+            items = list(self.values.items())
+        return [(f"{self.name}_total", self._labels(key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Labels, float] = {}
+    
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = value
+    
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+    
+    def samples(self) -> Iterable[Sample]:
+        with self.lock:
+            items = list(self.values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Por série: contagem de cada bucket (não cumulativa, + o +Inf) e soma
+        self.series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+    
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][position] += 1
+            series[1][0] += value
+    
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def samples(self) -> Iterable[Sample]:
+        with self.lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self.series.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets=buckets)
+        self.metrics.append(metric)
+        return metric
+    
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """collector() retorna (nome, tipo, descrição, amostras) de métricas calculadas no scrape"""
+        self.collectors.append(collector)
+    
+    def render(self) -> str:
+        families = [(metric.name, metric.kind, metric.documentation, metric.samples()) for metric in self.metrics]
+        errors = 0
+        for collector in self.collectors:
+            # Um coletor com erro não derruba o scrape inteiro
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.warning(f"Erro no coletor de métricas: {e}")
+                errors += 1
+        families.append((
+            "rag_metrics_collector_errors",
+            "gauge",
+            "Coletores de métricas que falharam neste scrape",
+            [("rag_metrics_collector_errors", {}, errors)]
+        ))
+        
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds",
+    "Duração de cada etapa do pipeline (ingestão, busca e geração)",
+    ["stage"]
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_seconds",
+    "Duração das requisições HTTP",
+    ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("rag_http_requests_in_flight", "Requisições HTTP em andamento")
+JOBS_IN_FLIGHT = REGISTRY.gauge("rag_jobs_in_flight", "Jobs de ingestão em execução neste processo", ["stage"])
+TOKENS = REGISTRY.counter("rag_tokens", "Tokens enviados/recebidos da API da OpenAI", ["kind"])
+BYTES = REGISTRY.counter("rag_bytes", "Bytes de arquivos recebidos", ["source"])
+JOB_CALLBACKS = REGISTRY.counter("rag_job_callbacks", "Eventos de jobs enviados aos callback URLs", ["result"])
+PROMPT_TOKENS = REGISTRY.histogram(
+    "rag_prompt_tokens",
+    "Tokens do prompt montado para o chat (total, contexto e histórico)",
+    ["part"],
+    buckets=TOKEN_BUCKETS
+)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Mede a etapa no histograma e na requisição corrente (Server-Timing)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """Valor do header Server-Timing (durações em ms; etapas repetidas são somadas)"""
+    durations: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        durations[stage] = durations.get(stage, 0.0) + elapsed
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def stats_family(name: str, documentation: str, stats: Dict[str, object], **labels: str) -> Tuple[str, str, str, List[Sample]]:
+    """Gauge com um label stat por valor numérico de um dicionário stats() dos serviços"""
+    samples = [
+        (name, {**labels, "stat": key}, float(value))
+        for key, value in stats.items()
+        if isinstance(value, (int, float))
+    ]
+    return name, "gauge", documentation, samples
+
+
+def process_resident_bytes() -> float:
+    """Memória residente do processo (0 se indisponível)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+REGISTRY.register_collector(lambda: [(
+    "rag_process_resident_memory_bytes",
+    "gauge",
+    "Memória residente do processo",
+    [("rag_process_resident_memory_bytes", {}, process_resident_bytes())]
+)])
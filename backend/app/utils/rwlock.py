@@ -0,0 +1,69 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class RWLock:
+    """Lock de leitores e escritor entre threads.
+    
+    Várias leituras simultâneas; uma escrita por vez, sem leitores. Um
+    escritor esperando barra leitores novos (a escrita não passa fome), e
+    ao liberar deixa entrar primeiro os leitores que já esperavam: escritas
+    em sequência (lotes de uma ingestão) se alternam com as buscas em vez
+    de bloqueá-las até o fim.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._readers_waiting = 0
+        # Leitores liberados na frente do próximo escritor
+        self._admitted = 0
+    
+    def acquire_read(self) -> None:
+        with self._cond:
+            self._readers_waiting += 1
+            while self._writer or (self._writers_waiting and not self._admitted):
+                self._cond.wait()
+            self._readers_waiting -= 1
+            if self._admitted:
+                self._admitted -= 1
+            self._readers += 1
+    
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+    
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers or self._admitted:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+    
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._admitted = self._readers_waiting
+            self._cond.notify_all()
+    
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+    
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
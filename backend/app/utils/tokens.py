@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Tokenizer do modelo (cl100k_base para modelos desconhecidos)"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, model: str, max_tokens: int) -> str:
+    """Corta o texto em max_tokens tokens do modelo"""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,101 @@
+"""Worker de ingestão de documentos.
+
+Consome a fila durável de jobs executando download, extração e geração
+de embeddings, cada etapa com sua própria concorrência. A indexação roda
+no processo da API, único dono do índice vetorial. Para aumentar a vazão
+da ingestão, basta subir mais workers:
+    
+    python worker.py
+
+As métricas do worker ficam em http://<worker>:WORKER_METRICS_PORT/metrics.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+from aiohttp import web
+
+from services.document_service import DocumentService
+from services.embedding_service import EmbeddingService
+from services.ingestion import IngestionPipeline
+from services.job_queue import JobQueue, JobRunner
+from utils.config import get_settings
+from utils.metrics import REGISTRY, stats_family
+
+settings = get_settings()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """/metrics do worker (etapas de download, extração e embeddings)"""
+    async def metrics(request: web.Request) -> web.Response:
+        body = await asyncio.to_thread(REGISTRY.render)
+        return web.Response(body=body.encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
+
+
+async def main():
+    queue = JobQueue(
+        settings.jobs_db_path,
+        settings.jobs_spool_dir,
+        max_attempts=settings.jobs_max_attempts,
+        retry_base=settings.jobs_retry_base_seconds
+    )
+    embedding_service = EmbeddingService()
+    document_service = DocumentService()
+    document_service.start()
+    pipeline = IngestionPipeline(
+        queue,
+        document_service=document_service,
+        embedding_service=embedding_service
+    )
+    runner = JobRunner(
+        queue,
+        {
+            "download": (pipeline.download, settings.worker_download_concurrency),
+            "extract": (pipeline.extract, settings.worker_extract_concurrency),
+            "embed": (pipeline.embed, settings.worker_embed_concurrency)
+        },
+        worker_id=f"{socket.gethostname()}-{os.getpid()}",
+        poll_interval=settings.jobs_poll_interval,
+        stale_seconds=settings.jobs_stale_seconds
+    )
+    
+    REGISTRY.register_collector(lambda: [
+        stats_family("rag_embedding_cache_stats", "Cache de embeddings", embedding_service.cache.stats()),
+        stats_family("rag_embedding_scheduler_stats", "Agendador de embeddings", embedding_service.provider.stats()),
+        stats_family("rag_extraction_pool_stats", "Pool de extração", document_service.extraction_pool.stats())
+    ])
+    metrics_runner = None
+    if settings.worker_metrics_port:
+        metrics_runner = await start_metrics_server(settings.worker_metrics_port)
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    runner.start()
+    logger.info(f"Worker de ingestão iniciado ({runner.worker_id})")
+    await stop.wait()
+    
+    logger.info("Encerrando worker; aguardando jobs em andamento")
+    await runner.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await document_service.close()
+    embedding_service.close()
+    queue.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
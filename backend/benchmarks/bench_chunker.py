@@ -0,0 +1,81 @@
+"""Benchmark do chunker em documentos grandes.
+
+Gera um documento sintético (títulos, parágrafos e tabelas, como os itens
+do Docling) e mede a vazão e o pico de memória do TokenChunker e do
+chunker antigo por palavras, que montava o texto inteiro e a lista de
+palavras em memória antes de cortar.
+
+Uso:
+    python benchmarks/bench_chunker.py --paragraphs 20000 50000 200000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.chunker import TokenChunker  # noqa: E402
+
+
+def make_items(paragraphs: int, words: int):
+    """Itens gerados sob demanda: um título a cada 20 parágrafos, uma tabela a cada 50"""
+    for i in range(paragraphs):
+        page = i // 10 + 1
+        if i % 20 == 0:
+            yield {"text": f"Seção {i // 20}", "label": "section_header", "page": page}
+        if i % 50 == 49:
+            yield {"text": "| a | b |\n|---|---|\n" + "| 1 | 2 |\n" * 10, "label": "table", "page": page}
+        yield {
+            "text": " ".join(f"palavra{(i * 7 + w) % 5000}" for w in range(words)),
+            "label": "text",
+            "page": page
+        }
+
+
+def chunks_legacy(items, chunk_size: int = 1000, overlap: int = 100):
+    """create_chunks antigo: texto inteiro, cortado a cada chunk_size palavras"""
+    text = "\n".join(item["text"] for item in items)
+    words = text.split()
+    return [
+        " ".join(words[i:i + chunk_size])
+        for i in range(0, len(words), chunk_size - overlap)
+    ]
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--words", type=int, default=80, help="palavras por parágrafo")
+    parser.add_argument("--model", default="text-embedding-ada-002")
+    parser.add_argument("--chunk-tokens", type=int, default=800)
+    parser.add_argument("--overlap-tokens", type=int, default=100)
+    parser.add_argument("--skip-legacy", action="store_true", help="não medir o chunker por palavras")
+    args = parser.parse_args()
+    
+    chunker = TokenChunker(args.model, chunk_tokens=args.chunk_tokens, overlap_tokens=args.overlap_tokens)
+    
+    print(f"{'parágrafos':>10} {'chunker':>8} {'chunks':>8} {'parág./s':>10} {'pico (MB)':>10}")
+    for paragraphs in args.paragraphs:
+        runs = [("tokens", lambda: sum(1 for _ in chunker.chunks(make_items(paragraphs, args.words))))]
+        if not args.skip_legacy:
+            runs.append(("legado", lambda: len(chunks_legacy(make_items(paragraphs, args.words)))))
+        
+        for name, run in runs:
+            count, elapsed, peak = measure(run)
+            print(f"{paragraphs:>10} {name:>8} {count:>8} {paragraphs / elapsed:>10.0f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark de vazão do agendador de embeddings contra o servidor falso.
+
+Simula várias ingestões concorrentes (cada uma com seus chunks) chamando
+o EmbeddingScheduler e mede chunks/s, requisições feitas e 429 recebidos.
+Com --legacy, mede também uma chamada embeddings.create por documento,
+como o generate_embeddings fazia antes.
+
+Uso:
+    python benchmarks/bench_embeddings.py --documents 50 --chunks 200 --max-concurrent 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from openai import AsyncOpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_openai import create_app, start  # noqa: E402
+from services.embedding_scheduler import EmbeddingScheduler  # noqa: E402
+
+
+def make_documents(documents: int, chunks: int, words: int):
+    return [
+        [f"documento {d} chunk {c} " + " ".join(f"palavra{(d * c + w) % 5000}" for w in range(words)) for c in range(chunks)]
+        for d in range(documents)
+    ]
+
+
+async def run_scheduler(client, docs, args):
+    scheduler = EmbeddingScheduler(
+        client,
+        "text-embedding-ada-002",
+        max_batch_inputs=args.batch_inputs,
+        max_concurrency=args.concurrency,
+        coalesce_ms=args.coalesce_ms
+    )
+    start_time = time.perf_counter()
+    await asyncio.gather(*(scheduler.embed(chunks) for chunks in docs))
+    elapsed = time.perf_counter() - start_time
+    return elapsed, scheduler.stats()
+
+
+async def run_legacy(client, docs):
+    client = client.with_options(max_retries=10)
+    start_time = time.perf_counter()
+    await asyncio.gather(*(
+        client.embeddings.create(input=chunks, model="text-embedding-ada-002") for chunks in docs
+    ))
+    return time.perf_counter() - start_time
+
+
+async def main_async(args):
+    app = create_app(
+        dim=args.dim,
+        latency_ms=args.latency_ms,
+        per_input_ms=args.per_input_ms,
+        max_concurrent=args.max_concurrent
+    )
+    runner = await start(app, args.port)
+    client = AsyncOpenAI(api_key="fake", base_url=f"http://127.0.0.1:{args.port}/v1")
+    docs = make_documents(args.documents, args.chunks, args.words)
+    total = args.documents * args.chunks
+    
+    try:
+        elapsed, stats = await run_scheduler(client, docs, args)
+        print(f"agendador: {total} chunks em {elapsed:.2f}s = {total / elapsed:,.0f} chunks/s")
+        print(f"  requisições={stats['requests']} retries={stats['retries']} 429={stats['rate_limited']}")
+        
+        if args.legacy:
+            app["state"].update(requests=0, inputs=0, rate_limited=0)
+            elapsed = await run_legacy(client, docs)
+            print(f"legado:    {total} chunks em {elapsed:.2f}s = {total / elapsed:,.0f} chunks/s")
+            print(f"  requisições={app['state']['requests']} 429={app['state']['rate_limited']}")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=200, help="chunks por documento")
+    parser.add_argument("--words", type=int, default=50, help="palavras por chunk")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch-inputs", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--coalesce-ms", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--per-input-ms", type=float, default=0.2)
+    parser.add_argument("--max-concurrent", type=int, default=4, help="limite do servidor antes do 429")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--legacy", action="store_true", help="medir também uma requisição por documento")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
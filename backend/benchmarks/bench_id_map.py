@@ -0,0 +1,79 @@
+"""Micro-benchmark da resolução de ids do FAISS em chunk ids.
+
+Compara a varredura linear antiga do search_similar (dict id -> chunk id
+percorrido a cada hit) com o IdMap. O tempo de resolução do IdMap deve
+ficar constante enquanto o corpus cresce.
+
+Uso:
+    python benchmarks/bench_id_map.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.id_map import IdMap  # noqa: E402
+
+
+def resolve_legacy(id_map, indices, distances):
+    """Resolução como era feita antes: O(hits * corpus)"""
+    chunk_ids = [id_map.get(idx) for idx in indices if idx >= 0 and id_map.get(idx)]
+    return [
+        (chunk_id, float(distances[indices.tolist().index(
+            next(k for k, v in id_map.items() if v == chunk_id)
+        )]))
+        for chunk_id in chunk_ids
+    ]
+
+
+def resolve_id_map(id_map, indices, distances):
+    keys = id_map.keys_for(indices)
+    return [(key, float(d)) for key, d in zip(keys, distances) if key is not None]
+
+
+def bench(size, hits, queries, skip_legacy):
+    keys = [f"doc{i // 50}_chunk_{i % 50}" for i in range(size)]
+    legacy_map = dict(enumerate(keys))
+    id_map = IdMap(keys)
+    
+    rng = np.random.default_rng(0)
+    all_indices = rng.integers(0, size, size=(queries, hits))
+    distances = rng.random(hits, dtype="float32")
+    
+    start = time.perf_counter()
+    for indices in all_indices:
+        resolve_id_map(id_map, indices, distances)
+    id_map_us = (time.perf_counter() - start) / queries * 1e6
+    
+    legacy_us = None
+    if not skip_legacy:
+        legacy_queries = all_indices[:max(1, queries // 100)]
+        start = time.perf_counter()
+        for indices in legacy_queries:
+            resolve_legacy(legacy_map, indices, distances)
+        legacy_us = (time.perf_counter() - start) / len(legacy_queries) * 1e6
+    
+    return id_map_us, legacy_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--hits", type=int, default=10, help="vizinhos por busca (top_k * 2)")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--skip-legacy", action="store_true", help="não medir a varredura antiga")
+    args = parser.parse_args()
+    
+    print(f"{'corpus':>10} {'IdMap (us/busca)':>18} {'legado (us/busca)':>18}")
+    for size in args.sizes:
+        id_map_us, legacy_us = bench(size, args.hits, args.queries, args.skip_legacy)
+        legacy = f"{legacy_us:18.1f}" if legacy_us is not None else f"{'-':>18}"
+        print(f"{size:>10} {id_map_us:18.1f} {legacy}")
+
+
+if __name__ == "__main__":
+    main()
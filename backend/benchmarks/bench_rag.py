@@ -0,0 +1,367 @@
+"""Benchmark de ponta a ponta: ingestão, busca e chat contra o servidor falso.
+
+Sobe o fake_openai no próprio processo, aponta a API (main.py) para ele e
+para um diretório de dados temporário e cresce um corpus sintético até
+cada tamanho pedido em --chunks. Em cada tamanho mede:
+
+- ingestão: chunks/s gravando documentos com VectorService.store_document
+  (embeddings calculados localmente com os mesmos vetores do servidor
+  falso, ou gerados pela API com --embeddings api);
+- busca: p50/p95/p99 por modo e top_k, com os embeddings das queries já
+  prontos (só índice e ChromaDB), e search_batch contra o laço de
+  search_similar;
+- memória: RSS atual e de pico e espaço em disco dos dados;
+- chat: latência de /chat com várias concorrências e /chat/batch contra o
+  laço de /chat.
+
+Os demais ajustes (tipo de índice, nprobe etc.) vêm das variáveis de
+ambiente de sempre. Com --output o resultado vai para um JSON, que pode
+ser comparado com outra execução com --compare.
+
+Uso:
+    python benchmarks/bench_rag.py --chunks 1000 10000 100000 --output base.json
+    FAISS_INDEX_TYPE=hnsw python benchmarks/bench_rag.py --chunks 1000 10000 100000 --compare base.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_openai import create_app, fake_embedding, start  # noqa: E402
+from utils.metrics import process_resident_bytes  # noqa: E402
+
+VOCABULARY = [f"termo{i}" for i in range(20000)]
+
+
+def make_document(index: int, chunks: int, words: int, seed: int) -> List[str]:
+    """Chunks de um documento: palavras com distribuição de Zipf, CVEs e IPs"""
+    rng = np.random.default_rng(seed + index)
+    texts = []
+    for c in range(chunks):
+        ids = rng.zipf(1.3, words) % len(VOCABULARY)
+        parts = [VOCABULARY[i] for i in ids]
+        if c % 7 == 0:
+            parts.append(f"CVE-2024-{(index * chunks + c) % 50000:05d}")
+        if c % 11 == 0:
+            parts.append(f"10.{index % 256}.{c % 256}.{(index + c) % 256}")
+        texts.append(f"documento {index} trecho {c}: " + " ".join(parts))
+    return texts
+
+
+def make_queries(count: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    queries = []
+    for q in range(count):
+        ids = rng.zipf(1.3, int(rng.integers(2, 7))) % len(VOCABULARY)
+        query = " ".join(VOCABULARY[i] for i in ids)
+        if q % 4 == 0:
+            query += f" CVE-2024-{int(rng.integers(0, 50000)):05d}"
+        queries.append(query)
+    return queries
+
+
+def latency_summary(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    values = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "per_second": len(latencies) / elapsed if elapsed else 0.0
+    }
+
+
+def disk_usage(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def environment() -> Dict[str, Any]:
+    import faiss
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", ""),
+        "commit": commit
+    }
+
+
+async def ingest(api, documents: range, args) -> Dict[str, float]:
+    vector_service = api.vector_service
+    elapsed = 0.0
+    chunks = 0
+    for index in documents:
+        texts = make_document(index, args.chunks_per_doc, args.words, args.seed)
+        embeddings = None
+        if args.embeddings == "local":
+            embeddings = np.array([fake_embedding(text, vector_service.embedding_dim) for text in texts], dtype="float32")
+        
+        start_time = time.perf_counter()
+        await vector_service.store_document(
+            chunks=texts,
+            filename=f"bench-{index}.txt",
+            original_text="\n".join(texts),
+            metadata={"pages": 1, "language": "pt"},
+            embeddings=embeddings,
+            source_id=f"bench-{index}"
+        )
+        elapsed += time.perf_counter() - start_time
+        chunks += len(texts)
+    return {
+        "documents": len(documents),
+        "chunks": chunks,
+        "seconds": elapsed,
+        "chunks_per_second": chunks / elapsed if elapsed else 0.0
+    }
+
+
+async def bench_search(api, queries: List[str], args) -> Dict[str, Any]:
+    vector_service = api.vector_service
+    query_embeddings = await vector_service.embed_queries(queries)
+    results: Dict[str, Any] = {}
+    
+    for mode in args.modes:
+        for top_k in args.top_k:
+            latencies = []
+            start_time = time.perf_counter()
+            for query, embedding in zip(queries, query_embeddings):
+                query_start = time.perf_counter()
+                await vector_service.search_similar(query, top_k=top_k, query_embedding=embedding, mode=mode)
+                latencies.append(time.perf_counter() - query_start)
+            results[f"{mode}/k{top_k}"] = latency_summary(latencies, time.perf_counter() - start_time)
+    
+    # Lote contra laço, no modo padrão e no primeiro top_k
+    top_k = args.top_k[0]
+    start_time = time.perf_counter()
+    await vector_service.search_batch(queries, top_k=top_k, query_embeddings=query_embeddings)
+    batch = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for query, embedding in zip(queries, query_embeddings):
+        await vector_service.search_similar(query, top_k=top_k, query_embedding=embedding)
+    loop = time.perf_counter() - start_time
+    results["batch_vs_loop"] = {
+        "queries": len(queries),
+        "batch_seconds": batch,
+        "loop_seconds": loop,
+        "speedup": loop / batch if batch else 0.0
+    }
+    return results
+
+
+async def bench_chat(api, queries: List[str], args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    
+    async def timed(request, latencies: List[float], semaphore: asyncio.Semaphore):
+        async with semaphore:
+            start_time = time.perf_counter()
+            await api.chat_endpoint(request)
+            latencies.append(time.perf_counter() - start_time)
+    
+    for concurrency in args.concurrency:
+        latencies: List[float] = []
+        semaphore = asyncio.Semaphore(concurrency)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(
+            timed(api.ChatRequest(message=query), latencies, semaphore)
+            for query in queries[:args.chat_requests]
+        ))
+        results[f"c{concurrency}"] = latency_summary(latencies, time.perf_counter() - start_time)
+    
+    # /chat/batch contra o laço de /chat com a mesma concorrência de completions
+    messages = queries[:args.chat_requests]
+    start_time = time.perf_counter()
+    await api.chat_batch_endpoint(api.BatchChatRequest(messages=messages))
+    batch = time.perf_counter() - start_time
+    semaphore = asyncio.Semaphore(api.settings.chat_batch_concurrency)
+    start_time = time.perf_counter()
+    await asyncio.gather(*(timed(api.ChatRequest(message=message), [], semaphore) for message in messages))
+    loop = time.perf_counter() - start_time
+    results["batch_vs_loop"] = {
+        "messages": len(messages),
+        "batch_seconds": batch,
+        "loop_seconds": loop,
+        "speedup": loop / batch if batch else 0.0
+    }
+    return results
+
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    old, new = flatten(previous["results"]), flatten(current["results"])
+    if not old.keys() & new.keys():
+        print("\nNenhuma métrica em comum com a execução anterior (tamanhos de corpus diferentes?)")
+        return
+    print(f"\n{'métrica':<60} {'antes':>12} {'agora':>12} {'variação':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<60} {old[key]:>12.2f} {new[key]:>12.2f} {change:>+8.1f}%")
+
+
+async def main_async(args) -> Dict[str, Any]:
+    fake = create_app(
+        latency_ms=args.latency_ms,
+        per_input_ms=args.per_input_ms,
+        max_concurrent=args.max_concurrent,
+        chat_latency_ms=args.chat_latency_ms,
+        per_token_ms=args.per_token_ms,
+        completion_tokens=args.completion_tokens
+    )
+    runner = await start(fake, args.port)
+    
+    # A API lê a configuração na importação
+    api = importlib.import_module("main")
+    queries = make_queries(args.queries, args.seed + 1)
+    report = {"config": vars(args), "environment": environment(), "results": {}}
+    documents = 0
+    
+    try:
+        for target in sorted(args.chunks):
+            target_documents = -(-target // args.chunks_per_doc)
+            step = await ingest(api, range(documents, target_documents), args)
+            documents = target_documents
+            print(f"\n== {documents * args.chunks_per_doc} chunks ({documents} documentos)")
+            print(f"ingestão: {step['chunks']} chunks em {step['seconds']:.1f}s = {step['chunks_per_second']:,.0f} chunks/s")
+            
+            search = await bench_search(api, queries, args)
+            for key, summary in search.items():
+                if key != "batch_vs_loop":
+                    print(f"busca {key:<14} p50={summary['p50_ms']:.2f}ms p99={summary['p99_ms']:.2f}ms")
+            print(f"busca em lote: {search['batch_vs_loop']['speedup']:.1f}x mais rápida que o laço")
+            
+            memory = {
+                "rss_bytes": process_resident_bytes(),
+                "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                "disk_bytes": disk_usage(args.data_dir)
+            }
+            print(
+                f"memória: RSS {memory['rss_bytes'] / 2**20:,.0f} MB "
+                f"(pico {memory['peak_rss_bytes'] / 2**20:,.0f} MB), disco {memory['disk_bytes'] / 2**20:,.0f} MB"
+            )
+            
+            result = {
+                "documents": documents,
+                "ingest": step,
+                "search": search,
+                "memory": memory,
+                "index": api.vector_service.index_stats()
+            }
+            if args.chat_requests:
+                result["chat"] = await bench_chat(api, queries, args)
+                for key, summary in result["chat"].items():
+                    if key != "batch_vs_loop":
+                        print(f"chat {key:<5} p50={summary['p50_ms']:.0f}ms p99={summary['p99_ms']:.0f}ms {summary['per_second']:.1f} req/s")
+                print(f"chat em lote: {result['chat']['batch_vs_loop']['speedup']:.1f}x mais rápido que o laço")
+            report["results"][str(documents * args.chunks_per_doc)] = result
+    finally:
+        api.job_queue.close()
+        api.vector_service.close()
+        await runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000, 100000], help="tamanhos do corpus")
+    parser.add_argument("--chunks-per-doc", type=int, default=100)
+    parser.add_argument("--words", type=int, default=150, help="palavras por chunk")
+    parser.add_argument("--embeddings", choices=["local", "api"], default="local",
+                        help="local: vetores calculados aqui; api: gerados pelo provedor na ingestão")
+    parser.add_argument("--local-model-dir", help="modelo ONNX local (EMBEDDING_PROVIDER=local) em vez do servidor falso")
+    parser.add_argument("--local-quantization", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--chat-requests", type=int, default=50, help="0 = sem o benchmark do chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--answer-cache", action="store_true", help="manter o cache de respostas ligado")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latência dos embeddings")
+    parser.add_argument("--per-input-ms", type=float, default=0.05)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--chat-latency-ms", type=float, default=100.0)
+    parser.add_argument("--per-token-ms", type=float, default=1.0)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", help="diretório dos dados (padrão: temporário, removido no fim)")
+    parser.add_argument("--output", help="arquivo JSON com o resultado")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+    
+    keep_data = bool(args.data_dir)
+    args.data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench_rag_")
+    os.environ.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.port}/v1",
+        "CHROMA_PATH": os.path.join(args.data_dir, "chroma_db"),
+        "FAISS_DATA_DIR": os.path.join(args.data_dir, "faiss_data"),
+        "LEXICAL_DATA_DIR": os.path.join(args.data_dir, "lexical_data"),
+        "EMBEDDING_CACHE_PATH": os.path.join(args.data_dir, "embedding_cache", "embeddings.db"),
+        "DOCUMENT_CATALOG_PATH": os.path.join(args.data_dir, "processed_texts", "catalog.db"),
+        "PROCESSED_TEXTS_PATH": os.path.join(args.data_dir, "processed_texts"),
+        "JOBS_DB_PATH": os.path.join(args.data_dir, "jobs", "jobs.db"),
+        "JOBS_SPOOL_DIR": os.path.join(args.data_dir, "jobs", "spool"),
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false"
+    })
+    if args.local_model_dir:
+        os.environ.update({
+            "EMBEDDING_PROVIDER": "local",
+            "LOCAL_EMBEDDING_MODEL_DIR": args.local_model_dir,
+            "LOCAL_EMBEDDING_QUANTIZATION": args.local_quantization
+        })
+    
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        if not keep_data:
+            shutil.rmtree(args.data_dir, ignore_errors=True)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
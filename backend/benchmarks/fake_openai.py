@@ -0,0 +1,166 @@
+"""Servidor local que imita as APIs de embeddings e de chat da OpenAI.
+
+Gera vetores determinísticos (a partir do hash do texto) com latência
+configurável e devolve 429 com Retry-After quando o número de requisições
+simultâneas passa do limite, para exercitar o agendador de embeddings sem
+gastar com a API real. O chat completions (com e sem stream) responde um
+texto fixo de completion_tokens palavras, com latência inicial mais um
+custo por token.
+
+Uso:
+    python benchmarks/fake_openai.py --port 8900 --max-concurrent 4
+    OPENAI_BASE_URL=http://localhost:8900/v1 OPENAI_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+import numpy as np
+from aiohttp import web
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def create_app(
+    dim: int = 1536,
+    latency_ms: float = 50.0,
+    per_input_ms: float = 0.2,
+    max_concurrent: int = 0,
+    retry_after: float = 0.5,
+    chat_latency_ms: float = 300.0,
+    per_token_ms: float = 5.0,
+    completion_tokens: int = 200
+) -> web.Application:
+    """Aplicação aiohttp com POST /v1/embeddings e /v1/chat/completions
+    (max_concurrent=0 desliga o 429 dos embeddings)"""
+    state = {"in_flight": 0, "requests": 0, "inputs": 0, "rate_limited": 0, "chat_requests": 0}
+    
+    async def embeddings(request: web.Request) -> web.Response:
+        if max_concurrent and state["in_flight"] >= max_concurrent:
+            state["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": str(retry_after)}
+            )
+        
+        state["in_flight"] += 1
+        try:
+            body = await request.json()
+            inputs = body["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            await asyncio.sleep((latency_ms + per_input_ms * len(inputs)) / 1000)
+        finally:
+            state["in_flight"] -= 1
+        
+        state["requests"] += 1
+        state["inputs"] += len(inputs)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, body.get("dimensions", dim))}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        })
+    
+    async def chat_completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        state["chat_requests"] += 1
+        model = body.get("model", "gpt-4")
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body["messages"])
+        words = [f"palavra{i % 100}" for i in range(completion_tokens)]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        base = {"id": f"chatcmpl-{state['chat_requests']}", "created": int(time.time()), "model": model}
+        
+        await asyncio.sleep(chat_latency_ms / 1000)
+        if not body.get("stream"):
+            await asyncio.sleep(per_token_ms * completion_tokens / 1000)
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        
+        async def send(delta: dict, finish_reason=None) -> None:
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        
+        await send({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            await asyncio.sleep(per_token_ms / 1000)
+            await send({"content": word if i == 0 else f" {word}"})
+        await send({}, finish_reason="stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(state)
+    
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app["state"] = state
+    app.router.add_post("/v1/embeddings", embeddings)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+async def start(app: web.Application, port: int) -> web.AppRunner:
+    """Sobe o servidor no event loop atual; encerrar com runner.cleanup()"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--per-input-ms", type=float, default=0.2)
+    parser.add_argument("--max-concurrent", type=int, default=0, help="requisições simultâneas antes do 429")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0, help="latência até o primeiro token do chat")
+    parser.add_argument("--per-token-ms", type=float, default=5.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+    
+    app = create_app(
+        args.dim,
+        args.latency_ms,
+        args.per_input_ms,
+        args.max_concurrent,
+        chat_latency_ms=args.chat_latency_ms,
+        per_token_ms=args.per_token_ms,
+        completion_tokens=args.completion_tokens
+    )
+    web.run_app(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
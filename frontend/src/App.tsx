@@ -47,28 +47,37 @@ function App() {
     }
   };
 
-  const monitorJob = async (jobId: string) => {
-    const checkStatus = async () => {
-      try {
-        const status = await apiService.getJobStatus(jobId);
-        setJobs(prev => prev.map(job => 
-          job.id === jobId ? { ...job, ...status } : job
-        ));
-
-        if (status.status === 'completed') {
-          loadDocuments();
-          return;
-        }
+  const monitorJob = (jobId: string) => {
+    const updateJob = (changes: Partial<Job>) => {
+      setJobs(prev => prev.map(job => 
+        job.id === jobId ? { ...job, ...changes } : job
+      ));
+    };
 
-        if (status.status === 'processing') {
-          setTimeout(checkStatus, 2000);
-        }
-      } catch (error) {
-        console.error('Erro ao monitorar job:', error);
-      }
+    // Eventos do job por SSE, sem polling de /job-status; se a conexão cair,
+    // o EventSource reconecta e continua do último evento recebido
+    const events = new EventSource(apiService.getJobEventsUrl(jobId));
+    const listen = (name: string, handler: (data: any) => void) => {
+      events.addEventListener(name, (event) => handler(JSON.parse((event as MessageEvent).data)));
     };
 
-    checkStatus();
+    listen('stage_started', (data) => updateJob({ stage: data.stage, progress: data.progress }));
+    listen('stage_failed', (data) => updateJob({ error: data.error }));
+    listen('completed', (data) => {
+      events.close();
+      updateJob({
+        status: 'completed',
+        progress: 100,
+        error: undefined,
+        document_id: data.document_id,
+        chunk_count: data.chunk_count
+      });
+      loadDocuments();
+    });
+    listen('failed', (data) => {
+      events.close();
+      updateJob({ status: 'error', error: data.error });
+    });
   };
 
   return (
@@ -29,6 +29,10 @@ export const apiService = {
     return response.data;
   },
 
+  getJobEventsUrl(jobId: string): string {
+    return `${API_BASE_URL}/job-events/${jobId}`;
+  },
+
   async getDocuments(): Promise<Document[]> {
     const response = await api.get('/documents');
     return response.data;
@@ -11,6 +11,7 @@ export interface Job {
   id: string;
   filename: string;
   status: 'processing' | 'completed' | 'error';
+  stage?: string;
   progress: number;
   document_id?: string;
   chunk_count?: number;